@@ -0,0 +1,201 @@
+"""
+Versión asíncrona del Sistema RAG Legal
+
+Usa cohere.AsyncClient para embed, rerank y chat, de modo que un único
+proceso puede atender muchas consultas concurrentes sin bloquear el event loop.
+La carga de documentos y la construcción del índice se hacen una sola vez
+con el cliente síncrono heredado de LegalRAGSystem.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import cohere
+import numpy as np
+
+from rag_system import LegalRAGSystem
+from utils.clients import AsyncCohereClient
+from utils.document_loader import Document
+from utils.hits import SearchHits
+from utils.log import BANNER, get_logger
+from utils.metrics import QueryTrace, activate
+from utils.rerank_policy import skip_decision
+
+
+logger = get_logger("async_rag_system")
+
+class AsyncLegalRAGSystem(LegalRAGSystem):
+    """
+    Gemelo asíncrono de LegalRAGSystem: mismo índice y cachés, llamadas de red con await
+    """
+
+    def __init__(self, api_key: str, async_client: Optional[AsyncCohereClient] = None, **kwargs):
+        """
+        Args:
+            api_key: API key de Cohere
+            async_client: Cliente con la interfaz de cohere.AsyncClient, p. ej.
+                AsyncFakeCohereClient (None usa el de la sesión HTTP o, si se
+                pasó client sin session, crea cohere.AsyncClient(api_key))
+            **kwargs: Mismos parámetros opcionales que LegalRAGSystem
+        """
+        super().__init__(api_key, **kwargs)
+        if async_client is None:
+            async_client = self.session.async_client if self.session is not None else cohere.AsyncClient(api_key)
+        self.async_client: AsyncCohereClient = async_client
+
+    async def _aembed_query(self, query: str) -> np.ndarray:
+        """
+        Obtiene el embedding de una query sin bloquear el event loop (con caché LRU + TTL)
+        """
+        with self._stage("query_embed"):
+            key = self._query_cache_key(query)
+            query_embedding = self.query_cache.get(key)
+            if query_embedding is None:
+                query_response = await self.async_client.embed(
+                    texts=[query],
+                    model=self.embed_model,
+                    input_type="search_query",
+                    embedding_types=["float"]
+                )
+                self._record_usage("embed", query_response)
+                query_embedding = np.asarray(query_response.embeddings.float[0], dtype=np.float32)
+                self.query_cache.put(key, query_embedding)
+        return query_embedding
+
+    async def _asemantic_search(self, query: str, top_n: int = 20,
+                                query_embedding: Optional[np.ndarray] = None) -> SearchHits:
+        """
+        PASO 1 (async): Búsqueda semántica usando embeddings de Cohere
+        """
+        logger.info("🔍 [Paso 1] Búsqueda semántica con embeddings...")
+
+        if self.index is None:
+            logger.warning("   ⚠️  No hay embeddings generados. Usa load_documents_from_folder() primero.")
+            return SearchHits.empty()
+
+        if query_embedding is None:
+            query_embedding = await self._aembed_query(query)
+
+        return self._candidates_from_embedding(query_embedding, top_n)
+
+    async def _aretrieve(self, query: str, top_n: int = 20,
+                         query_embedding: Optional[np.ndarray] = None) -> SearchHits:
+        """
+        PASO 1 (async) según retrieval_mode; solo el embedding de la query usa la red
+        """
+        if self.retrieval_mode == "vector":
+            return await self._asemantic_search(query, top_n=top_n, query_embedding=query_embedding)
+        if self.retrieval_mode == "hybrid" and query_embedding is None:
+            query_embedding = await self._aembed_query(query)
+        return self._retrieve(query, top_n=top_n, query_embedding=query_embedding)
+
+    async def _arerank_documents(self, query: str, documents: Sequence[Document], top_k: int = 5) -> List[Dict]:
+        """
+        PASO 2 (async): Reordena documentos usando Cohere Rerank (con caché)
+        """
+        logger.info("\n🎯 [Paso 2] Reranking con Cohere...")
+
+        with self._stage("rerank"):
+            cache_key = self._rerank_cache_key(query, documents, top_k)
+            ranking = self.rerank_cache.get(cache_key)
+            if ranking is not None:
+                logger.info("   → Resultado de rerank recuperado de la caché")
+            else:
+                rerank_response = await self.async_client.rerank(
+                    model=self.rerank_model,
+                    query=query,
+                    documents=[doc.content for doc in documents],
+                    top_n=top_k,
+                    return_documents=False
+                )
+                self._record_usage("rerank", rerank_response)
+                ranking = [(result.index, result.relevance_score) for result in rerank_response.results]
+                self.rerank_cache.put(cache_key, ranking)
+
+        return self._build_reranked_docs(documents, ranking)
+
+    async def _arerank_step(self, query: str, candidates: SearchHits, top_k: int = 5) -> tuple:
+        """
+        PASO 2 (async) con la política adaptativa de rerank
+        """
+        decision = self._rerank_decision(candidates, top_k)
+        if decision['action'] == "skip":
+            return self._semantic_order(candidates, top_k, decision), decision
+        return await self._arerank_documents(query, candidates[:decision['sent']], top_k=top_k), decision
+
+    async def _agenerate_response(self, query: str, context_docs: List[Dict]) -> str:
+        """
+        PASO 3 (async): Genera respuesta usando Command R+ con contexto
+        """
+        logger.info("\n🤖 [Paso 3] Generando respuesta con %s...", self.model)
+
+        with self._stage("prompt_build"):
+            prompt = self._build_prompt(query, context_docs)
+
+        with self._stage("chat"):
+            response = await self.async_client.chat(
+                model=self.model,
+                message=prompt,
+                temperature=0.3,
+            )
+        self._record_usage("chat", response)
+
+        return response.text
+
+    async def aquery(self, query: str, top_k: int = 5, initial_candidates: int = 20, structured: bool = False) -> Dict:
+        """
+        Método principal asíncrono: procesa una consulta completa
+
+        Args:
+            query: Pregunta del usuario
+            top_k: Número de documentos top después de rerank
+            initial_candidates: Número de candidatos iniciales (búsqueda semántica)
+            structured: Si True, usa Pydantic AI para respuestas estructuradas
+
+        Returns:
+            Diccionario con respuesta y metadatos (mismo formato que LegalRAGSystem.query)
+        """
+        if structured:
+            from legal_agent import arun_legal_agent
+            return await arun_legal_agent(self, query)
+        # Cada tarea de asyncio tiene su propio contexto: las consultas concurrentes no comparten traza
+        trace = QueryTrace()
+        with activate(trace), self._stage("total"):
+            result = await self._arun_query(query, top_k, initial_candidates)
+        return self._attach_trace(result, trace)
+
+    async def _arun_query(self, query: str, top_k: int, initial_candidates: int) -> Dict:
+        """Pasos 1 a 3 de aquery() (dentro de la traza activa)"""
+        logger.info("\n%s\nCONSULTA: %s\n%s", BANNER, query, BANNER)
+
+        not_ready = self._check_ready(query)
+        if not_ready is not None:
+            return not_ready
+
+        # Citas explícitas ("Art. 189"): pasajes exactos, sin embeddings ni rerank
+        query_embedding = None
+        cache_params = (self.model, top_k, initial_candidates, self.retrieval_mode)
+        reranked_docs = self._lookup_citations(query, top_k)
+        rerank_decision = skip_decision("exact_citation", len(reranked_docs or []))
+        if reranked_docs is None:
+            # PASO 1: Búsqueda de candidatos (embeddings, BM25 o ambos)
+            if self.retrieval_mode != "lexical":
+                query_embedding = await self._aembed_query(query)
+
+            cached = self._lookup_cached_answer(query, query_embedding, cache_params)
+            if cached is not None:
+                return cached
+
+            candidates = await self._aretrieve(query, top_n=initial_candidates, query_embedding=query_embedding)
+
+            # PASO 2: Rerank
+            reranked_docs, rerank_decision = await self._arerank_step(query, candidates, top_k=top_k)
+
+        # PASO 3: Generar respuesta (con el contexto ajustado al presupuesto de tokens)
+        context_docs, context_stats = self._pack_context(reranked_docs)
+        answer = await self._agenerate_response(query, context_docs)
+
+        logger.info("\n%s\nRESPUESTA FINAL:\n%s\n", BANNER, BANNER)
+
+        result = self._make_result(query, answer, context_docs, context_stats, rerank_decision)
+        self._store_answer(query_embedding, cache_params, result)
+
+        return result
@@ -0,0 +1,278 @@
+"""
+Benchmark offline del Sistema RAG Legal (sin API key ni red)
+
+Genera corpus sintéticos de N chunks, los indexa con FakeCohereClient y mide:
+tiempo de carga, memoria, latencia por consulta (p50/p95/p99), throughput
+secuencial y concurrente, y la mediana de cada etapa del pipeline.
+
+Cada tamaño se mide en un proceso nuevo para que la memoria pico no arrastre
+la del tamaño anterior. El resultado es un JSON comparable entre commits:
+
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --baseline bench_anterior.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.document_loader import Document
+
+
+# Vocabulario para el texto sintético (términos procesales frecuentes en el corpus real)
+_SUJETOS = ["el demandado", "la parte apelante", "el tribunal", "el juez de letras", "la Corte de Apelaciones",
+            "el recurrente", "el ministro de fe", "la parte demandante", "el receptor judicial", "el árbitro"]
+_ACCIONES = ["deberá notificar", "podrá apelar", "interpondrá el recurso", "fijará el plazo", "dictará sentencia",
+             "certificará la notificación", "admitirá a tramitación", "declarará inadmisible", "suspenderá la ejecución",
+             "ordenará el cumplimiento"]
+_OBJETOS = ["la sentencia definitiva", "la resolución interlocutoria", "el recurso de casación en la forma",
+            "la demanda ejecutiva", "el recurso de reposición", "el escrito de contestación", "la medida precautoria",
+            "el recurso de queja", "la cosa juzgada", "el término probatorio"]
+_CIRCUNSTANCIAS = ["dentro de diez días hábiles", "desde la notificación por cédula", "en el efecto devolutivo",
+                   "sin perjuicio de lo dispuesto en este título", "con citación de la contraparte",
+                   "bajo sanción de nulidad", "en única instancia", "en los días feriados legales",
+                   "cuando la ley no disponga otra cosa", "previa consignación de la multa"]
+_MATERIAS = ["Procedimiento Civil", "Procedimiento Penal", "Procedimiento Laboral", "Tribunales", "Comercio",
+             "Familia", "Aguas", "Minería"]
+
+ARTICLES_PER_DOCUMENT = 20
+
+
+def _frase(rng: random.Random) -> str:
+    return f"{rng.choice(_SUJETOS).capitalize()} {rng.choice(_ACCIONES)} {rng.choice(_OBJETOS)} {rng.choice(_CIRCUNSTANCIAS)}."
+
+
+def generar_corpus(n_chunks: int, seed: int = 0) -> List[Document]:
+    """
+    Documentos Markdown sintéticos con ~n_chunks artículos (un chunk por artículo)
+
+    Cada documento es un código con ARTICLES_PER_DOCUMENT artículos de 3 a 6
+    frases; el resultado es el mismo para la misma semilla.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for doc_id in range(math.ceil(n_chunks / ARTICLES_PER_DOCUMENT)):
+        articles = min(ARTICLES_PER_DOCUMENT, n_chunks - doc_id * ARTICLES_PER_DOCUMENT)
+        materia = _MATERIAS[doc_id % len(_MATERIAS)]
+        lines = [f"# Código de {materia} {doc_id} - Texto sintético", ""]
+        for article in range(1, articles + 1):
+            lines.append(f"### Artículo {article}")
+            lines.append(" ".join(_frase(rng) for _ in range(rng.randint(3, 6))))
+            lines.append("")
+        content = "\n".join(lines)
+        documents.append(Document(content=content, metadata={
+            'source': f"sintetico_{doc_id:05d}.md",
+            'path': f"sintetico/sintetico_{doc_id:05d}.md",
+            'size': len(content)
+        }))
+    return documents
+
+
+def generar_consultas(n_queries: int, seed: int = 1) -> List[str]:
+    """Consultas en lenguaje natural sobre el vocabulario del corpus (sin citas de artículos)"""
+    rng = random.Random(seed)
+    return [f"¿Cuándo {rng.choice(_SUJETOS)} {rng.choice(_ACCIONES)} {rng.choice(_OBJETOS)}?" for _ in range(n_queries)]
+
+
+def _percentiles_ms(values: List[float]) -> Dict[str, float]:
+    array = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        'mean': round(float(array.mean()), 3),
+        'p50': round(float(np.percentile(array, 50)), 3),
+        'p95': round(float(np.percentile(array, 95)), 3),
+        'p99': round(float(np.percentile(array, 99)), 3),
+    }
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Memoria residente pico del proceso en MB (None si la plataforma no la informa)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def medir_tamano(n_chunks: int, config: Dict) -> Dict:
+    """
+    Indexa un corpus sintético de n_chunks y mide carga, memoria y consultas
+
+    Se ejecuta en un proceso hijo (ver ejecutar_benchmark).
+    """
+    from rag_system import LegalRAGSystem
+    from utils.fake_cohere import FakeCohereClient
+    from utils.log import configure_logging
+    from utils.metrics import MetricsRegistry
+
+    configure_logging("silent")
+    client = FakeCohereClient(dim=config['dim'], latency=config['latency'], jitter=config['jitter'], seed=config['seed'])
+    # Sin cachés: cada consulta recorre el pipeline completo
+    rag = LegalRAGSystem(
+        api_key="", client=client, cache_dir=None, query_cache_size=0, rerank_cache_size=0,
+        index_type=config['index_type'], embedding_precision=config['precision'],
+        retrieval_mode=config['retrieval_mode'], embed_max_workers=config['embed_workers']
+    )
+    documents = generar_corpus(n_chunks, seed=config['seed'])
+    queries = generar_consultas(config['queries'], seed=config['seed'] + 1)
+
+    start = time.perf_counter()
+    rag.add_documents(documents)
+    load_seconds = time.perf_counter() - start
+    load_rss = _peak_rss_mb()
+
+    for query in queries[:config['warmup']]:
+        rag.query(query, top_k=config['top_k'], initial_candidates=config['candidates'])
+    # Los histogramas por etapa solo cuentan las consultas medidas
+    rag.metrics = MetricsRegistry()
+
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        rag.query(query, top_k=config['top_k'], initial_candidates=config['candidates'])
+        latencies.append(time.perf_counter() - query_start)
+    sequential_seconds = time.perf_counter() - start
+    stages = rag.metrics.summary("rag_stage_seconds", "stage")
+
+    start = time.perf_counter()
+    rag.query_many(queries, top_k=config['top_k'], initial_candidates=config['candidates'],
+                   max_concurrency=config['concurrency'])
+    concurrent_seconds = time.perf_counter() - start
+
+    return {
+        'chunks': len(rag.chunks),
+        'documents': len(rag.documents),
+        'load_seconds': round(load_seconds, 3),
+        'index_mb': round(rag.index.nbytes / 1e6, 1),
+        'peak_rss_mb_after_load': load_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+        'queries': len(queries),
+        'latency_ms': _percentiles_ms(latencies),
+        'throughput_qps': {
+            'sequential': round(len(queries) / sequential_seconds, 2),
+            'concurrent': round(len(queries) / concurrent_seconds, 2),
+        },
+        'stages_ms': {stage: {'p50': round(s['p50'] * 1000, 3), 'p99': round(s['p99'] * 1000, 3)}
+                      for stage, s in sorted(stages.items())},
+        'api_calls': dict(client.calls),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar_benchmark(sizes: List[int], config: Dict, isolate: bool = True) -> Dict:
+    """
+    Mide cada tamaño de corpus y arma el informe JSON
+
+    Args:
+        sizes: Números de chunks sintéticos
+        config: Parámetros del sistema y de la carga (ver main)
+        isolate: Medir cada tamaño en un proceso nuevo (memoria pico independiente)
+    """
+    results = []
+    for n_chunks in sizes:
+        print(f"⏱️  {n_chunks} chunks...", flush=True)
+        if isolate:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(medir_tamano, n_chunks, config).result()
+        else:
+            result = medir_tamano(n_chunks, config)
+        latency = result['latency_ms']
+        print(f"   carga {result['load_seconds']:.2f}s | p50 {latency['p50']:.2f} ms | p99 {latency['p99']:.2f} ms | "
+              f"{result['throughput_qps']['sequential']:.1f} consultas/s | RSS {result['peak_rss_mb']} MB")
+        results.append(result)
+    return {
+        'benchmark': "legal_rag",
+        'schema_version': 1,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'config': config,
+        'results': results,
+    }
+
+
+def comparar(report: Dict, baseline: Dict) -> List[str]:
+    """
+    Líneas con la variación respecto a un informe anterior (mismos tamaños de corpus)
+    """
+    previous = {result['chunks']: result for result in baseline.get('results', [])}
+    lines = [f"Comparación con {baseline.get('git_commit') or 'baseline'}:"]
+    for result in report['results']:
+        old = previous.get(result['chunks'])
+        if old is None:
+            continue
+        changes = []
+        for label, new_value, old_value in (
+            ("carga", result['load_seconds'], old['load_seconds']),
+            ("p50", result['latency_ms']['p50'], old['latency_ms']['p50']),
+            ("p99", result['latency_ms']['p99'], old['latency_ms']['p99']),
+            ("qps", result['throughput_qps']['sequential'], old['throughput_qps']['sequential']),
+        ):
+            change = (new_value / old_value - 1) * 100 if old_value else float('nan')
+            changes.append(f"{label} {change:+.1f}%")
+        lines.append(f"   {result['chunks']} chunks: " + ", ".join(changes))
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del Sistema RAG Legal")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Chunks sintéticos por corpus")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas medidas por corpus")
+    parser.add_argument("--warmup", type=int, default=5, help="Consultas de calentamiento (no se miden)")
+    parser.add_argument("--dim", type=int, default=1024, help="Dimensiones de los embeddings simulados")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia simulada por llamada a la API (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación aleatoria máxima de la latencia (s)")
+    parser.add_argument("--index-type", default="flat", choices=["flat", "ivf"])
+    parser.add_argument("--precision", default="float32", choices=["float32", "float16", "int8", "binary"])
+    parser.add_argument("--retrieval-mode", default="vector", choices=["vector", "hybrid", "lexical"])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="max_concurrency de query_many")
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--no-isolate", action="store_true", help="Medir todos los tamaños en este proceso")
+    args = parser.parse_args(argv)
+
+    config = {
+        'queries': args.queries, 'warmup': args.warmup, 'dim': args.dim, 'latency': args.latency,
+        'jitter': args.jitter, 'index_type': args.index_type, 'precision': args.precision,
+        'retrieval_mode': args.retrieval_mode, 'top_k': args.top_k, 'candidates': args.candidates,
+        'concurrency': args.concurrency, 'embed_workers': args.embed_workers, 'seed': args.seed,
+    }
+    report = ejecutar_benchmark(args.sizes, config, isolate=not args.no_isolate)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print("\n".join(comparar(report, json.load(f))))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Este script muestra cómo integrar el sistema RAG en tus propios proyectos
 import os
 from dotenv import load_dotenv
 from rag_system import LegalRAGSystem
+from utils.log import configure_logging
 import json
 
 
@@ -76,16 +77,17 @@ def ejemplo_multiples_consultas():
         "¿Qué es el efecto devolutivo de la apelación?"
     ]
     
+    # Un solo embed para todas las consultas; rerank y generación en paralelo
     resultados = []
-    for consulta in consultas:
-        print(f"\n🔍 Procesando: {consulta}")
-        resultado = rag.query(consulta, top_k=2)
+    for resultado in rag.query_many(consultas, top_k=2, max_concurrency=3):
         resultados.append({
-            'consulta': consulta,
+            'consulta': resultado['query'],
             'respuesta': resultado['answer'],
-            'num_docs': len(resultado['context_docs'])
+            'num_docs': len(resultado['context_docs']),
+            'error': resultado.get('error')
         })
-        print("✅ Completado")
+        estado = "❌ Error" if resultado.get('error') else "✅ Completado"
+        print(f"{estado}: {resultado['query']}")
     
     # Guardar resultados
     with open('resultados_batch.json', 'w', encoding='utf-8') as f:
@@ -121,6 +123,7 @@ def ejemplo_comparacion_modelos():
 
 
 if __name__ == "__main__":
+    configure_logging()
     print("🎓 EJEMPLOS AVANZADOS DEL SISTEMA RAG")
     print("Nota: Estos ejemplos consumen API credits. Usa con moderación.")
     
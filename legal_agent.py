@@ -6,22 +6,31 @@ Este módulo implementa un agente inteligente que utiliza:
 - Cohere como proveedor de LLM
 - Tools para búsqueda de documentos legales via RAG
 """
+import asyncio
 import os
 import json
 import re
+import threading
+import weakref
 from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.cohere import CohereModel
 from pydantic_ai.providers.cohere import CohereProvider
 
 from models import LegalAnswer
+from utils.cohere_session import CohereSession
+from utils.log import BANNER, get_logger
+from utils.metrics import QueryTrace, activate
 
 if TYPE_CHECKING:
     from rag_system import LegalRAGSystem
 
 
+logger = get_logger("legal_agent")
+
+
 @dataclass
 class LegalDeps:
     """Dependencias inyectadas al agente durante la ejecución"""
@@ -76,15 +85,24 @@ NO incluyas texto antes o después del JSON. Solo el JSON.
 
 
 # Crear el agente con modelo de Cohere (output_type=str para parseo manual)
-def create_legal_agent() -> Agent[LegalDeps, str]:
-    """Crea el agente legal con el modelo de Cohere"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    api_key = os.getenv("COHERE_API_KEY")
-    if not api_key:
-        raise ValueError("COHERE_API_KEY no encontrada en variables de entorno")
+def create_legal_agent(session: Optional[CohereSession] = None) -> Agent[LegalDeps, str]:
+    """
+    Crea el agente legal con el modelo de Cohere
 
-    model = CohereModel('command-r-plus-08-2024', provider=CohereProvider(api_key=api_key))
+    Args:
+        session: Sesión HTTP del sistema RAG; el agente comparte con él límites
+            de ritmo, reintentos y conexiones (None crea una con COHERE_API_KEY)
+    """
+    if session is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("COHERE_API_KEY")
+        if not api_key:
+            raise ValueError("COHERE_API_KEY no encontrada en variables de entorno")
+        session = CohereSession(api_key)
+
+    provider: CohereProvider = session.provider()
+    model = CohereModel('command-r-plus-08-2024', provider=provider)
 
     return Agent(
         model=model,
@@ -94,50 +112,83 @@ def create_legal_agent() -> Agent[LegalDeps, str]:
     )
 
 
-# Crear el agente (lazy initialization)
+# Crear el agente (lazy initialization): uno sin sesión propia y uno por sesión del sistema RAG
 legal_agent: Agent[LegalDeps, str] | None = None
+_agents_by_session: "weakref.WeakKeyDictionary[CohereSession, Agent[LegalDeps, str]]" = weakref.WeakKeyDictionary()
+_agents_lock = threading.Lock()
 
 
-def get_legal_agent() -> Agent[LegalDeps, str]:
-    """Obtiene o crea el agente legal"""
-    global legal_agent
-    if legal_agent is None:
-        legal_agent = create_legal_agent()
-        # Registrar la herramienta después de crear el agente
-        @legal_agent.tool
-        async def buscar_documentos(ctx: RunContext[LegalDeps]) -> str:
-            """
-            Busca documentos legales relevantes para la consulta del usuario.
-
-            Esta herramienta realiza:
-            1. Búsqueda semántica con embeddings de Cohere
-            2. Reranking para ordenar por relevancia
-
-            Returns:
-                Contexto formateado con los documentos más relevantes
-            """
-            rag = ctx.deps.rag_system
-            query = ctx.deps.query
-
-            # Paso 1: Búsqueda semántica
-            candidates = rag._semantic_search(query, top_n=15)
-
-            if not candidates:
-                return "No se encontraron documentos relevantes."
-
-            # Paso 2: Rerank
-            reranked_docs = rag._rerank_documents(query, candidates, top_k=5)
-
-            # Formatear contexto para el modelo
-            context_parts = []
-            for doc in reranked_docs:
-                context_parts.append(
-                    f"DOCUMENTO (Relevancia: {doc['score']:.2f}):\n{doc['content']}"
-                )
+def get_legal_agent(session: Optional[CohereSession] = None) -> Agent[LegalDeps, str]:
+    """
+    Obtiene o crea el agente legal de una sesión
 
-            return "\n\n---\n\n".join(context_parts)
+    Cada sesión tiene su agente (se libera con la sesión): dos sistemas RAG con
+    sesiones distintas no comparten límites ni conexiones a través del agente.
+    Sin sesión se usa un único agente con COHERE_API_KEY.
+    """
+    global legal_agent
+    with _agents_lock:
+        agent = legal_agent if session is None else _agents_by_session.get(session)
+        if agent is None:
+            agent = create_legal_agent(session)
+            _register_tools(agent)
+            if session is None:
+                legal_agent = agent
+            else:
+                _agents_by_session[session] = agent
+    return agent
+
+
+def _register_tools(agent: Agent[LegalDeps, str]):
+    """Registra las herramientas del agente"""
+    @agent.tool
+    async def buscar_documentos(ctx: RunContext[LegalDeps]) -> str:
+        """
+        Busca documentos legales relevantes para la consulta del usuario.
+
+        Esta herramienta realiza:
+        1. Búsqueda semántica con embeddings de Cohere
+        2. Reranking para ordenar por relevancia
+
+        Returns:
+            Contexto formateado con los documentos más relevantes
+        """
+        return await buscar_contexto(ctx.deps.rag_system, ctx.deps.query)
+
+
+async def buscar_contexto(rag_system: "LegalRAGSystem", query: str) -> str:
+    """
+    Recupera y formatea el contexto de la herramienta 'buscar_documentos'
 
-    return legal_agent
+    Con un AsyncLegalRAGSystem usa las llamadas asíncronas; con el sistema
+    síncrono ejecuta la búsqueda en un hilo para no bloquear el event loop.
+    """
+    cited = rag_system._lookup_citations(query, 5)
+    if cited is not None:
+        # Citas explícitas: pasajes exactos, sin búsqueda ni rerank
+        reranked_docs = cited
+    elif hasattr(rag_system, '_aretrieve'):
+        # Paso 1: Búsqueda de candidatos (según retrieval_mode)
+        candidates = await rag_system._aretrieve(query, top_n=15)
+        if not candidates:
+            return "No se encontraron documentos relevantes."
+        # Paso 2: Rerank
+        reranked_docs, _ = await rag_system._arerank_step(query, candidates, top_k=5)
+    else:
+        candidates = await asyncio.to_thread(rag_system._retrieve, query, 15)
+        if not candidates:
+            return "No se encontraron documentos relevantes."
+        reranked_docs, _ = await asyncio.to_thread(rag_system._rerank_step, query, candidates, 5)
+
+    # Ajustar al presupuesto de tokens y formatear contexto para el modelo
+    context_docs, _ = rag_system._pack_context(reranked_docs)
+    context_parts = []
+    for doc in context_docs:
+        context_parts.append(
+            f"DOCUMENTO (Relevancia: {doc['score']:.2f}):\n{doc['content']}"
+        )
+
+    return "\n\n---\n\n".join(context_parts)
 
 
 def parse_agent_response(raw_response: str) -> dict:
@@ -181,7 +232,7 @@ def parse_agent_response(raw_response: str) -> dict:
 
     except (json.JSONDecodeError, Exception) as e:
         # Fallback: devolver respuesta como texto plano
-        print(f"⚠️  No se pudo parsear JSON, usando respuesta como texto: {e}")
+        logger.warning("⚠️  No se pudo parsear JSON, usando respuesta como texto: %s", e)
         return {
             'answer': raw_response,
             'fuentes': [],
@@ -202,28 +253,56 @@ def run_legal_agent(rag_system: "LegalRAGSystem", query: str) -> dict:
     Returns:
         Diccionario con la respuesta estructurada
     """
-    print(f"\n{'='*60}")
-    print(f"🤖 CONSULTA (Pydantic AI): {query}")
-    print(f"{'='*60}")
+    # La traza da el ID de correlación a los logs del agente y de sus herramientas
+    trace = QueryTrace()
+    with activate(trace):
+        logger.info("\n%s\n🤖 CONSULTA (Pydantic AI): %s\n%s", BANNER, query, BANNER)
+
+        # Obtener el agente
+        agent = get_legal_agent(getattr(rag_system, 'session', None))
+
+        # Crear dependencias
+        deps = LegalDeps(rag_system=rag_system, query=query)
+
+        # Ejecutar agente de forma síncrona
+        result = agent.run_sync(query, deps=deps)
+
+        # Obtener respuesta como string
+        raw_response: str = result.output
 
-    # Obtener el agente
-    agent = get_legal_agent()
+        logger.info("\n%s\n✅ RESPUESTA ESTRUCTURADA:\n%s\n", BANNER, BANNER)
+
+        # Parsear respuesta
+        parsed = parse_agent_response(raw_response)
+    parsed['query'] = query
+    parsed['query_id'] = trace.query_id
+
+    return parsed
 
-    # Crear dependencias
-    deps = LegalDeps(rag_system=rag_system, query=query)
 
-    # Ejecutar agente de forma síncrona
-    result = agent.run_sync(query, deps=deps)
+async def arun_legal_agent(rag_system: "LegalRAGSystem", query: str) -> dict:
+    """
+    Ejecuta el agente legal de forma asíncrona (agent.run en lugar de run_sync).
+
+    Args:
+        rag_system: Instancia del sistema RAG (preferiblemente AsyncLegalRAGSystem)
+        query: Consulta del usuario
+
+    Returns:
+        Diccionario con la respuesta estructurada
+    """
+    trace = QueryTrace()
+    with activate(trace):
+        logger.info("\n%s\n🤖 CONSULTA (Pydantic AI, async): %s\n%s", BANNER, query, BANNER)
 
-    # Obtener respuesta como string
-    raw_response: str = result.output
+        agent = get_legal_agent(getattr(rag_system, 'session', None))
+        deps = LegalDeps(rag_system=rag_system, query=query)
 
-    print(f"\n{'='*60}")
-    print("✅ RESPUESTA ESTRUCTURADA:")
-    print(f"{'='*60}\n")
+        # Ejecutar agente sin bloquear el event loop
+        result = await agent.run(query, deps=deps)
 
-    # Parsear respuesta
-    parsed = parse_agent_response(raw_response)
+        parsed = parse_agent_response(result.output)
     parsed['query'] = query
+    parsed['query_id'] = trace.query_id
 
     return parsed
@@ -6,6 +6,7 @@ Ejecuta este script para ver el sistema en acción
 import os
 from dotenv import load_dotenv
 from rag_system import LegalRAGSystem
+from utils.log import configure_logging
 
 
 def mostrar_respuesta_estructurada(resultado: dict):
@@ -46,6 +47,8 @@ def main():
     """
     # Cargar variables de entorno
     load_dotenv()
+    # Mensajes del pipeline en consola (RAG_LOG_MODE=json o silent para cambiarlo)
+    configure_logging()
     api_key = os.getenv("COHERE_API_KEY")
     
     if not api_key:
@@ -119,13 +122,19 @@ def main():
             if not consulta:
                 continue
             
-            resultado = rag.query(
+            # La respuesta se imprime a medida que llegan los tokens
+            for evento in rag.query_stream(
                 query=consulta,
                 top_k=5,
                 initial_candidates=20
-            )
+            ):
+                if evento['type'] == 'delta':
+                    print(evento['text'], end="", flush=True)
+                else:
+                    tiempos = evento['timings']
+                    print(f"\n\n⏱️  Primer token: {tiempos['time_to_first_token']:.2f}s | "
+                          f"Generación total: {tiempos['generation_time']:.2f}s")
             
-            print(resultado['answer'])
             print("\n" + "-" * 60 + "\n")
 
     elif opcion == "3":
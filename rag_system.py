@@ -6,18 +6,55 @@ Este módulo implementa el flujo completo:
 2. Rerank con Cohere para ordenar por relevancia
 3. Generación de respuesta con Command R+ usando contexto
 """
-import cohere
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from typing import List, Dict, Optional
-from utils.document_loader import Document, DocumentLoader
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from utils.bm25 import BM25Index, reciprocal_rank_fusion
+from utils.document_loader import DEFAULT_IGNORE, Document, DocumentLoader, LoadReport
+from utils.cache import LRUCache, SemanticAnswerCache, normalize_query
+from utils.citations import CitationIndex, document_code
+from utils.clients import CohereClient
+from utils.cohere_session import CohereSession, is_transient
+from utils.context_packer import ContextPacker
+from utils.embedding_cache import EmbeddingCache, content_hash
+from utils.hits import SearchHits
+from utils.log import BANNER, get_logger
+from utils.metrics import MetricsRegistry, QueryTrace, activate, current_trace, response_usage
+from utils.rerank_policy import RerankPolicy, skip_decision
+from utils.text_store import TextStore
+from utils.vector_index import VectorIndex, create_index
+
 
+logger = get_logger("rag_system")
 
 class LegalRAGSystem:
     """
     Sistema completo de RAG para consultas legales con búsqueda semántica
     """
+
+    RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
     
-    def __init__(self, api_key: str, model: str = "command-r-plus", embed_model: str = "embed-multilingual-v3.0"):
+    def __init__(self, api_key: str, model: str = "command-r-plus", embed_model: str = "embed-multilingual-v3.0",
+                 cache_dir: Optional[str] = ".embeddings_cache", embed_batch_size: int = 96,
+                 embed_max_workers: int = 4, embed_max_retries: int = 3,
+                 query_cache_size: int = 1024, query_cache_ttl: Optional[float] = 3600,
+                 rerank_model: str = "rerank-v3.5", rerank_cache_size: int = 512,
+                 answer_cache_threshold: Optional[float] = None, answer_cache_size: int = 256,
+                 chunk_size: Optional[int] = 1000, text_store_path: Optional[str] = None,
+                 context_max_tokens: Optional[int] = 3000,
+                 index_type: str = "flat", index_params: Optional[Dict] = None,
+                 embedding_precision: str = "float32", compact_threshold: float = 0.25,
+                 retrieval_mode: str = "vector", rrf_k: int = 60, citation_lookup: bool = True,
+                 adaptive_rerank: bool = True, rerank_policy: Optional[RerankPolicy] = None,
+                 metrics: Optional[MetricsRegistry] = None, client: Optional[CohereClient] = None,
+                 session: Optional[CohereSession] = None):
         """
         Inicializa el sistema RAG
         
@@ -25,156 +62,818 @@ class LegalRAGSystem:
             api_key: API key de Cohere
             model: Modelo a usar para generación (command-r-plus o command-r)
             embed_model: Modelo de embeddings (embed-multilingual-v3.0 recomendado para español)
+            cache_dir: Carpeta de la caché persistente de embeddings (None para desactivarla)
+            embed_batch_size: Textos por llamada a embed (Cohere acepta hasta 96)
+            embed_max_workers: Llamadas a embed concurrentes durante la ingesta
+            embed_max_retries: Reintentos de un lote ante errores transitorios antes de
+                propagar el error (solo con client propio: con session reintenta la sesión)
+            query_cache_size: Embeddings de query guardados en memoria (0 la desactiva)
+            query_cache_ttl: Segundos de vida de cada embedding de query (None = sin expiración)
+            rerank_model: Modelo de rerank de Cohere
+            rerank_cache_size: Resultados de rerank guardados en memoria (0 la desactiva)
+            answer_cache_threshold: Similaridad coseno mínima para reutilizar una respuesta
+                previa (None desactiva la caché semántica de respuestas)
+            answer_cache_size: Respuestas guardadas en la caché semántica
+            chunk_size: Tamaño máximo de cada chunk en caracteres; los documentos se
+                indexan por secciones/artículos (None indexa cada archivo entero)
+            text_store_path: Archivo donde guardar el texto del corpus, leído con mmap
+                (None lo guarda en un buffer en memoria; ver TextStore). Al recargar el
+                corpus se alterna con path + ".next" y se borra el archivo anterior
+            context_max_tokens: Presupuesto aproximado de tokens del contexto del prompt
+                (None lo desactiva y se envían todos los documentos completos)
+            index_type: "flat" (búsqueda exacta) o "ivf" (aproximada, para corpus grandes)
+            index_params: Parámetros del índice, p. ej. {'nlist': 1024, 'nprobe': 16} para "ivf"
+            embedding_precision: Precisión con que se guardan los vectores del índice:
+                "float32", o "float16"/"int8"/"binary" (menos memoria; una lista corta se
+                re-puntúa con los vectores float32 en un archivo temporal, o en
+                index_params['rescore_path']; ver QuantizedIndex)
+            compact_threshold: Fracción de filas borradas del índice a partir de la cual
+                remove_document() compacta el índice automáticamente
+            retrieval_mode: Cómo se obtienen los candidatos del paso 1:
+                "vector" (embeddings), "hybrid" (embeddings + BM25 fusionados con RRF)
+                o "lexical" (solo BM25: no llama a la API para embeber la query)
+            rrf_k: Constante de Reciprocal Rank Fusion del modo "hybrid"
+            citation_lookup: Si True, las consultas que citan artículos ("Art. 189") se
+                responden con los pasajes exactos, sin embeddings ni rerank
+            adaptive_rerank: Si True, se decide por consulta si hace falta Rerank (ver
+                RerankPolicy); si False, siempre se llama a Rerank con todos los candidatos
+            rerank_policy: Política con umbrales propios (None = RerankPolicy() por defecto)
+            metrics: Registro de métricas (None crea uno propio; compartirlo permite
+                exportar varias instancias juntas)
+            client: Cliente con la interfaz de cohere.Client (ver utils.clients), p. ej.
+                FakeCohereClient para tests y benchmarks sin red (None usa el de session)
+            session: Sesión HTTP con límites de ritmo, reintentos y pool de conexiones,
+                compartible con el agente (None crea una con api_key si no se pasa client)
         """
-        self.client = cohere.Client(api_key)
+        self.metrics = metrics or MetricsRegistry()
+        self.session = session
+        if client is None:
+            if self.session is None:
+                self.session = CohereSession(api_key, metrics=self.metrics)
+            client = self.session.client
+        self.client: CohereClient = client
         self.model = model
         self.embed_model = embed_model
         self.documents: List[Document] = []
-        self.document_embeddings: Optional[np.ndarray] = None
+        # Unidad de búsqueda: chunks de los documentos y a qué documento pertenece cada uno
+        self.chunk_size = chunk_size
+        self.chunks: List[Document] = []
+        # Texto de documentos y chunks en un único buffer UTF-8; los Document guardan rangos
+        self.text_store_path = text_store_path
+        self.text_store = TextStore(text_store_path)
+        self.chunk_doc_ids: np.ndarray = np.empty(0, dtype=np.int32)
+        self.embedding_precision = embedding_precision
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        if embedding_precision != "float32":
+            if index_type != "flat":
+                raise ValueError(f"embedding_precision={embedding_precision} solo se admite con index_type='flat'")
+            self.index_type = "quantized"
+            self.index_params = {'precision': embedding_precision, **self.index_params}
+        self.index: Optional[VectorIndex] = None
+        self.compact_threshold = compact_threshold
+        if retrieval_mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode desconocido: {retrieval_mode} (opciones: {', '.join(self.RETRIEVAL_MODES)})")
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        # Índice léxico y de citas, fila a fila con el índice vectorial
+        self.bm25 = BM25Index()
+        self.citation_lookup = citation_lookup
+        self.citations = CitationIndex()
+        # Manifiesto de la última sincronización: ruta → {'mtime_ns', 'size', 'hash'}
+        self.manifest: Dict[str, Dict] = {}
+        self.embedding_cache: Optional[EmbeddingCache] = EmbeddingCache(cache_dir) if cache_dir else None
+        self.embedding_cache_stats: Dict[str, int] = {'hits': 0, 'misses': 0}
+        self.embed_batch_size = embed_batch_size
+        self.embed_max_workers = embed_max_workers
+        self.embed_max_retries = embed_max_retries
+        self.query_cache = LRUCache(maxsize=query_cache_size, ttl=query_cache_ttl)
+        self.rerank_model = rerank_model
+        self.rerank_cache = LRUCache(maxsize=rerank_cache_size)
+        self.rerank_policy: Optional[RerankPolicy] = None
+        if adaptive_rerank:
+            self.rerank_policy = rerank_policy or RerankPolicy()
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        if answer_cache_threshold is not None:
+            self.answer_cache = SemanticAnswerCache(maxsize=answer_cache_size, threshold=answer_cache_threshold)
+        self.context_packer: Optional[ContextPacker] = None
+        if context_max_tokens is not None:
+            self.context_packer = ContextPacker(max_tokens=context_max_tokens)
+        # Se incrementa cada vez que cambia el corpus o el índice; invalida las cachés derivadas
+        self.index_version = 0
+        self.metrics.describe("rag_stage_seconds", "Duración de cada etapa de la consulta en segundos")
+        self.metrics.describe("rag_api_calls_total", "Llamadas a la API de Cohere por endpoint")
+        self.metrics.describe("rag_api_units_total", "Unidades facturadas y tokens informados por Cohere")
+        self.metrics.describe("rag_queries_total", "Consultas respondidas")
+
+    @property
+    def document_embeddings(self) -> Optional[np.ndarray]:
+        """
+        Matriz de embeddings del índice (float32, filas normalizadas; en IVF, agrupadas por lista)
+
+        None si no hay índice o si el índice solo guarda vectores cuantizados.
+        """
+        return getattr(self.index, 'vectors', None)
         
-    def load_documents_from_folder(self, folder_path: str):
+    def load_documents_from_folder(self, folder_path: str, recursive: bool = True,
+                                   ignore: Sequence[str] = DEFAULT_IGNORE, load_workers: int = 8) -> LoadReport:
         """
         Carga documentos desde una carpeta y genera sus embeddings
         
+        Los archivos se leen en paralelo y se embeben por tandas mientras se
+        siguen leyendo los demás; el índice se construye una vez al final.
+        
         Args:
             folder_path: Ruta a la carpeta con archivos .md
+            recursive: Si True, incluye las subcarpetas
+            ignore: Patrones de archivos y carpetas a omitir (ver DocumentLoader.find_files)
+            load_workers: Archivos leídos en paralelo
+            
+        Returns:
+            LoadReport con los archivos cargados, omitidos y fallidos
+        """
+        logger.info("\n📂 Cargando documentos desde: %s", folder_path)
+        report = LoadReport()
+        documents = DocumentLoader.iter_folder(folder_path, recursive=recursive, ignore=ignore,
+                                               max_workers=load_workers, report=report)
+        self._index_stream(documents)
+        logger.info("✅ Total de documentos cargados: %d (%.1f MB en %.2fs)",
+                    len(self.documents), report.bytes / 1e6, report.seconds)
+        if report.failed:
+            logger.warning("⚠️ %d archivos no se pudieron cargar", len(report.failed))
+        return report
+
+    def _index_stream(self, documents: Iterable[Document]):
+        """
+        Reemplaza el corpus por los documentos de un iterable, embebiendo mientras llegan
+
+        Cada vez que se juntan embed_batch_size × embed_max_workers chunks se
+        envían a embeber en segundo plano (una tanda a la vez, con sus lotes en
+        paralelo) y se sigue consumiendo el iterable.
         """
-        print(f"\n📂 Cargando documentos desde: {folder_path}")
-        self.documents = DocumentLoader.load_from_folder(folder_path)
-        print(f"✅ Total de documentos cargados: {len(self.documents)}")
+        old_store = self._swap_text_store()
+        self.documents, self.chunks, self.manifest = [], [], {}
+        self.citations = CitationIndex()
+        doc_ids: List[int] = []
+        wave_size = self.embed_batch_size * max(self.embed_max_workers, 1)
+        pending: List[Document] = []
+        waves = []
+        
+        logger.info("\n🔢 Generando embeddings con %s por tandas de %d chunks...", self.embed_model, wave_size)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed") as embedder:
+            for document in documents:
+                if 'path' in document.metadata:
+                    self.manifest[document.metadata['path']] = self._manifest_entry(document)
+                first_doc_id, first_row = len(self.documents), len(self.chunks)
+                stored, chunks, ids = self._chunk_documents([document], first_doc_id=first_doc_id)
+                self._index_citations(stored, chunks, first_doc_id=first_doc_id, first_row=first_row)
+                self.documents.extend(stored)
+                self.chunks.extend(chunks)
+                doc_ids.extend(ids)
+                pending.extend(chunks)
+                if len(pending) >= wave_size:
+                    waves.append(embedder.submit(self._embed_chunks_counted, pending))
+                    pending = []
+            if pending:
+                waves.append(embedder.submit(self._embed_chunks_counted, pending))
+            
+            # Mientras se embebe la última tanda
+            self.chunk_doc_ids = np.array(doc_ids, dtype=np.int32)
+            self.bm25 = BM25Index([chunk.content for chunk in self.chunks])
+            results = [wave.result() for wave in waves]
+        self._discard_text_store(old_store)
+        
+        if self.chunk_size:
+            logger.info("✂️  %d chunks (máx. %d caracteres) de %d documentos, %.1f MB de texto",
+                        len(self.chunks), self.chunk_size, len(self.documents), self.text_store.nbytes / 1e6)
+        self.embedding_cache_stats = {'hits': sum(hits for _, hits, _ in results),
+                                      'misses': sum(misses for _, _, misses in results)}
+        if not self.chunks:
+            self.index = None
+            self._bump_index_version()
+            return
         
-        if self.documents:
-            self._generate_embeddings()
+        # Construir el índice: float32 contiguo y normalizado una sola vez
+        self.index = create_index(self.index_type, np.concatenate([embeddings for embeddings, _, _ in results]),
+                                  **self.index_params)
+        self._bump_index_version()
+        
+        logger.info("✅ Embeddings generados: (%d, %d) en %d tandas", len(self.index), self.index.dim, len(results))
+        logger.info("   → %d chunks × %d dimensiones (%s, %.1f MB)\n",
+                    len(self.chunks), self.index.dim, self.embedding_precision, self.index.nbytes / 1e6)
     
-    def _generate_embeddings(self):
+    def _build_chunks(self):
+        """
+        Divide los documentos cargados en chunks y construye el mapeo chunk → documento
+        """
+        old_store = self._swap_text_store()
+        self.documents, self.chunks, doc_ids = self._chunk_documents(self.documents, first_doc_id=0)
+        self._discard_text_store(old_store)
+        self.chunk_doc_ids = np.array(doc_ids, dtype=np.int32)
+        self.bm25 = BM25Index([chunk.content for chunk in self.chunks])
+        self.citations = CitationIndex()
+        self._index_citations(self.documents, self.chunks, first_doc_id=0, first_row=0)
+        if self.chunk_size:
+            logger.info("✂️  %d chunks (máx. %d caracteres) de %d documentos, %.1f MB de texto",
+                        len(self.chunks), self.chunk_size, len(self.documents), self.text_store.nbytes / 1e6)
+
+    def _swap_text_store(self) -> TextStore:
+        """
+        Abre un TextStore vacío para un corpus nuevo y devuelve el anterior
+
+        Con text_store_path se alterna entre ese archivo y path + ".next": el
+        anterior sigue abierto (sus documentos pueden estar copiándose al nuevo)
+        hasta _discard_text_store, y en Windows no se puede borrar un archivo abierto.
+        Un almacén anterior vacío se cierra ya y su archivo se reutiliza.
+        """
+        old_store = self.text_store
+        path = self.text_store_path
+        if old_store.nbytes == 0:
+            old_store.close()
+        elif path is not None and old_store.path == path:
+            path += ".next"
+        self.text_store = TextStore(path)
+        return old_store
+
+    def _discard_text_store(self, store: TextStore):
+        """Cierra un TextStore reemplazado y borra su archivo"""
+        store.close()
+        if store.path is not None and store.path != self.text_store.path and os.path.exists(store.path):
+            os.remove(store.path)
+
+    def _chunk_documents(self, documents: List[Document], first_doc_id: int):
+        """
+        Guarda documentos en el TextStore y los divide en chunks; el documento i
+        recibe el id first_doc_id + i
+
+        Returns:
+            Tupla (documentos guardados, chunks, id de documento de cada chunk)
         """
-        Genera embeddings para todos los documentos cargados
+        stored, chunks, doc_ids = [], [], []
+        for doc_id, doc in enumerate(documents, first_doc_id):
+            doc = self.text_store.add(doc)
+            stored.append(doc)
+            pieces = DocumentLoader.chunk_document(doc, self.chunk_size) if self.chunk_size else [doc]
+            for chunk in pieces:
+                chunk.metadata['doc_id'] = doc_id
+                chunks.append(chunk)
+                doc_ids.append(doc_id)
+        return stored, chunks, doc_ids
+
+    def _index_citations(self, documents: List[Document], chunks: List[Document], first_doc_id: int, first_row: int):
+        """
+        Registra en el índice de citas los artículos de unos chunks recién añadidos
+        """
+        codes = [document_code(doc) for doc in documents]
+        for row, chunk in enumerate(chunks, first_row):
+            self.citations.add(chunk, row, codes[chunk.metadata['doc_id'] - first_doc_id])
+
+    def _embed_chunks(self, chunks: List[Document]) -> np.ndarray:
         """
-        print(f"\n🔢 Generando embeddings con {self.embed_model}...")
+        Embeddings de unos chunks: los ya cacheados se leen de disco y el resto
+        se envía a la API (y se guarda en la caché)
+
+        Returns:
+            Matriz float32 (n_chunks × dimensiones)
+        """
+        embeddings, hits, misses = self._embed_chunks_counted(chunks)
+        self.embedding_cache_stats = {'hits': hits, 'misses': misses}
+        return embeddings
+
+    def _embed_chunks_counted(self, chunks: List[Document]) -> Tuple[np.ndarray, int, int]:
+        """
+        Como _embed_chunks, pero devuelve los aciertos y fallos de caché en vez de guardarlos
+
+        Returns:
+            Tupla (embeddings, aciertos de caché, chunks embebidos con la API)
+        """
+        texts = [chunk.content for chunk in chunks]
+        hashes = [content_hash(text) for text in texts]
         
-        # Extraer textos de los documentos
-        texts = [doc.content for doc in self.documents]
+        cached = {}
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get_many(self.embed_model, "search_document", hashes)
+        missing = [i for i in range(len(texts)) if i not in cached]
+        logger.info("   → Caché: %d aciertos, %d chunks por embeber", len(cached), len(missing))
         
-        # Generar embeddings con Cohere
-        response = self.client.embed(
-            texts=texts,
-            model=self.embed_model,
-            input_type="search_document",  # Tipo para documentos (no queries)
-            embedding_types=["float"]
-        )
+        embeddings: List[Optional[np.ndarray]] = [cached.get(i) for i in range(len(texts))]
+        if missing:
+            # Generar embeddings con Cohere solo para los chunks nuevos o modificados
+            new_embeddings = self._embed_texts([texts[i] for i in missing], input_type="search_document")
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = np.asarray(embedding)
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(self.embed_model, "search_document", hashes[i], embeddings[i])
         
-        # Convertir a numpy array para cálculos eficientes
-        self.document_embeddings = np.array(response.embeddings.float)
+        # El hash identifica al chunk en las claves de caché (p. ej. rerank)
+        for chunk, text_hash in zip(chunks, hashes):
+            chunk.metadata['content_hash'] = text_hash
         
-        print(f"✅ Embeddings generados: {self.document_embeddings.shape}")
-        print(f"   → {len(self.documents)} documentos × {self.document_embeddings.shape[1]} dimensiones\n")
+        return np.array(embeddings, dtype=np.float32), len(cached), len(missing)
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Añade documentos al corpus sin reconstruir el índice
+
+        Solo se embeben los chunks de los documentos nuevos (una llamada a embed
+        por cada embed_batch_size chunks) y se añaden al final del índice. Se
+        embeben antes de tocar el corpus: si embed falla, el sistema queda como estaba.
+
+        Args:
+            documents: Documentos a añadir
+        """
+        if not documents:
+            return
+        first_doc_id = len(self.documents)
+        documents, chunks, doc_ids = self._chunk_documents(documents, first_doc_id=first_doc_id)
+        embeddings = self._embed_chunks(chunks) if chunks else None
+        self.documents.extend(documents)
+        if chunks:
+            self._index_citations(documents, chunks, first_doc_id=first_doc_id, first_row=len(self.chunks))
+            if self.index is None:
+                self.index = create_index(self.index_type, embeddings, **self.index_params)
+            else:
+                self.index.add(embeddings)
+            self.bm25.add([chunk.content for chunk in chunks])
+            self.chunks.extend(chunks)
+            self.chunk_doc_ids = np.concatenate([self.chunk_doc_ids, np.array(doc_ids, dtype=np.int32)])
+        self._bump_index_version()
+        logger.info("➕ %d documentos añadidos (%d chunks)", len(documents), len(chunks))
+
+    def remove_document(self, source: str) -> bool:
+        """
+        Quita un documento del corpus
+
+        Sus filas del índice quedan como lápidas (dejan de aparecer en las búsquedas)
+        y el índice se compacta cuando superan compact_threshold.
+
+        Args:
+            source: Ruta ('path') o nombre de archivo ('source') del documento
+
+        Returns:
+            True si el documento existía
+        """
+        doc_id = self._find_document(source)
+        if doc_id is None:
+            return False
+        del self.documents[doc_id]
+
+        rows = np.flatnonzero(self.chunk_doc_ids == doc_id)
+        if self.index is not None and len(rows):
+            self.index.remove(rows)
+        self.bm25.remove(rows)
+        self.citations.remove(rows)
+        # Las filas borradas quedan con doc_id -1; los documentos posteriores bajan un puesto
+        self.chunk_doc_ids[rows] = -1
+        later = np.flatnonzero(self.chunk_doc_ids > doc_id)
+        self.chunk_doc_ids[later] -= 1
+        for row in later:
+            self.chunks[row].metadata['doc_id'] -= 1
+
+        self._bump_index_version()
+        logger.info("➖ Documento eliminado: %s", source)
+        if len(self.chunk_doc_ids) and np.mean(self.chunk_doc_ids < 0) > self.compact_threshold:
+            self.compact()
+        return True
+
+    def update_document(self, document: Document):
+        """
+        Reemplaza un documento (identificado por su ruta o nombre) por su nueva versión
+
+        Los chunks que no cambiaron salen de la caché de embeddings; solo los
+        modificados se envían a la API.
+        """
+        self.remove_document(document.metadata.get('path') or document.metadata['source'])
+        self.add_documents([document])
+
+    def compact(self):
+        """
+        Elimina del índice y de la lista de chunks las filas borradas
+        """
+        if self.index is not None:
+            keep = self.index.compact()
+        else:
+            keep = np.flatnonzero(self.chunk_doc_ids >= 0)
+        self.bm25.compact()
+        if len(keep) == len(self.chunks):
+            return
+        self.citations.compact(keep)
+        self.chunks = [self.chunks[i] for i in keep]
+        self.chunk_doc_ids = self.chunk_doc_ids[keep]
+        logger.info("🧹 Índice compactado: %d chunks", len(self.chunks))
+
+    def sync_folder(self, folder_path: str, recursive: bool = True, ignore: Sequence[str] = DEFAULT_IGNORE,
+                    load_workers: int = 8) -> Dict[str, List[str]]:
+        """
+        Sincroniza el corpus con una carpeta usando el manifiesto (mtime, tamaño y hash)
+
+        Los archivos con el mismo mtime y tamaño no se leen; los que cambiaron de
+        mtime pero no de contenido solo actualizan el manifiesto. Los nuevos se
+        añaden, los modificados se reemplazan y los que ya no existen se quitan.
+
+        Args:
+            folder_path: Ruta a la carpeta con archivos .md
+            recursive: Si True, incluye las subcarpetas
+            ignore: Patrones de archivos y carpetas a omitir (ver DocumentLoader.find_files)
+            load_workers: Archivos leídos en paralelo
+
+        Returns:
+            Diccionario con las rutas 'added', 'updated', 'removed' y 'unchanged', y
+            en 'failed' las que no se pudieron leer (se conservan como estaban)
+        """
+        folder = Path(folder_path)
+        summary = {'added': [], 'updated': [], 'removed': [], 'unchanged': [], 'failed': []}
+        changed: List[Document] = []
+        # Entradas de los archivos nuevos o modificados: se guardan cuando ya están indexados
+        changed_entries: Dict[str, Dict] = {}
+        seen = set()
+
+        def unchanged(path: str) -> bool:
+            seen.add(path)
+            stat = os.stat(path)
+            entry = self.manifest.get(path)
+            if entry is not None and (entry['mtime_ns'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+                summary['unchanged'].append(path)
+                return True
+            return False
+
+        report = LoadReport()
+        for document in DocumentLoader.iter_folder(folder_path, recursive=recursive, ignore=ignore, skip=unchanged,
+                                                   max_workers=load_workers, report=report):
+            path = document.metadata['path']
+            entry = self.manifest.get(path)
+            new_entry = self._manifest_entry(document)
+            if entry is not None and entry['hash'] == new_entry['hash']:
+                self.manifest[path] = new_entry
+                summary['unchanged'].append(path)
+                continue
+            if entry is not None:
+                self.remove_document(path)
+                summary['updated'].append(path)
+            else:
+                summary['added'].append(path)
+            changed_entries[path] = new_entry
+            changed.append(document)
+        summary['failed'] = list(report.failed)
+
+        in_folder = (lambda p: folder in Path(p).parents) if recursive else (lambda p: Path(p).parent == folder)
+        for path in [p for p in self.manifest if in_folder(p) and p not in seen]:
+            self.remove_document(path)
+            del self.manifest[path]
+            summary['removed'].append(path)
+
+        # Todos los documentos nuevos o modificados en una sola tanda de embeddings; si
+        # falla, sus entradas no llegan al manifiesto y la próxima sincronización los reintenta
+        self.add_documents(changed)
+        self.manifest.update(changed_entries)
+        logger.info("🔄 Sincronizado %s: %d nuevos, %d modificados, %d eliminados", folder_path,
+                    len(summary['added']), len(summary['updated']), len(summary['removed']))
+        return summary
+
+    @staticmethod
+    def _manifest_entry(document: Document, stat=None) -> Dict:
+        """Entrada del manifiesto de un documento cargado desde disco"""
+        if stat is None and 'mtime_ns' in document.metadata:
+            mtime_ns, size = document.metadata['mtime_ns'], document.metadata['size']
+        else:
+            stat = stat or Path(document.metadata['path']).stat()
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        return {'mtime_ns': mtime_ns, 'size': size, 'hash': content_hash(document.content)}
+
+    def _find_document(self, source: str) -> Optional[int]:
+        """Posición en self.documents del documento con esa ruta o nombre de archivo"""
+        for key in ('path', 'source'):
+            for doc_id, doc in enumerate(self.documents):
+                if doc.metadata.get(key) == source:
+                    return doc_id
+        return None
         
-    def _semantic_search(self, query: str, top_n: int = 20) -> List[Document]:
+    def _bump_index_version(self):
+        """
+        Marca un cambio de corpus/índice y descarta los resultados que dependían de él
+        """
+        self.index_version += 1
+        self.rerank_cache.clear()
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+
+    def _embed_texts(self, texts: List[str], input_type: str) -> List[List[float]]:
+        """
+        Genera embeddings en lotes, usando un pool acotado de hilos
+
+        Args:
+            texts: Textos a embeber
+            input_type: "search_document" o "search_query"
+
+        Returns:
+            Lista de embeddings en el mismo orden que texts
+        """
+        batches = [texts[i:i + self.embed_batch_size] for i in range(0, len(texts), self.embed_batch_size)]
+        if len(batches) <= 1 or self.embed_max_workers <= 1:
+            results = [self._embed_batch(batch, input_type) for batch in batches]
+        else:
+            logger.info("   → %d textos en %d lotes (%d en paralelo)", len(texts), len(batches), self.embed_max_workers)
+            with ThreadPoolExecutor(max_workers=self.embed_max_workers) as executor:
+                # map conserva el orden de los lotes aunque terminen desordenados
+                results = list(executor.map(lambda batch: self._embed_batch(batch, input_type), batches))
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    def _embed_batch(self, texts: List[str], input_type: str) -> List[List[float]]:
+        """
+        Embebe un lote; los errores transitorios se reintentan con backoff exponencial
+
+        Con session los reintentos (y el ritmo) los gestiona su transporte y aquí
+        no se repiten; con un client propio se reintenta el lote hasta
+        embed_max_retries veces. Los errores no transitorios se propagan siempre.
+        """
+        max_retries = 0 if self.session is not None else self.embed_max_retries
+        for attempt in range(max_retries + 1):
+            try:
+                response = self.client.embed(
+                    texts=texts,
+                    model=self.embed_model,
+                    input_type=input_type,
+                    embedding_types=["float"]
+                )
+                self._record_usage("embed", response)
+                return response.embeddings.float
+            except Exception as e:
+                if attempt == max_retries or not is_transient(e):
+                    raise
+                wait = 0.5 * (2 ** attempt)
+                logger.warning("   ⚠️  Lote de %d textos falló (%s); reintentando en %.1fs", len(texts), e, wait)
+                time.sleep(wait)
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        """
+        Obtiene el embedding de una query, usando la caché LRU + TTL
+
+        Args:
+            query: Consulta del usuario
+
+        Returns:
+            Embedding de la query (1D array float32)
+        """
+        with self._stage("query_embed"):
+            key = self._query_cache_key(query)
+            query_embedding = self.query_cache.get(key)
+            if query_embedding is None:
+                query_response = self.client.embed(
+                    texts=[query],
+                    model=self.embed_model,
+                    input_type="search_query",  # Tipo para queries (no documentos)
+                    embedding_types=["float"]
+                )
+                self._record_usage("embed", query_response)
+                query_embedding = np.asarray(query_response.embeddings.float[0], dtype=np.float32)
+                self.query_cache.put(key, query_embedding)
+        return query_embedding
+
+    def _query_cache_key(self, query: str) -> tuple:
+        return (self.embed_model, normalize_query(query))
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Obtiene los embeddings de varias queries con una sola llamada (por lote) a embed
+
+        Las queries ya presentes en la caché no se vuelven a enviar.
+
+        Returns:
+            Matriz (n_queries × dimensiones) float32
+        """
+        keys = [self._query_cache_key(query) for query in queries]
+        embeddings: List[Optional[np.ndarray]] = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            new_embeddings = self._embed_texts([queries[i] for i in missing], input_type="search_query")
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = np.asarray(embedding, dtype=np.float32)
+                self.query_cache.put(keys[i], embeddings[i])
+        return np.array(embeddings, dtype=np.float32)
+
+    def _semantic_search(self, query: str, top_n: int = 20,
+                         query_embedding: Optional[np.ndarray] = None) -> SearchHits:
         """
         PASO 1: Búsqueda semántica usando embeddings de Cohere
         
         Args:
             query: Consulta del usuario
             top_n: Número de documentos a retornar
+            query_embedding: Embedding de la query ya calculado (opcional)
             
         Returns:
-            Lista de documentos candidatos ordenados por similaridad
+            Candidatos (filas y scores) ordenados por similaridad
         """
-        print(f"🔍 [Paso 1] Búsqueda semántica con embeddings...")
+        logger.info("🔍 [Paso 1] Búsqueda semántica con embeddings...")
         
-        if self.document_embeddings is None:
-            print("   ⚠️  No hay embeddings generados. Usa load_documents_from_folder() primero.")
-            return []
+        if self.index is None:
+            logger.warning("   ⚠️  No hay embeddings generados. Usa load_documents_from_folder() primero.")
+            return SearchHits.empty()
         
-        # Generar embedding de la query
-        query_response = self.client.embed(
-            texts=[query],
-            model=self.embed_model,
-            input_type="search_query",  # Tipo para queries (no documentos)
-            embedding_types=["float"]
-        )
-        query_embedding = np.array(query_response.embeddings.float[0])
-        
-        # Calcular similaridad coseno con todos los documentos
-        similarities = self._cosine_similarity(query_embedding, self.document_embeddings)
-        
-        # Obtener índices de los top N documentos más similares
-        top_indices = np.argsort(similarities)[::-1][:top_n]
-        
-        # Crear lista de candidatos con sus scores
-        candidates = []
-        for idx in top_indices:
-            doc = self.documents[idx]
-            score = similarities[idx]
-            # Agregar score como metadata temporal
-            doc.similarity_score = score
-            candidates.append(doc)
-            
-        print(f"   → Top {len(candidates)} candidatos por similaridad:")
-        for i, doc in enumerate(candidates[:5], 1):  # Mostrar top 5
-            print(f"      #{i} - Score: {doc.similarity_score:.4f} - {doc.metadata['source']}")
+        # Generar embedding de la query (o reutilizarlo de la caché)
+        if query_embedding is None:
+            query_embedding = self._embed_query(query)
         
-        return candidates
-    
-    @staticmethod
-    def _cosine_similarity(query_embedding: np.ndarray, doc_embeddings: np.ndarray) -> np.ndarray:
+        return self._candidates_from_embedding(query_embedding, top_n)
+
+    def _retrieve(self, query: str, top_n: int = 20,
+                  query_embedding: Optional[np.ndarray] = None) -> SearchHits:
         """
-        Calcula similaridad coseno entre query y documentos
-        
+        PASO 1 según retrieval_mode: semántica, léxica (BM25) o híbrida (RRF)
+
         Args:
-            query_embedding: Embedding de la query (1D array)
-            doc_embeddings: Embeddings de documentos (2D array)
-            
+            query: Consulta del usuario
+            top_n: Número de documentos a retornar
+            query_embedding: Embedding de la query ya calculado (no se usa en modo "lexical")
+
         Returns:
-            Array de similaridades
+            Candidatos (filas y scores) ordenados por relevancia
         """
-        # Normalizar vectores
-        query_norm = query_embedding / np.linalg.norm(query_embedding)
-        doc_norms = doc_embeddings / np.linalg.norm(doc_embeddings, axis=1, keepdims=True)
+        if self.retrieval_mode == "vector":
+            return self._semantic_search(query, top_n=top_n, query_embedding=query_embedding)
+        if self.retrieval_mode == "lexical":
+            logger.info("🔍 [Paso 1] Búsqueda léxica BM25 (sin embeddings)...")
+            with self._stage("similarity_scan"):
+                hits = self.bm25.search(query, top_n)
+            return self._candidates_from_hits(*hits)
         
-        # Calcular producto punto (cosine similarity)
-        similarities = np.dot(doc_norms, query_norm)
+        logger.info("🔍 [Paso 1] Búsqueda híbrida (embeddings + BM25)...")
+        if query_embedding is None:
+            query_embedding = self._embed_query(query)
+        with self._stage("similarity_scan"):
+            hits = self._fuse_hits(query, self.index.search(query_embedding, top_n), top_n)
+        return self._candidates_from_hits(*hits)
+
+    def _fuse_hits(self, query: str, vector_hits: tuple, top_n: int) -> tuple:
+        """
+        Fusiona los resultados vectoriales (índices, scores) con los de BM25 mediante RRF
+        """
+        vector_indices, vector_scores = vector_hits
+        vector_indices = vector_indices[np.isfinite(vector_scores)]
+        lexical_indices, _ = self.bm25.search(query, top_n)
+        return reciprocal_rank_fusion([vector_indices, lexical_indices], top_n, k=self.rrf_k)
+
+    def _query_embedding_for_mode(self, query: str) -> Optional[np.ndarray]:
+        """Embedding de la query, o None en modo "lexical" (sin llamada a la API)"""
+        if self.retrieval_mode == "lexical":
+            return None
+        return self._embed_query(query)
+
+    def _candidates_from_embedding(self, query_embedding: np.ndarray, top_n: int) -> SearchHits:
+        """
+        Parte local de la búsqueda semántica: consulta el índice con un embedding ya calculado
+        """
+        # Similaridad coseno (un producto matriz-vector) y selección parcial del top N
+        with self._stage("similarity_scan"):
+            top_indices, top_scores = self.index.search(query_embedding, top_n)
+        return self._candidates_from_hits(top_indices, top_scores)
+
+    def _candidates_from_hits(self, top_indices: np.ndarray, top_scores: np.ndarray) -> SearchHits:
+        """
+        Envuelve índices y scores del índice en un SearchHits inmutable
+
+        Los chunks compartidos no se modifican: varias consultas concurrentes
+        pueden tener a la vez el mismo chunk con scores distintos.
+        """
+        # Las filas con score no finito (lápidas que search_many usa de relleno) se descartan
+        candidates = SearchHits(top_indices, top_scores, self.chunks)
+            
+        logger.info("   → Top %d candidatos por similaridad", len(candidates))
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, hit in enumerate(candidates[:5], 1):  # Mostrar top 5
+                logger.debug("      #%d - Score: %.4f - %s", i, hit.score, hit.metadata['source'])
         
-        return similarities
+        return candidates
     
-    def _rerank_documents(self, query: str, documents: List[Document], top_k: int = 5) -> List[Dict]:
+    def _rerank_step(self, query: str, candidates: SearchHits, top_k: int = 5) -> tuple:
+        """
+        PASO 2 con la política adaptativa: rerank completo, con menos candidatos u omitido
+
+        Returns:
+            Tupla (documentos reordenados, decisión de la política)
+        """
+        decision = self._rerank_decision(candidates, top_k)
+        if decision['action'] == "skip":
+            return self._semantic_order(candidates, top_k, decision), decision
+        return self._rerank_documents(query, candidates[:decision['sent']], top_k=top_k), decision
+
+    def _rerank_decision(self, candidates: SearchHits, top_k: int) -> Dict:
+        """
+        Aplica la política de rerank a los scores del paso 1
+        """
+        if self.rerank_policy is None:
+            return {'action': "rerank", 'reason': "policy_disabled", 'candidates': len(candidates), 'sent': len(candidates)}
+        # Los márgenes y saltos solo tienen sentido con similaridades coseno
+        return self.rerank_policy.decide(candidates.scores, top_k, scores_comparable=self.retrieval_mode == "vector")
+
+    def _semantic_order(self, candidates: SearchHits, top_k: int, decision: Dict) -> List[Dict]:
+        """
+        Contexto del paso 3 sin rerank: los top_k candidatos en el orden del paso 1
+        """
+        logger.info("\n⏭️  [Paso 2] Rerank omitido (%s): se usa el orden de la búsqueda", decision['reason'])
+        ranking = list(enumerate(candidates.scores[:top_k].tolist()))
+        return self._build_reranked_docs(candidates, ranking)
+
+    def _rerank_documents(self, query: str, documents: Sequence[Document], top_k: int = 5) -> List[Dict]:
         """
         PASO 2: Reordena documentos usando Cohere Rerank
         
         Args:
             query: Consulta del usuario
-            documents: Lista de documentos a reordenar
+            documents: Documentos a reordenar (candidatos del paso 1 o una lista de Document)
             top_k: Número de documentos top a retornar
             
         Returns:
             Lista de documentos reordenados con scores
         """
-        print(f"\n🎯 [Paso 2] Reranking con Cohere...")
+        logger.info("\n🎯 [Paso 2] Reranking con Cohere...")
         
-        # Preparar documentos para Rerank
-        docs_text = [doc.content for doc in documents]
-        
-        # Llamar a Cohere Rerank
-        rerank_response = self.client.rerank(
-            model="rerank-v3.5",  # Modelo de rerank de Cohere
-            query=query,
-            documents=docs_text,
-            top_n=top_k,
-            return_documents=True
-        )
+        # El orden de rerank es determinista para la misma query y los mismos candidatos
+        with self._stage("rerank"):
+            cache_key = self._rerank_cache_key(query, documents, top_k)
+            ranking = self.rerank_cache.get(cache_key)
+            if ranking is not None:
+                logger.info("   → Resultado de rerank recuperado de la caché")
+            else:
+                # Preparar documentos para Rerank
+                docs_text = [doc.content for doc in documents]
+                
+                # Llamar a Cohere Rerank (el texto se recupera localmente, no hace falta que vuelva)
+                rerank_response = self.client.rerank(
+                    model=self.rerank_model,
+                    query=query,
+                    documents=docs_text,
+                    top_n=top_k,
+                    return_documents=False
+                )
+                self._record_usage("rerank", rerank_response)
+                ranking = [(result.index, result.relevance_score) for result in rerank_response.results]
+                self.rerank_cache.put(cache_key, ranking)
         
+        return self._build_reranked_docs(documents, ranking)
+
+    def _build_reranked_docs(self, documents: Sequence[Document], ranking: List[tuple]) -> List[Dict]:
+        """
+        Convierte pares (índice del candidato, score) en la lista de contexto del paso 3
+        """
         # Procesar resultados
         reranked_docs = []
-        for idx, result in enumerate(rerank_response.results):
+        for idx, (original_index, score) in enumerate(ranking):
+            doc = documents[original_index]
             reranked_docs.append({
-                'content': result.document.text,
-                'score': result.relevance_score,
-                'original_index': result.index,
-                'rank': idx + 1
+                'content': doc.content,
+                'score': score,
+                'original_index': original_index,
+                'rank': idx + 1,
+                'source': doc.metadata['source'],
+                'chunk_id': doc.metadata.get('chunk_id')
             })
-            print(f"   #{idx+1} - Score: {result.relevance_score:.4f} - Fuente: {documents[result.index].metadata['source']}")
+            logger.debug("   #%d - Score: %.4f - Fuente: %s", idx + 1, score, doc.metadata['source'])
         
         return reranked_docs
+
+    def _lookup_citations(self, query: str, top_k: int) -> Optional[List[Dict]]:
+        """
+        PASO 1 y 2 para consultas que citan artículos: pasajes exactos del índice de citas
+
+        Returns:
+            Lista de contexto (con 'exact_citation': True) o None si la consulta no cita
+            ningún artículo indexado o citation_lookup está desactivado
+        """
+        if not self.citation_lookup:
+            return None
+        citations = self.citations.lookup(query)[:top_k]
+        if not citations:
+            return None
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("📌 [Paso 1] Cita exacta: %s (sin embeddings ni rerank)",
+                        ', '.join(f'Art. {c.article}' for c in citations))
+        context_docs = []
+        for rank, citation in enumerate(citations, 1):
+            chunk = self.chunks[citation.row]
+            context_docs.append({
+                'content': chunk.content[citation.start:citation.end].strip(),
+                'score': 1.0,
+                'original_index': citation.row,
+                'rank': rank,
+                'source': chunk.metadata['source'],
+                'chunk_id': chunk.metadata.get('chunk_id'),
+                'exact_citation': True,
+                'citation': f"Art. {citation.article}",
+                'code': citation.code
+            })
+        return context_docs
+
+    def _rerank_cache_key(self, query: str, documents: Sequence[Document], top_k: int) -> tuple:
+        """
+        Clave de la caché de rerank: (modelo, query normalizada, hash ordenado de candidatos, top_k, versión)
+        """
+        candidate_ids = hashlib.sha256()
+        for doc in documents:
+            text_hash = doc.metadata.get('content_hash') or content_hash(doc.content)
+            candidate_ids.update(text_hash.encode('ascii'))
+        return (self.rerank_model, normalize_query(query), candidate_ids.hexdigest(), top_k, self.index_version)
     
     def _generate_response(self, query: str, context_docs: List[Dict]) -> str:
         """
@@ -187,11 +886,30 @@ class LegalRAGSystem:
         Returns:
             Respuesta generada
         """
-        print(f"\n🤖 [Paso 3] Generando respuesta con {self.model}...")
+        logger.info("\n🤖 [Paso 3] Generando respuesta con %s...", self.model)
+        
+        with self._stage("prompt_build"):
+            prompt = self._build_prompt(query, context_docs)
         
+        # Generar respuesta
+        with self._stage("chat"):
+            response = self.client.chat(
+                model=self.model,
+                message=prompt,
+                temperature=0.3,  # Baja temperatura para respuestas más precisas
+            )
+        self._record_usage("chat", response)
+        
+        return response.text
+
+    @staticmethod
+    def _build_prompt(query: str, context_docs: List[Dict]) -> str:
+        """
+        Construye el prompt de generación a partir de la consulta y el contexto
+        """
         # Construir contexto desde los documentos
         context = "\n\n---\n\n".join([
-            f"DOCUMENTO {doc['rank']} (Relevancia: {doc['score']:.2f}):\n{doc['content']}"
+            f"DOCUMENTO {doc['rank']} (Fuente: {doc.get('source', 'desconocida')}, Relevancia: {doc['score']:.2f}):\n{doc['content']}"
             for doc in context_docs
         ])
         
@@ -212,14 +930,7 @@ INSTRUCCIONES:
 
 RESPUESTA:"""
         
-        # Generar respuesta
-        response = self.client.chat(
-            model=self.model,
-            message=prompt,
-            temperature=0.3,  # Baja temperatura para respuestas más precisas
-        )
-        
-        return response.text
+        return prompt
     
     def query(self, query: str, top_k: int = 5, initial_candidates: int = 20, structured: bool = False) -> Dict:
         """
@@ -238,10 +949,323 @@ RESPUESTA:"""
         if structured:
             from legal_agent import run_legal_agent
             return run_legal_agent(self, query)
-        print(f"\n{'='*60}")
-        print(f"CONSULTA: {query}")
-        print(f"{'='*60}")
+        trace = QueryTrace()
+        with activate(trace), self._stage("total"):
+            result = self._run_query(query, top_k, initial_candidates)
+        return self._attach_trace(result, trace)
+
+    def _run_query(self, query: str, top_k: int, initial_candidates: int) -> Dict:
+        """Pasos 1 a 3 de query() (dentro de la traza activa)"""
+        logger.info("\n%s\nCONSULTA: %s\n%s", BANNER, query, BANNER)
+        
+        not_ready = self._check_ready(query)
+        if not_ready is not None:
+            return not_ready
+        
+        # Citas explícitas ("Art. 189"): pasajes exactos, sin embeddings ni rerank
+        query_embedding = None
+        cache_params = (self.model, top_k, initial_candidates, self.retrieval_mode)
+        reranked_docs = self._lookup_citations(query, top_k)
+        rerank_decision = skip_decision("exact_citation", len(reranked_docs or []))
+        if reranked_docs is None:
+            # PASO 1: Búsqueda de candidatos (embeddings, BM25 o ambos)
+            query_embedding = self._query_embedding_for_mode(query)
+            
+            # Caché semántica de respuestas: una consulta equivalente ya respondida se reutiliza
+            cached = self._lookup_cached_answer(query, query_embedding, cache_params)
+            if cached is not None:
+                return cached
+            
+            candidates = self._retrieve(query, top_n=initial_candidates, query_embedding=query_embedding)
+            
+            # PASO 2: Rerank
+            reranked_docs, rerank_decision = self._rerank_step(query, candidates, top_k=top_k)
+        
+        # PASO 3: Generar respuesta (con el contexto ajustado al presupuesto de tokens)
+        context_docs, context_stats = self._pack_context(reranked_docs)
+        answer = self._generate_response(query, context_docs)
+        
+        logger.info("\n%s\nRESPUESTA FINAL:\n%s\n", BANNER, BANNER)
+        
+        result = self._make_result(query, answer, context_docs, context_stats, rerank_decision)
+        self._store_answer(query_embedding, cache_params, result)
+        
+        return result
+
+    def query_many(self, queries: List[str], top_k: int = 5, initial_candidates: int = 20,
+                   max_concurrency: int = 4) -> List[Dict]:
+        """
+        Procesa un lote de consultas compartiendo el paso de embeddings
+
+        Todas las queries se embeben en una llamada por lote y se puntúan contra el
+        índice con un único producto matriz-matriz; rerank y generación se ejecutan
+        en paralelo con como máximo max_concurrency consultas a la vez.
+
+        Args:
+            queries: Lista de preguntas
+            top_k: Número de documentos top después de rerank
+            initial_candidates: Número de candidatos iniciales (búsqueda semántica)
+            max_concurrency: Consultas procesando rerank/generación simultáneamente
+
+        Returns:
+            Lista de resultados en el mismo orden que queries. Si una consulta falla,
+            su resultado trae 'error' y las demás no se ven afectadas.
+        """
+        if not queries:
+            return []
+        
+        not_ready = self._check_ready(queries[0])
+        if not_ready is not None:
+            return [{**not_ready, 'query': query} for query in queries]
+        
+        logger.info("\n📦 Procesando lote de %d consultas (concurrencia: %d)", len(queries), max_concurrency)
+        
+        # Las consultas que citan artículos se resuelven con el índice de citas
+        cited = [self._lookup_citations(query, top_k) for query in queries]
+        pending = [i for i in range(len(queries)) if cited[i] is None]
+        
+        # PASO 1 para el resto del lote: embeddings en bloque + búsqueda matriz-matriz
+        # (en modo "lexical" no hay embeddings: cada consulta va solo contra BM25)
+        query_embeddings: List[Optional[np.ndarray]] = [None] * len(queries)
+        vector_hits: Dict[int, tuple] = {}
+        batch_trace = QueryTrace()
+        if self.retrieval_mode != "lexical" and pending:
+            with activate(batch_trace):
+                with self._stage("query_embed"):
+                    embeddings = self._embed_queries([queries[i] for i in pending])
+                with self._stage("similarity_scan"):
+                    all_indices, all_scores = self.index.search_many(embeddings, initial_candidates)
+            for row, i in enumerate(pending):
+                query_embeddings[i] = embeddings[row]
+                vector_hits[i] = (all_indices[row], all_scores[row])
+        cache_params = (self.model, top_k, initial_candidates, self.retrieval_mode)
+        
+        def hits(i: int) -> tuple:
+            if self.retrieval_mode == "lexical":
+                with self._stage("similarity_scan"):
+                    return self.bm25.search(queries[i], initial_candidates)
+            if self.retrieval_mode == "hybrid":
+                with self._stage("similarity_scan"):
+                    return self._fuse_hits(queries[i], vector_hits[i], initial_candidates)
+            return vector_hits[i]
+        
+        def process(i: int) -> Dict:
+            # Cada consulta parte de los tiempos compartidos del paso 1 del lote
+            trace = QueryTrace(batch_trace.timings)
+            with activate(trace), self._stage("total"):
+                result = answer(i)
+            return self._attach_trace(result, trace)
+        
+        def answer(i: int) -> Dict:
+            query = queries[i]
+            try:
+                reranked_docs = cited[i]
+                rerank_decision = skip_decision("exact_citation", len(reranked_docs or []))
+                if reranked_docs is None:
+                    cached = self._lookup_cached_answer(query, query_embeddings[i], cache_params)
+                    if cached is not None:
+                        return cached
+                    candidates = self._candidates_from_hits(*hits(i))
+                    # PASO 2 y 3 por consulta
+                    reranked_docs, rerank_decision = self._rerank_step(query, candidates, top_k=top_k)
+                context_docs, context_stats = self._pack_context(reranked_docs)
+                answer = self._generate_response(query, context_docs)
+                result = self._make_result(query, answer, context_docs, context_stats, rerank_decision)
+                self._store_answer(query_embeddings[i], cache_params, result)
+                return result
+            except Exception as e:
+                logger.error("   ❌ Error procesando '%s': %s", query, e)
+                return {'answer': None, 'context_docs': [], 'query': query, 'error': str(e)}
         
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            return list(executor.map(process, range(len(queries))))
+
+    def query_stream(self, query: str, top_k: int = 5, initial_candidates: int = 20) -> Iterator[Dict]:
+        """
+        Procesa una consulta emitiendo la respuesta token a token
+
+        Los pasos 1 y 2 son iguales que en query(); el paso 3 usa el endpoint de
+        chat en streaming.
+
+        Args:
+            query: Pregunta del usuario
+            top_k: Número de documentos top después de rerank
+            initial_candidates: Número de candidatos iniciales (búsqueda semántica)
+
+        Yields:
+            {'type': 'delta', 'text': ...} por cada fragmento de texto y, al final,
+            {'type': 'final', ...} con el mismo contenido que query(); sus 'timings'
+            incluyen además time_to_first_token y generation_time (en segundos)
+        """
+        # La traza se activa solo en tramos sin yield: un generador puede
+        # reanudarse en otro contexto y la ContextVar no debe cruzar los yield
+        trace = QueryTrace()
+        start_total = time.perf_counter()
+        with activate(trace):
+            logger.info("\n%s\nCONSULTA: %s\n%s", BANNER, query, BANNER)
+        not_ready = self._check_ready(query)
+        if not_ready is not None:
+            yield {'type': 'delta', 'text': not_ready['answer']}
+            trace.timings.update(time_to_first_token=0.0, generation_time=0.0)
+            yield {'type': 'final', **self._attach_trace(not_ready, trace)}
+            return
+        
+        with activate(trace):
+            # Citas explícitas ("Art. 189"): pasajes exactos, sin embeddings ni rerank
+            query_embedding = None
+            cache_params = (self.model, top_k, initial_candidates, self.retrieval_mode)
+            reranked_docs = self._lookup_citations(query, top_k)
+            rerank_decision = skip_decision("exact_citation", len(reranked_docs or []))
+            cached = None
+            if reranked_docs is None:
+                # PASO 1: Búsqueda de candidatos (embeddings, BM25 o ambos)
+                query_embedding = self._query_embedding_for_mode(query)
+                cached = self._lookup_cached_answer(query, query_embedding, cache_params)
+            if reranked_docs is None and cached is None:
+                candidates = self._retrieve(query, top_n=initial_candidates, query_embedding=query_embedding)
+                
+                # PASO 2: Rerank
+                reranked_docs, rerank_decision = self._rerank_step(query, candidates, top_k=top_k)
+        if cached is not None:
+            yield {'type': 'delta', 'text': cached['answer']}
+            self._observe_stage("total", time.perf_counter() - start_total, trace)
+            trace.timings.update(time_to_first_token=0.0, generation_time=0.0)
+            yield {'type': 'final', **self._attach_trace(cached, trace)}
+            return
+        with activate(trace):
+            context_docs, context_stats = self._pack_context(reranked_docs)
+            with self._stage("prompt_build"):
+                prompt = self._build_prompt(query, context_docs)
+            
+            # PASO 3: Generar respuesta en streaming
+            logger.info("\n🤖 [Paso 3] Generando respuesta con %s (streaming)...\n", self.model)
+        start = time.perf_counter()
+        time_to_first_token = None
+        parts = []
+        for event in self.client.chat_stream(
+            model=self.model,
+            message=prompt,
+            temperature=0.3,
+        ):
+            if event.event_type == "stream-end":
+                self._record_usage("chat", getattr(event, 'response', None), trace)
+            if event.event_type != "text-generation":
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            parts.append(event.text)
+            yield {'type': 'delta', 'text': event.text}
+        generation_time = time.perf_counter() - start
+        self._observe_stage("chat", generation_time, trace)
+        
+        result = self._make_result(query, "".join(parts), context_docs, context_stats, rerank_decision)
+        self._store_answer(query_embedding, cache_params, result)
+        
+        self._observe_stage("total", time.perf_counter() - start_total, trace)
+        trace.timings.update(
+            time_to_first_token=time_to_first_token if time_to_first_token is not None else generation_time,
+            generation_time=generation_time
+        )
+        yield {'type': 'final', **self._attach_trace(result, trace)}
+
+    def _pack_context(self, reranked_docs: List[Dict]) -> tuple:
+        """
+        Ajusta los documentos reordenados al presupuesto de tokens del prompt
+
+        Returns:
+            Tupla (documentos de contexto, estadísticas de empaquetado o None)
+        """
+        if self.context_packer is None:
+            return reranked_docs, None
+        with self._stage("context_pack"):
+            context_docs, context_stats = self.context_packer.pack(reranked_docs)
+        logger.info("   → Contexto: %d tokens empaquetados, %d descartados (%d pasajes)",
+                    context_stats['packed_tokens'], context_stats['dropped_tokens'], context_stats['dropped_docs'])
+        return context_docs, context_stats
+
+    def _make_result(self, query: str, answer: str, context_docs: List[Dict],
+                     context_stats: Optional[Dict] = None, rerank_decision: Optional[Dict] = None) -> Dict:
+        """
+        Arma el diccionario de resultado de una consulta respondida por el pipeline
+        """
+        result = {
+            'answer': answer,
+            'context_docs': context_docs,
+            'sources': self._group_by_source(context_docs),
+            'query': query,
+            'cache_hit': False
+        }
+        if context_stats is not None:
+            result['context_stats'] = context_stats
+        if rerank_decision is not None:
+            result['rerank'] = rerank_decision
+        return result
+
+    @staticmethod
+    def _group_by_source(context_docs: List[Dict]) -> List[Dict]:
+        """
+        Agrupa los chunks del contexto por documento de origen
+
+        Returns:
+            Lista de {'source', 'score', 'ranks', 'chunk_ids'} ordenada por el mejor rank
+        """
+        groups: Dict[str, Dict] = {}
+        for doc in context_docs:
+            group = groups.setdefault(doc['source'], {
+                'source': doc['source'],
+                'score': doc['score'],
+                'ranks': [],
+                'chunk_ids': []
+            })
+            group['score'] = max(group['score'], doc['score'])
+            group['ranks'].append(doc['rank'])
+            group['chunk_ids'].append(doc.get('chunk_id'))
+        return list(groups.values())
+
+    @contextmanager
+    def _stage(self, stage: str):
+        """Mide una etapa con reloj monótono y la registra en el histograma y en la traza activa"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe_stage(stage, time.perf_counter() - start, current_trace())
+
+    def _observe_stage(self, stage: str, seconds: float, trace: Optional[QueryTrace] = None):
+        """Registra la duración de una etapa ya medida"""
+        self.metrics.observe("rag_stage_seconds", seconds, stage=stage)
+        if trace is not None:
+            trace.add_timing(stage, seconds)
+
+    def _record_usage(self, endpoint: str, response, trace: Optional[QueryTrace] = None):
+        """
+        Contabiliza una llamada a la API y el uso que informa (unidades facturadas y tokens)
+        en los contadores y en la traza (por defecto, la activa)
+        """
+        usage = response_usage(response)
+        self.metrics.inc("rag_api_calls_total", endpoint=endpoint)
+        for kind, values in usage.items():
+            for unit, value in values.items():
+                self.metrics.inc("rag_api_units_total", value, endpoint=endpoint, kind=kind, unit=unit)
+        trace = trace if trace is not None else current_trace()
+        if trace is not None and usage:
+            trace.add_usage(endpoint, usage)
+
+    def _attach_trace(self, result: Dict, trace: QueryTrace) -> Dict:
+        """
+        Añade 'query_id' (el de los logs), 'timings' (segundos por etapa) y 'usage'
+        (por endpoint) a un resultado
+
+        Se llama después de _store_answer para que la caché no guarde los tiempos
+        de la consulta original.
+        """
+        self.metrics.inc("rag_queries_total", cache_hit=str(bool(result.get('cache_hit'))).lower())
+        return {**result, 'query_id': trace.query_id, 'timings': dict(trace.timings), 'usage': trace.usage}
+
+    def _check_ready(self, query: str) -> Optional[Dict]:
+        """
+        Devuelve un resultado de error si no hay corpus indexado, None si se puede consultar
+        """
         # Validar que hay documentos cargados
         if not self.documents:
             return {
@@ -250,29 +1274,36 @@ RESPUESTA:"""
                 'query': query
             }
         
-        # Validar que hay embeddings generados
-        if self.document_embeddings is None:
+        # Validar que hay embeddings generados (el modo léxico no los necesita)
+        if self.index is None and self.retrieval_mode != "lexical":
             return {
                 'answer': "❌ No hay embeddings generados. Los documentos deben cargarse con load_documents_from_folder().",
                 'context_docs': [],
                 'query': query
             }
-        
-        # PASO 1: Búsqueda semántica con embeddings
-        candidates = self._semantic_search(query, top_n=initial_candidates)
-        
-        # PASO 2: Rerank
-        reranked_docs = self._rerank_documents(query, candidates, top_k=top_k)
-        
-        # PASO 3: Generar respuesta
-        answer = self._generate_response(query, reranked_docs)
-        
-        print(f"\n{'='*60}")
-        print("RESPUESTA FINAL:")
-        print(f"{'='*60}\n")
-        
+        return None
+
+    def _lookup_cached_answer(self, query: str, query_embedding: np.ndarray, cache_params: tuple) -> Optional[Dict]:
+        """
+        Busca en la caché semántica una respuesta a una consulta equivalente
+        (sin embedding de la query, como en el modo "lexical", no hay búsqueda)
+        """
+        if self.answer_cache is None or query_embedding is None:
+            return None
+        cached = self.answer_cache.lookup(query_embedding, self.index_version, cache_params)
+        if cached is None:
+            return None
+        result, similarity = cached
+        logger.info("♻️  Respuesta reutilizada de la caché (similaridad %.4f con: %s)", similarity, result['query'])
         return {
-            'answer': answer,
-            'context_docs': reranked_docs,
-            'query': query
+            **result,
+            'query': query,
+            'cache_hit': True,
+            'cached_query': result['query'],
+            'cache_similarity': similarity
         }
+
+    def _store_answer(self, query_embedding: np.ndarray, cache_params: tuple, result: Dict):
+        """Guarda una respuesta recién generada en la caché semántica (si está activa)"""
+        if self.answer_cache is not None and query_embedding is not None:
+            self.answer_cache.put(query_embedding, self.index_version, cache_params, dict(result))
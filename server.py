@@ -0,0 +1,349 @@
+"""
+Servicio HTTP (ASGI) del Sistema RAG Legal
+
+Carga el corpus y construye el índice una sola vez al arrancar, y atiende
+consultas concurrentes sobre ese mismo sistema:
+
+    POST /query          {"query": "...", "top_k": 5, "initial_candidates": 20}
+    POST /query/stream   igual, responde NDJSON: eventos "delta" y un "final"
+    POST /structured     {"query": "..."} con el agente de Pydantic AI
+    GET  /health         el proceso responde
+    GET  /ready          el índice está cargado (503 mientras no)
+    GET  /metrics        métricas en formato Prometheus
+
+Con más de max_in_flight consultas en curso, las siguientes esperan en una
+cola de max_queue plazas (como mucho queue_timeout segundos); fuera de ella
+se responde 429 con Retry-After.
+
+Ejecuta: python server.py [--fake] [--port 8000] [--max-in-flight 8]
+"""
+import argparse
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from async_rag_system import AsyncLegalRAGSystem
+from utils.log import get_logger
+
+
+logger = get_logger("server")
+
+StructuredRunner = Callable[[AsyncLegalRAGSystem, str], Awaitable[Dict]]
+
+
+class InFlightLimiter:
+    """
+    Cupo de consultas simultáneas con una cola de espera acotada
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_queue: int = 0, queue_timeout: Optional[float] = 5.0):
+        """
+        Args:
+            max_in_flight: Consultas atendidas a la vez
+            max_queue: Consultas que pueden esperar un hueco (0 = rechazar en cuanto se llena el cupo)
+            queue_timeout: Segundos máximos de espera en la cola (None = sin límite)
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight debe ser al menos 1")
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def acquire(self) -> bool:
+        """Ocupa un hueco; False si el cupo y la cola están llenos o se agota la espera"""
+        if not self._semaphore.locked():
+            # Hay hueco: acquire() no cede el control, así que nadie puede adelantarse
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queue:
+            self.rejected += 1
+            return False
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        """Libera el hueco ocupado por acquire()"""
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {'in_flight': self.in_flight, 'waiting': self.waiting, 'rejected': self.rejected,
+                'max_in_flight': self.max_in_flight, 'max_queue': self.max_queue}
+
+
+def _json_default(value: Any):
+    """Convierte los escalares y arrays de NumPy que pueden aparecer en los resultados"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _dumps(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default)
+
+
+def json_response(payload: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(_dumps(payload), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def _error(message: str, status_code: int, headers: Optional[Dict[str, str]] = None) -> Response:
+    return json_response({'error': message}, status_code=status_code, headers=headers)
+
+
+class _StreamWithSlot(StreamingResponse):
+    """
+    StreamingResponse que libera un hueco del limitador al terminar de servirse
+
+    Se libera en __call__ y no en el generador: si el cliente se desconecta
+    antes del primer evento, el generador no llega a arrancar y su finally no
+    se ejecutaría. release es idempotente por si se llama más de una vez.
+    """
+
+    def __init__(self, content, limiter: InFlightLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self._limiter = limiter
+        self._held = True
+
+    def release(self):
+        if self._held:
+            self._held = False
+            self._limiter.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+async def _read_query(request: Request) -> Dict:
+    """
+    Valida el cuerpo JSON de una consulta
+
+    Raises:
+        ValueError: Si falta 'query' o los parámetros no son enteros positivos
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("El cuerpo debe ser JSON")
+    if not isinstance(body, dict) or not isinstance(body.get('query'), str) or not body['query'].strip():
+        raise ValueError("Falta el campo 'query'")
+    params = {'query': body['query']}
+    for name, default in (('top_k', 5), ('initial_candidates', 20)):
+        value = body.get(name, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError(f"'{name}' debe ser un entero positivo")
+        params[name] = value
+    return params
+
+
+def create_app(rag: AsyncLegalRAGSystem, docs_folder: Optional[str] = "data/legal_docs",
+               max_in_flight: int = 8, max_queue: int = 0, queue_timeout: Optional[float] = 5.0,
+               retry_after: int = 1, structured_runner: Optional[StructuredRunner] = None) -> Starlette:
+    """
+    Crea la aplicación ASGI sobre un sistema RAG compartido
+
+    Args:
+        rag: Sistema (con cliente real o simulado) que atenderá todas las consultas
+        docs_folder: Carpeta a cargar al arrancar (None si rag ya tiene el índice cargado)
+        max_in_flight: Consultas atendidas a la vez
+        max_queue: Consultas que pueden esperar un hueco antes de responder 429
+        queue_timeout: Segundos máximos de espera en la cola
+        retry_after: Valor de la cabecera Retry-After de las respuestas 429
+        structured_runner: Función async (rag, query) → resultado para /structured
+            (None usa arun_legal_agent de legal_agent)
+
+    Returns:
+        Aplicación Starlette (ejecutable con cualquier servidor ASGI, p. ej. uvicorn)
+    """
+    state = {'ready': docs_folder is None, 'error': None}
+    limiter_holder: Dict[str, InFlightLimiter] = {}
+
+    def limiter() -> InFlightLimiter:
+        # El semáforo se crea dentro del event loop que sirve la aplicación
+        if 'limiter' not in limiter_holder:
+            limiter_holder['limiter'] = InFlightLimiter(max_in_flight, max_queue, queue_timeout)
+        return limiter_holder['limiter']
+
+    async def load():
+        try:
+            # La carga embebe el corpus (bloqueante): fuera del event loop
+            await asyncio.to_thread(rag.load_documents_from_folder, docs_folder)
+            state['ready'] = rag.index is not None or (rag.retrieval_mode == "lexical" and bool(rag.chunks))
+            if not state['ready']:
+                state['error'] = f"No se indexó ningún documento de {docs_folder}"
+        except Exception as e:
+            logger.error("❌ Error cargando %s: %s", docs_folder, e)
+            state['error'] = str(e)
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        # El servidor acepta conexiones mientras carga: /health responde y /ready da 503
+        loading = asyncio.create_task(load()) if docs_folder is not None else None
+        yield
+        if loading is not None:
+            loading.cancel()
+
+    async def admit() -> Optional[Response]:
+        """None si la consulta puede pasar; si no, la respuesta de rechazo"""
+        if not state['ready']:
+            return _error("El índice todavía no está cargado", 503, {'Retry-After': str(retry_after)})
+        if not await limiter().acquire():
+            rag.metrics.inc("rag_http_rejected_total")
+            return _error("Demasiadas consultas en curso", 429, {'Retry-After': str(retry_after)})
+        return None
+
+    async def health(request: Request) -> Response:
+        return json_response({'status': "ok"})
+
+    async def ready(request: Request) -> Response:
+        payload = {
+            'ready': state['ready'],
+            'documents': len(rag.documents),
+            'chunks': len(rag.chunks),
+            'index_version': rag.index_version,
+            'retrieval_mode': rag.retrieval_mode,
+            **limiter().stats()
+        }
+        if state['error']:
+            payload['error'] = state['error']
+        return json_response(payload, status_code=200 if state['ready'] else 503)
+
+    async def metrics(request: Request) -> Response:
+        return Response(rag.metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    async def query(request: Request) -> Response:
+        try:
+            params = await _read_query(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+        rejection = await admit()
+        if rejection is not None:
+            return rejection
+        try:
+            return json_response(await rag.aquery(params['query'], top_k=params['top_k'],
+                                                  initial_candidates=params['initial_candidates']))
+        except Exception as e:
+            logger.error("❌ Error en /query: %s", e)
+            return _error(str(e), 500)
+        finally:
+            limiter().release()
+
+    async def query_stream(request: Request) -> Response:
+        try:
+            params = await _read_query(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+        rejection = await admit()
+        if rejection is not None:
+            return rejection
+
+        async def events():
+            try:
+                stream = rag.query_stream(params['query'], top_k=params['top_k'],
+                                          initial_candidates=params['initial_candidates'])
+                async for event in iterate_in_threadpool(stream):
+                    yield _dumps(event) + "\n"
+            except Exception as e:
+                logger.error("❌ Error en /query/stream: %s", e)
+                yield _dumps({'type': 'error', 'error': str(e)}) + "\n"
+
+        # El hueco se ocupa hasta el último evento (o hasta que el cliente se desconecta)
+        return _StreamWithSlot(events(), limiter(), media_type="application/x-ndjson")
+
+    async def structured(request: Request) -> Response:
+        try:
+            params = await _read_query(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+        rejection = await admit()
+        if rejection is not None:
+            return rejection
+        try:
+            runner = structured_runner
+            if runner is None:
+                from legal_agent import arun_legal_agent
+                runner = arun_legal_agent
+            return json_response(await runner(rag, params['query']))
+        except Exception as e:
+            logger.error("❌ Error en /structured: %s", e)
+            return _error(str(e), 500)
+        finally:
+            limiter().release()
+
+    rag.metrics.describe("rag_http_rejected_total", "Consultas rechazadas con 429 por exceso de carga")
+    return Starlette(
+        routes=[
+            Route("/health", health, methods=["GET"]),
+            Route("/ready", ready, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+            Route("/query", query, methods=["POST"]),
+            Route("/query/stream", query_stream, methods=["POST"]),
+            Route("/structured", structured, methods=["POST"]),
+        ],
+        lifespan=lifespan
+    )
+
+
+def build_system(fake: bool = False, **kwargs) -> AsyncLegalRAGSystem:
+    """
+    Sistema para el servicio: con la API de Cohere (COHERE_API_KEY) o con el backend simulado
+    """
+    if fake:
+        from utils.fake_cohere import AsyncFakeCohereClient, FakeCohereClient
+        return AsyncLegalRAGSystem(api_key="", client=FakeCohereClient(), async_client=AsyncFakeCohereClient(), **kwargs)
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("COHERE_API_KEY")
+    if not api_key or api_key == "tu-api-key-aqui":
+        raise SystemExit("❌ Configura COHERE_API_KEY en .env o usa --fake")
+    return AsyncLegalRAGSystem(api_key=api_key, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP del Sistema RAG Legal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--docs", default="data/legal_docs", help="Carpeta de documentos a indexar al arrancar")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Consultas atendidas a la vez")
+    parser.add_argument("--max-queue", type=int, default=16, help="Consultas en espera antes de responder 429")
+    parser.add_argument("--queue-timeout", type=float, default=5.0, help="Segundos máximos en la cola")
+    parser.add_argument("--fake", action="store_true", help="Usar el cliente simulado de Cohere (sin API key)")
+    parser.add_argument("--log-mode", default=None, help='"console", "json" o "silent" (por defecto RAG_LOG_MODE)')
+    args = parser.parse_args()
+
+    import uvicorn
+    from utils.log import configure_logging
+
+    configure_logging(args.log_mode)
+    app = create_app(build_system(fake=args.fake), docs_folder=args.docs, max_in_flight=args.max_in_flight,
+                     max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,53 @@ Tests básicos para el sistema RAG
 
 Ejecuta: python test_rag.py
 """
+import asyncio
+import io
+import json
+import logging
 import os
+import sys
+import tempfile
+import numpy as np
+from cohere.core import ApiError
+from cohere.errors import BadRequestError, TooManyRequestsError
 from dotenv import load_dotenv
 from rag_system import LegalRAGSystem
-from utils.document_loader import DocumentLoader
+from utils.document_loader import ChunkMetadata, Document, DocumentLoader, LoadReport
+import time
+from utils.bm25 import BM25Index, fold_accents, reciprocal_rank_fusion, tokenize
+from utils.cache import LRUCache, SemanticAnswerCache, normalize_query
+from utils.citations import parse_citations
+from utils.context_packer import ContextPacker, estimate_tokens
+from utils.log import configure_logging, get_logger
+from utils.metrics import MetricsRegistry
+from utils.rerank_policy import RerankPolicy
+from utils.embedding_cache import EmbeddingCache, content_hash
+from utils.cohere_session import CohereSession, RetryPolicy, TokenBucket
+from utils.fake_cohere import AsyncFakeCohereClient, FakeCohereClient, FakeCohereServer
+from utils.hits import SearchHits
+from utils.text_store import TextStore
+from utils.vector_index import FlatIndex, IVFIndex, QuantizedIndex, load_index, recall_at_k
+
+
+def rag_simulado(cliente=None, sistema=LegalRAGSystem, **kwargs):
+    """
+    Sistema sin red con data/legal_docs troceado e indexado
+
+    Cada chunk se indexa como [1, longitud] sin llamar a embed: los tests que
+    fijan rag._embed_query controlan así el orden de la búsqueda.
+
+    Args:
+        cliente: FakeCohereClient o subclase con un endpoint a medida (None = uno de 2 dimensiones)
+        sistema: LegalRAGSystem o AsyncLegalRAGSystem
+        **kwargs: Parámetros del sistema (cache_dir=None por defecto)
+    """
+    kwargs.setdefault('cache_dir', None)
+    rag = sistema(api_key="", client=cliente or FakeCohereClient(dim=2), **kwargs)
+    rag.documents = DocumentLoader.load_from_folder("data/legal_docs")
+    rag._build_chunks()
+    rag.index = FlatIndex(np.array([[1.0, float(len(c.content))] for c in rag.chunks]))
+    return rag
 
 
 def test_cargar_documentos():
@@ -89,6 +132,10 @@ def test_query_simple():
         print("   ⏭️  Saltando (API key no configurada)")
         return None
     
+    if not sys.stdin.isatty():
+        print("   ⏭️  Saltando (sin terminal para confirmar el consumo de créditos)")
+        return None
+    
     respuesta = input("   ⚠️  Este test consume créditos de API. ¿Continuar? (s/n): ")
     if respuesta.lower() != 's':
         print("   ⏭️  Test saltado por el usuario")
@@ -145,6 +192,1166 @@ def test_estructura_proyecto():
     return todos_ok
 
 
+def test_cache_embeddings():
+    """Test: Verificar que la caché persistente de embeddings funciona sin API"""
+    print("\n🧪 Test 6: Caché persistente de embeddings")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(tmp)
+            h = content_hash("Artículo 64 - Cómputo de plazos")
+            assert cache.get("embed-test", "search_document", h) is None, "La caché debería estar vacía"
+            
+            cache.put("embed-test", "search_document", h, np.arange(4, dtype=np.float64))
+            
+            # Una instancia nueva (simula un reinicio) debe encontrar el embedding
+            reopened = EmbeddingCache(tmp)
+            found = reopened.get_many("embed-test", "search_document", [h, content_hash("otro")])
+            assert list(found) == [0], "Solo el primer texto debería estar en caché"
+            assert np.allclose(found[0], np.arange(4)), "Embedding recuperado incorrecto"
+            assert reopened.get("otro-modelo", "search_document", h) is None, "La clave debe incluir el modelo"
+            assert reopened.stats() == {'hits': 1, 'misses': 2}, f"Estadísticas incorrectas: {reopened.stats()}"
+        print("   ✅ Embeddings recuperados de disco tras reinicio")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_embeddings_por_lotes():
+    """Test: Verificar que los lotes concurrentes conservan el orden y reintentan"""
+    print("\n🧪 Test 7: Embeddings por lotes concurrentes")
+    
+    class ClienteLotes(FakeCohereClient):
+        """Falla una vez en el lote con el texto "3" """
+        def __init__(self, error=None):
+            super().__init__(dim=8)
+            self.error = error or TooManyRequestsError(body="429 simulado")
+            self.fallo_pendiente = True
+        
+        def embed(self, *, texts, **kwargs):
+            if "3" in texts and self.fallo_pendiente:
+                self.fallo_pendiente = False
+                self._count("embed")
+                raise self.error
+            return super().embed(texts=texts, **kwargs)
+    
+    try:
+        rag = LegalRAGSystem(api_key="", client=ClienteLotes(), cache_dir=None, embed_batch_size=2, embed_max_workers=3)
+        textos = [str(i) for i in range(7)]
+        embeddings = rag._embed_texts(textos, input_type="search_document")
+        assert np.allclose(embeddings, [rag.client.embed_vector(t) for t in textos]), "Orden de embeddings incorrecto"
+        llamadas = rag.client.calls['embed']
+        assert llamadas == 5, f"Se esperaban 4 lotes + 1 reintento, hubo {llamadas} llamadas"
+        print("   ✅ 4 lotes en orden, con un reintento aislado")
+        
+        # Un 400 no es transitorio, y con session reintenta solo su transporte
+        sesion = CohereSession("test")
+        for cliente, session in [(ClienteLotes(BadRequestError(body="400 simulado")), None), (ClienteLotes(), sesion)]:
+            rag = LegalRAGSystem(api_key="", client=cliente, session=session, cache_dir=None, embed_batch_size=2)
+            try:
+                rag._embed_texts(textos, input_type="search_document")
+                raise AssertionError("El error debía propagarse sin reintentar el lote")
+            except ApiError:
+                pass
+        sesion.close()
+        print("   ✅ Sin reintentos de lote ante un 400 ni con session")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_indice_vectorial():
+    """Test: Verificar que el índice normalizado coincide con la similaridad coseno exacta"""
+    print("\n🧪 Test 8: Índice vectorial float32 con top-k parcial")
+    
+    try:
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(200, 32))
+        query = rng.normal(size=32)
+        
+        index = FlatIndex(embeddings)
+        assert index.vectors.dtype == np.float32, "El índice debe guardarse en float32"
+        assert index.vectors.flags['C_CONTIGUOUS'], "El índice debe ser contiguo"
+        
+        # Referencia: coseno en float64 y ordenamiento completo
+        esperado = (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)) @ (query / np.linalg.norm(query))
+        indices, scores = index.search(query, top_n=10)
+        assert list(indices) == list(np.argsort(esperado)[::-1][:10]), "Top 10 distinto del ordenamiento completo"
+        assert np.allclose(scores, esperado[indices], atol=1e-5), "Scores distintos del coseno exacto"
+        assert len(index.search(query, top_n=500)[0]) == 200, "top_n mayor que el corpus debe devolver todo"
+        print("   ✅ Top 10 idéntico a argsort completo")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_cache_queries():
+    """Test: Verificar la caché LRU + TTL de embeddings de query"""
+    print("\n🧪 Test 9: Caché LRU + TTL de queries")
+    
+    try:
+        assert normalize_query("  ¿Cuál es el  plazo para APELAR? ") == normalize_query("¿cuál es el plazo para apelar?"), \
+            "La normalización debe ignorar mayúsculas y espacios"
+        
+        cache = LRUCache(maxsize=2, ttl=None)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")       # "a" pasa a ser la más reciente
+        cache.put("c", 3)    # desaloja "b"
+        assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3, "Desalojo LRU incorrecto"
+        assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1, f"Estadísticas incorrectas: {cache.stats()}"
+        
+        expira = LRUCache(maxsize=10, ttl=0.05)
+        expira.put("q", np.ones(3))
+        assert expira.get("q") is not None, "La entrada debería existir antes del TTL"
+        time.sleep(0.06)
+        assert expira.get("q") is None, "La entrada debería expirar tras el TTL"
+        print(f"   ✅ LRU, TTL y tasa de aciertos ({cache.stats()['hit_rate']:.0%})")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_cache_rerank():
+    """Test: Verificar que el rerank se cachea y se invalida al cambiar el índice"""
+    print("\n🧪 Test 10: Caché de resultados de rerank")
+    
+    try:
+        rag = rag_simulado()
+        docs = rag.documents
+        llamadas = rag.client.calls
+        
+        primero = rag._rerank_documents("¿Plazo para apelar?", docs, top_k=2)
+        segundo = rag._rerank_documents("¿plazo para  apelar?", docs, top_k=2)
+        assert llamadas['rerank'] == 1, "La segunda consulta debería salir de la caché"
+        assert primero == segundo, "El resultado cacheado debe ser idéntico"
+        
+        rag._rerank_documents("¿Plazo para apelar?", docs[::-1], top_k=2)
+        assert llamadas['rerank'] == 2, "Otro orden de candidatos es otra clave"
+        
+        rag._bump_index_version()
+        rag._rerank_documents("¿Plazo para apelar?", docs, top_k=2)
+        assert llamadas['rerank'] == 3, "Cambiar la versión del índice debe invalidar la caché"
+        print("   ✅ Aciertos de caché e invalidación por versión del índice")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_cache_respuestas():
+    """Test: Verificar la caché semántica de respuestas"""
+    print("\n🧪 Test 11: Caché semántica de respuestas")
+    
+    try:
+        cache = SemanticAnswerCache(maxsize=2, threshold=0.95)
+        base = np.array([1.0, 0.0, 0.0])
+        parecida = np.array([1.0, 0.1, 0.0])    # coseno ≈ 0.995
+        distinta = np.array([0.0, 1.0, 0.0])
+        
+        cache.put(base, version=1, params=("m", 5, 20), result={'answer': "10 días", 'query': "q1"})
+        hit = cache.lookup(parecida, version=1, params=("m", 5, 20))
+        assert hit is not None and hit[0]['answer'] == "10 días", "Una consulta parecida debería reutilizar la respuesta"
+        assert cache.lookup(distinta, version=1, params=("m", 5, 20)) is None, "Una consulta distinta no debe acertar"
+        assert cache.lookup(parecida, version=2, params=("m", 5, 20)) is None, "Otra versión del corpus no debe acertar"
+        assert cache.lookup(parecida, version=1, params=("m", 3, 20)) is None, "Otros parámetros no deben acertar"
+        
+        # Llenar la caché desaloja la entrada menos usada
+        cache.put(distinta, version=1, params=("m", 5, 20), result={'answer': "b", 'query': "q2"})
+        cache.lookup(distinta, version=1, params=("m", 5, 20))
+        cache.put(np.array([0.0, 0.0, 1.0]), version=1, params=("m", 5, 20), result={'answer': "c", 'query': "q3"})
+        assert len(cache) == 2 and cache.lookup(base, version=1, params=("m", 5, 20)) is None, "Desalojo por tamaño incorrecto"
+        print("   ✅ Umbral, versión, parámetros y desalojo por tamaño")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_pipeline_asincrono():
+    """Test: Verificar que aquery atiende consultas concurrentes sin bloquear el event loop"""
+    print("\n🧪 Test 12: Pipeline asíncrono (aquery)")
+    
+    from async_rag_system import AsyncLegalRAGSystem
+    
+    try:
+        # Cada llamada asíncrona tarda 50 ms
+        rag = rag_simulado(sistema=AsyncLegalRAGSystem, adaptive_rerank=False,
+                           async_client=AsyncFakeCohereClient(dim=2, latency=0.05, answer="respuesta"))
+        
+        async def consultas():
+            return await asyncio.gather(*[rag.aquery(f"consulta {i}", top_k=2, initial_candidates=3) for i in range(20)])
+        
+        inicio = time.perf_counter()
+        resultados = asyncio.run(consultas())
+        duracion = time.perf_counter() - inicio
+        assert all(r['answer'] == "respuesta" and len(r['context_docs']) == 2 for r in resultados), "Resultados incorrectos"
+        # En serie serían 20 × 150 ms = 3 s
+        assert duracion < 1.5, f"Las consultas no se ejecutaron concurrentemente ({duracion:.2f}s)"
+        print(f"   ✅ 20 consultas concurrentes en {duracion:.2f}s")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_query_stream():
+    """Test: Verificar que query_stream emite deltas y un evento final con tiempos"""
+    print("\n🧪 Test 13: Generación en streaming")
+    
+    try:
+        rag = rag_simulado(FakeCohereClient(dim=2, answer="El plazo es de 10 días."))
+        
+        eventos = list(rag.query_stream("¿Cuál es el plazo para apelar?", top_k=2, initial_candidates=3))
+        deltas = [e['text'] for e in eventos if e['type'] == 'delta']
+        final = eventos[-1]
+        assert deltas == ["El", " plazo", " es", " de", " 10", " días."], f"Deltas incorrectos: {deltas}"
+        assert final['type'] == 'final' and final['answer'] == "".join(deltas), "El evento final debe traer la respuesta"
+        assert len(final['context_docs']) == 2, "El evento final debe traer context_docs"
+        tiempos = final['timings']
+        assert 0 <= tiempos['time_to_first_token'] <= tiempos['generation_time'], f"Tiempos incoherentes: {tiempos}"
+        print(f"   ✅ {len(deltas)} deltas y evento final con context_docs y tiempos")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_query_many():
+    """Test: Verificar query_many (un embed por lote, orden conservado, errores aislados)"""
+    print("\n🧪 Test 14: Consultas por lote (query_many)")
+    
+    class ClienteLote(FakeCohereClient):
+        """Responde con la consulta y falla al generar la respuesta de la consulta 'falla'"""
+        def chat(self, *, message, **kwargs):
+            consulta = message.split("CONSULTA DEL USUARIO:")[1].split("INSTRUCCIONES:")[0].strip()
+            if consulta == "falla":
+                raise RuntimeError("error simulado")
+            respuesta = super().chat(message=message, **kwargs)
+            respuesta.text = f"respuesta a {consulta}"
+            return respuesta
+    
+    try:
+        rag = rag_simulado(ClienteLote(dim=2))
+        
+        consultas = ["cosa juzgada", "falla", "recurso de queja", "efecto devolutivo"]
+        resultados = rag.query_many(consultas, top_k=2, initial_candidates=3, max_concurrency=2)
+        assert [r['query'] for r in resultados] == consultas, "Los resultados deben conservar el orden"
+        llamadas = rag.client.calls['embed']
+        assert llamadas == 1, f"Se esperaba 1 llamada a embed, hubo {llamadas}"
+        assert resultados[1].get('error') == "error simulado", "El error debe quedar aislado en su consulta"
+        assert all(r['answer'] == f"respuesta a {r['query']}" for i, r in enumerate(resultados) if i != 1), \
+            "Las demás consultas deben responderse"
+        print("   ✅ 4 consultas con 1 embed, orden conservado y error aislado")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_query_many_indices_aproximados():
+    """Test: Verificar query_many con índices IVF y cuantizados que devuelven menos filas que top_n"""
+    print("\n🧪 Test 31: Consultas por lote con IVF, cuantización y lápidas")
+    
+    try:
+        consultas = ["¿Plazo para apelar?", "¿Qué es la casación?", "¿Cómo se notifica?"]
+        for parametros in ({'index_type': "ivf"}, {'embedding_precision': "int8"}):
+            rag = LegalRAGSystem(api_key="", client=FakeCohereClient(dim=32), cache_dir=None, citation_lookup=False,
+                                 query_cache_size=0, rerank_cache_size=0, compact_threshold=1.0, **parametros)
+            rag.load_documents_from_folder("data/legal_docs")
+            rag.remove_document("plazos_legales.md")
+            assert rag.index.deleted is not None and rag.index.deleted.any(), "Debe haber lápidas"
+            
+            indices, scores = rag.index.search_many(np.stack([rag._embed_query(c) for c in consultas]), len(rag.chunks))
+            assert indices.shape == scores.shape == (3, len(rag.chunks)), f"Forma incorrecta: {indices.shape}"
+            assert np.all(indices[~np.isfinite(scores)] == -1), "El relleno debe ser -1 con score -inf"
+            
+            resultados = rag.query_many(consultas, top_k=3, initial_candidates=20)
+            assert all(len(r['context_docs']) == 3 and 'error' not in r for r in resultados), f"{parametros}: {resultados}"
+            assert all(d['source'] != "plazos_legales.md" for r in resultados for d in r['context_docs']), \
+                "Los documentos borrados no deben aparecer"
+        
+        # El índice exacto también rellena hasta top_n cuando top_n supera las filas vivas
+        plano = FlatIndex(np.eye(4))
+        plano.remove(np.array([1]))
+        indices, scores = plano.search_many(np.eye(4)[:2], 6)
+        assert indices.shape == scores.shape == (2, 6), f"Forma incorrecta: {indices.shape}"
+        assert indices[0, 0] == 0 and set(indices[0, :3]) == {0, 2, 3}, f"Filas vivas incorrectas: {indices[0]}"
+        assert np.all(indices[:, 3:] == -1) and np.all(np.isneginf(scores[:, 3:])), "El relleno debe ser -1 con score -inf"
+        print("   ✅ query_many con IVF e int8 rellena con -1/-inf y excluye lápidas; FlatIndex rellena igual")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_chunks_por_articulo():
+    """Test: Verificar que los documentos se dividen por encabezados y artículos"""
+    print("\n🧪 Test 15: Chunks por sección y artículo")
+    
+    try:
+        docs = DocumentLoader.load_from_folder("data/legal_docs")
+        codigo = next(d for d in docs if d.metadata['source'] == "codigo_procesal.md")
+        chunks = DocumentLoader.chunk_document(codigo, chunk_size=1000)
+        
+        articulos = [c for c in chunks if "### Artículo" in c.content]
+        assert all(c.content.count("### Artículo") == 1 for c in articulos), "Cada chunk debe contener un solo artículo"
+        assert chunks[0].content.startswith("# Código de Procedimiento Civil"), "El título debe unirse al primer artículo"
+        assert all(codigo.content[c.metadata['start']:c.metadata['end']].strip() == c.content for c in chunks), \
+            "Los offsets deben apuntar al texto original"
+        
+        pequenos = DocumentLoader.chunk_document(codigo, chunk_size=120)
+        assert all(len(c.content) <= 120 for c in pequenos), "Ningún chunk debe superar chunk_size"
+        
+        rag = rag_simulado()
+        assert len(rag.chunk_doc_ids) == len(rag.chunks) > len(docs), "Debe haber más chunks que documentos"
+        assert all(docs[d].metadata['source'] == c.metadata['source'] for c, d in zip(rag.chunks, rag.chunk_doc_ids)), \
+            "El mapeo chunk → documento es incorrecto"
+        print(f"   ✅ {len(chunks)} chunks en codigo_procesal.md, {len(rag.chunks)} en total")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_empaquetado_contexto():
+    """Test: Verificar el empaquetado del contexto con presupuesto de tokens"""
+    print("\n🧪 Test 16: Empaquetado de contexto")
+    
+    try:
+        articulo = "El plazo para apelar es de 10 días. Se cuenta desde la notificación. " * 4
+        docs = [
+            {'content': articulo, 'score': 0.9, 'rank': 1, 'source': "a.md"},
+            {'content': articulo.strip(), 'score': 0.8, 'rank': 2, 'source': "b.md"},    # redundante
+            {'content': "La casación procede por errores de derecho. " * 20, 'score': 0.7, 'rank': 3, 'source': "c.md"},
+        ]
+        presupuesto = estimate_tokens(articulo) + 60
+        empaquetados, stats = ContextPacker(max_tokens=presupuesto).pack(docs)
+        
+        assert [d['source'] for d in empaquetados] == ["a.md", "c.md"], "El pasaje redundante debe descartarse"
+        assert empaquetados[1].get('truncated') and empaquetados[1]['content'].endswith("."), \
+            "El último pasaje debe recortarse en un fin de frase"
+        assert stats['packed_tokens'] <= presupuesto, f"Se excedió el presupuesto: {stats}"
+        total = sum(estimate_tokens(d['content']) for d in docs)
+        assert stats['packed_tokens'] + stats['dropped_tokens'] == total, f"La contabilidad no cuadra: {stats}"
+        print(f"   ✅ {stats['packed_tokens']} tokens empaquetados, {stats['dropped_tokens']} descartados")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_indice_ivf():
+    """Test: Verificar el índice aproximado IVF (recall y serialización)"""
+    print("\n🧪 Test 17: Índice aproximado IVF")
+    
+    try:
+        rng = np.random.default_rng(0)
+        # Corpus sintético agrupado (como los embeddings reales, no uniforme)
+        centros = rng.normal(size=(50, 32))
+        embeddings = centros[rng.integers(0, 50, 5000)] + 0.3 * rng.normal(size=(5000, 32))
+        queries = embeddings[rng.integers(0, 5000, 50)] + 0.1 * rng.normal(size=(50, 32))
+        
+        exacto = FlatIndex(embeddings)
+        ivf = IVFIndex(embeddings, nlist=64, nprobe=8)
+        recall = recall_at_k(ivf, exacto, queries, k=10)
+        assert recall >= 0.9, f"Recall@10 demasiado bajo: {recall:.2f}"
+        
+        ivf.nprobe = ivf.nlist
+        assert recall_at_k(ivf, exacto, queries, k=10) == 1.0, "Con nprobe = nlist la búsqueda debe ser exacta"
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            ruta = os.path.join(tmp, "indice.npz")
+            ivf.save(ruta)
+            cargado = load_index(ruta)
+        assert isinstance(cargado, IVFIndex) and cargado.nprobe == ivf.nprobe, "El índice cargado no coincide"
+        assert list(cargado.search(queries[0], 5)[0]) == list(ivf.search(queries[0], 5)[0]), "Resultados distintos tras cargar"
+        print(f"   ✅ Recall@10 = {recall:.2f} con nprobe=8/64; guardado y cargado")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_precision_embeddings():
+    """Test: Verificar los índices cuantizados (memoria y pérdida de recall)"""
+    print("\n🧪 Test 18: Precisión reducida de embeddings")
+    
+    try:
+        rng = np.random.default_rng(0)
+        centros = rng.normal(size=(50, 64))
+        embeddings = centros[rng.integers(0, 50, 5000)] + 0.5 * rng.normal(size=(5000, 64))
+        queries = embeddings[rng.integers(0, 5000, 50)] + 0.2 * rng.normal(size=(50, 64))
+        exacto = FlatIndex(embeddings)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            for precision, ahorro, minimo in [("float16", 2, 0.99), ("int8", 4, 0.99), ("binary", 32, 0.9)]:
+                ruta = os.path.join(tmp, f"{precision}.npy") if precision == "binary" else None
+                indice = QuantizedIndex(embeddings, precision=precision, rescore_path=ruta)
+                assert indice.rescore_vectors is not None, f"{precision}: sin vectores float32 para re-puntuar"
+                recall = recall_at_k(indice, exacto, queries, k=10)
+                sin_rescore = recall_at_k(QuantizedIndex(embeddings, precision=precision, rescore=False),
+                                          exacto, queries, k=10)
+                factor = exacto.nbytes / indice.nbytes
+                assert factor >= ahorro * 0.9, f"{precision}: la memoria solo baja {factor:.1f}x"
+                assert recall >= minimo, f"{precision}: Recall@10 demasiado bajo: {recall:.2f}"
+                assert recall >= sin_rescore, f"{precision}: re-puntuar empeora el recall"
+                print(f"   ✅ {precision}: {factor:.1f}x menos memoria, Recall@10 = {recall:.2f} "
+                      f"({sin_rescore:.2f} sin re-puntuar en float32)")
+            
+            temporal = QuantizedIndex(embeddings, precision="int8").rescore_path
+            assert not os.path.exists(temporal), "El archivo temporal sobrevive al índice"
+            
+            indice.save(os.path.join(tmp, "binario.npz"))
+            cargado = load_index(os.path.join(tmp, "binario.npz"))
+            assert list(cargado.search(queries[0], 5)[0]) == list(indice.search(queries[0], 5)[0]), "Resultados distintos tras cargar"
+            del indice, cargado
+            
+            # Sin rescore_path los vectores están en un archivo temporal: no se puede guardar
+            try:
+                QuantizedIndex(embeddings, precision="int8").save(os.path.join(tmp, "temporal.npz"))
+                raise AssertionError("Guardar un índice con vectores temporales debe fallar")
+            except ValueError:
+                pass
+            # Si falta el archivo de vectores, la carga avisa de que se pierde recall
+            os.remove(os.path.join(tmp, "binary.npy"))
+            avisos = io.StringIO()
+            handler = logging.StreamHandler(avisos)
+            get_logger("vector_index").addHandler(handler)
+            try:
+                sin_vectores = load_index(os.path.join(tmp, "binario.npz"))
+            finally:
+                get_logger("vector_index").removeHandler(handler)
+            assert sin_vectores.rescore_vectors is None and "binary.npy" in avisos.getvalue(), "Falta el aviso"
+        
+        rag = LegalRAGSystem(api_key="test", cache_dir=None, embedding_precision="int8")
+        assert rag.index_type == "quantized" and rag.index_params == {'precision': "int8"}, "Parámetros de índice incorrectos"
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_actualizacion_incremental():
+    """Test: Verificar altas, bajas y sincronización sin reconstruir el índice"""
+    print("\n🧪 Test 19: Actualización incremental del índice")
+    
+    class ClienteContador(FakeCohereClient):
+        """Cuenta también los textos embebidos y falla mientras falla sea True"""
+        textos = 0
+        falla = False
+        
+        def embed(self, *, texts, **kwargs):
+            if self.falla:
+                raise RuntimeError("embed simulado caído")
+            self.textos += len(texts)
+            return super().embed(texts=texts, **kwargs)
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for nombre in ("a.md", "b.md", "c.md"):
+                with open(os.path.join(tmp, nombre), "w", encoding="utf-8") as f:
+                    f.write(f"# {nombre}\n\nContenido del documento {nombre}.")
+            
+            rag = LegalRAGSystem(api_key="", client=ClienteContador(dim=16), cache_dir=None, chunk_size=None,
+                                 compact_threshold=0.7)
+            llamadas = rag.client.calls
+            rag.load_documents_from_folder(tmp)
+            assert len(rag.index) == 3 and llamadas['embed'] == 1, "La carga inicial debe embeber los 3 documentos"
+            
+            # Sin cambios: no se lee ni se embebe nada
+            resumen = rag.sync_folder(tmp)
+            assert len(resumen['unchanged']) == 3 and llamadas['embed'] == 1, f"Sincronización sin cambios: {resumen}"
+            
+            # Un documento nuevo, uno modificado y uno borrado
+            with open(os.path.join(tmp, "d.md"), "w", encoding="utf-8") as f:
+                f.write("# d.md\n\nNueva sentencia.")
+            with open(os.path.join(tmp, "b.md"), "w", encoding="utf-8") as f:
+                f.write("# b.md\n\nContenido modificado, bastante más largo que el original.")
+            os.remove(os.path.join(tmp, "c.md"))
+            version = rag.index_version
+            resumen = rag.sync_folder(tmp)
+            assert [os.path.basename(p) for p in resumen['added']] == ["d.md"], f"Altas incorrectas: {resumen}"
+            assert [os.path.basename(p) for p in resumen['updated']] == ["b.md"], f"Cambios incorrectos: {resumen}"
+            assert [os.path.basename(p) for p in resumen['removed']] == ["c.md"], f"Bajas incorrectas: {resumen}"
+            assert llamadas['embed'] == 2 and rag.client.textos == 5, "Solo deben embeberse b.md y d.md, en una llamada"
+            assert rag.index_version > version, "La versión del índice debe cambiar"
+            
+            fuentes = sorted(d.metadata['source'] for d in rag.documents)
+            assert fuentes == ["a.md", "b.md", "d.md"], f"Documentos incorrectos: {fuentes}"
+            encontrados = {rag.chunks[i].metadata['source'] for i in rag.index.search(rag.client.embed_vector("documento"), 10)[0]}
+            assert encontrados == set(fuentes), f"La búsqueda devuelve filas borradas: {encontrados}"
+            assert all(rag.documents[d].metadata['source'] == c.metadata['source']
+                       for c, d in zip(rag.chunks, rag.chunk_doc_ids) if d >= 0), "El mapeo chunk → documento es incorrecto"
+            
+            # Al superar compact_threshold las lápidas se eliminan
+            assert len(rag.index) == 5 and rag.index.live_count == 3, "b.md y c.md deben quedar como lápidas"
+            rag.compact_threshold = 0.5
+            rag.remove_document("a.md")
+            assert len(rag.index) == len(rag.chunks) == 2 and rag.index.deleted is None, "El índice debía compactarse"
+            resumen_cargas = f"{llamadas['embed']} llamadas a embed para 2 cargas; índice compactado a {len(rag.index)} filas"
+            
+            # Si embed falla al sincronizar, el corpus no cambia y la siguiente sincronización lo reintenta
+            with open(os.path.join(tmp, "e.md"), "w", encoding="utf-8") as f:
+                f.write("# e.md\n\nArt. 500 Norma que no llega a indexarse a la primera.")
+            rag.client.falla = True
+            try:
+                rag.sync_folder(tmp)
+                raise AssertionError("El error de embed debe propagarse")
+            except RuntimeError:
+                pass
+            assert len(rag.documents) == 2 and not rag.citations.lookup("Art. 500"), "El fallo no debe dejar restos"
+            rag.client.falla = False
+            rag.query("¿Qué dice el Art. 500?", top_k=2, initial_candidates=2)
+            resumen = rag.sync_folder(tmp)
+            assert [os.path.basename(p) for p in resumen['added']] == ["e.md"], f"e.md debía reintentarse: {resumen}"
+            assert rag.query("¿Qué dice el Art. 500?")['context_docs'][0]['citation'] == "Art. 500"
+            print(f"   ✅ {resumen_cargas}; alta reintentada tras un fallo de embed")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_busqueda_lexica():
+    """Test: Verificar BM25, la fusión RRF y el modo léxico sin llamadas de embed"""
+    print("\n🧪 Test 20: Búsqueda léxica BM25 e híbrida")
+    
+    try:
+        assert fold_accents("Artículo APELACIÓN año") == "articulo apelacion año", "Plegado de tildes incorrecto"
+        assert tokenize("los Recursos de Queja del Art. 186") == ["recurso", "queja", "articulo", "186"], \
+            f"Tokenización incorrecta: {tokenize('los Recursos de Queja del Art. 186')}"
+        for singular, plural in [("parte", "partes"), ("demandante", "demandantes"), ("tribunal", "tribunales"), ("juez", "jueces")]:
+            assert tokenize(singular) == tokenize(plural), f"{plural} debe reducirse a {singular}: {tokenize(plural)}"
+        assert tokenize("interés") == ["interes"], "Un singular en -és no es un plural"
+        
+        indices, scores = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 4])], top_n=3, k=60)
+        assert list(indices[:2]) == [1, 3], f"RRF debe premiar lo que aparece en ambos rankings: {indices}"
+        
+        rag = rag_simulado(FakeCohereClient(dim=2, answer="respuesta"), retrieval_mode="lexical", context_max_tokens=None)
+        indice, rag.index = rag.index, None
+        
+        candidatos = rag._retrieve("Art. 186 recurso de apelación", top_n=3)
+        assert "Artículo 186" in candidatos[0].content, f"El primer candidato debe ser el Art. 186: {candidatos[0].content[:60]}"
+        
+        # Sin índice vectorial y sin embed: el modo léxico responde igual (con 2 candidatos no hay rerank)
+        resultado = rag.query("¿Qué es el recurso de queja?", top_k=2, initial_candidates=2)
+        assert resultado['answer'] == "respuesta" and resultado['context_docs'], "El modo léxico debe responder"
+        assert "queja" in fold_accents(resultado['context_docs'][0]['content']), "El contexto debe mencionar la queja"
+        assert rag.client.calls['embed'] == 0, "El modo léxico no debe llamar a embed"
+        
+        # Híbrido: los chunks que aparecen en ambos rankings suben
+        rag.retrieval_mode = "hybrid"
+        rag.index = indice
+        rag._embed_query = lambda q: np.array([1.0, 300.0])
+        hibridos = rag._retrieve("Art. 186 recurso de apelación", top_n=5)
+        assert "Artículo 186" in hibridos[0].content or "Artículo 186" in hibridos[1].content, "El Art. 186 debe quedar arriba"
+        
+        bm25 = BM25Index(["recurso de queja", "plazo de apelación", "queja"])
+        bm25.remove([2])
+        assert list(bm25.search("queja", 5)[0]) == [0], "Las filas borradas no deben puntuar"
+        assert list(bm25.compact()) == [0, 1] and list(bm25.search("apelacion", 5)[0]) == [1], "Compactación incorrecta"
+        print("   ✅ Art. 186 encontrado por BM25; modo léxico sin llamadas de embed")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_citas_exactas():
+    """Test: Verificar que las citas de artículos se resuelven sin embed ni rerank"""
+    print("\n🧪 Test 21: Índice de citas exactas")
+    
+    class ClienteConPrompt(FakeCohereClient):
+        """Guarda el último prompt de chat"""
+        prompt = None
+        
+        def chat(self, *, message, **kwargs):
+            self.prompt = message
+            return super().chat(message=message, **kwargs)
+    
+    try:
+        assert parse_citations("¿Qué dicen los arts. 186 y 189?") == ["186", "189"], "Citas mal detectadas"
+        assert parse_citations("¿Qué dice el Artículo 64 del CPC?") == ["64"], "Citas mal detectadas"
+        assert parse_citations("¿Cuál es el plazo para apelar?") == [], "No hay citas en esta consulta"
+        assert parse_citations("¿Qué dice el art. 189 y 10 días de plazo?") == ["189"], "10 días no es un artículo"
+        assert parse_citations("el artículo 5, 3 veces") == ["5"], "3 veces no es un artículo"
+        assert parse_citations("arts. 186, 187 y 2 años") == ["186", "187"], "2 años no es un artículo"
+        
+        rag = rag_simulado(ClienteConPrompt(dim=2))
+        
+        resultado = rag.query("¿Qué dice el Art. 186?")
+        docs = resultado['context_docs']
+        assert len(docs) == 1 and docs[0]['exact_citation'] and docs[0]['citation'] == "Art. 186", f"Contexto incorrecto: {docs}"
+        assert docs[0]['content'].startswith("### Artículo 186") and "Artículo 189" not in docs[0]['content'], \
+            "El pasaje debe ser exactamente el artículo citado"
+        assert "Artículo 186" in rag.client.prompt, "El pasaje debe llegar al prompt"
+        
+        # El Art. 189 aparece dos veces en el código: se devuelven ambos pasajes
+        docs = rag.query("Art. 189 del Código de Procedimiento Civil")['context_docs']
+        assert [d['citation'] for d in docs] == ["Art. 189", "Art. 189"], f"Se esperaban dos pasajes: {docs}"
+        docs = rag.query("¿Qué dice el art 64 del CPC?")['context_docs']
+        assert [d['citation'] for d in docs] == ["Art. 64"], f"La sigla del código debe reconocerse: {docs}"
+        assert rag.client.calls['embed'] == rag.client.calls['rerank'] == 0, "Una cita exacta no llama a embed ni a rerank"
+        print(f"   ✅ {len(rag.citations)} artículos indexados; Art. 186 resuelto sin embed ni rerank")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_politica_rerank():
+    """Test: Verificar cuándo se omite o se acota el rerank"""
+    print("\n🧪 Test 22: Política adaptativa de rerank")
+    
+    class ClienteRerank(FakeCohereClient):
+        """Guarda cuántos documentos recibe cada llamada a rerank"""
+        def __init__(self):
+            super().__init__(dim=2)
+            self.enviados = []
+        
+        def rerank(self, *, documents, **kwargs):
+            self.enviados.append(len(documents))
+            return super().rerank(documents=documents, **kwargs)
+    
+    try:
+        politica = RerankPolicy(skip_margin=0.1, narrow_gap=0.08)
+        assert politica.decide([0.5, 0.4], top_k=5)['reason'] == "few_candidates", "Con ≤ top_k candidatos no hay rerank"
+        assert politica.decide([0.8, 0.5, 0.49, 0.48], top_k=2)['reason'] == "dominant_hit", "Un primer score dominante omite el rerank"
+        acotada = politica.decide([0.60, 0.58, 0.57, 0.56, 0.30, 0.29], top_k=2)
+        assert acotada['action'] == "narrow" and acotada['sent'] == 4, f"Debe cortarse en el salto de score: {acotada}"
+        assert politica.decide([0.6, 0.59, 0.58, 0.57], top_k=2)['action'] == "rerank", "Sin salto ni margen se hace rerank"
+        assert politica.decide([9.0, 3.0, 2.0], top_k=2, scores_comparable=False)['action'] == "rerank", \
+            "Con scores BM25/RRF solo cuenta el número de candidatos"
+        completa = RerankPolicy(skip_at_most_top_k=False)
+        assert completa.decide([0.5], top_k=5)['reason'] == "single_candidate", "Un candidato no se reordena"
+        assert completa.decide([], top_k=5)['reason'] == "no_candidates", "Sin candidatos no hay rerank"
+        try:
+            politica.decide([0.5, 0.4], top_k=0)
+            raise AssertionError("top_k=0 debe rechazarse")
+        except ValueError:
+            pass
+        
+        rag = rag_simulado(ClienteRerank(), context_max_tokens=None, citation_lookup=False)
+        rag._embed_query = lambda q: np.array([1.0, 300.0])
+        
+        resultado = rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=3)
+        assert resultado['rerank']['action'] == "skip" and rag.client.enviados == [], "3 candidatos para top_k=3: sin rerank"
+        assert [d['rank'] for d in resultado['context_docs']] == [1, 2, 3], "Debe conservarse el orden de la búsqueda"
+        
+        rag.rerank_policy = None
+        resultado = rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=3)
+        assert resultado['rerank']['action'] == "rerank" and rag.client.enviados == [3], "Sin política siempre hay rerank"
+        print("   ✅ Rerank omitido, acotado o completo según los scores; decisión en el resultado")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_tiempos_y_uso():
+    """Test: Verificar tiempos por etapa, uso de la API y exportación Prometheus"""
+    print("\n🧪 Test 23: Tiempos por etapa y uso de la API")
+    
+    try:
+        # El cliente simulado informa unidades facturadas como la API de Cohere
+        rag = rag_simulado(FakeCohereClient(dim=2, answer="respuesta"), citation_lookup=False, adaptive_rerank=False,
+                           metrics=MetricsRegistry())
+        salida = estimate_tokens("respuesta")
+        
+        resultado = rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=6)
+        etapas = {"query_embed", "similarity_scan", "rerank", "context_pack", "prompt_build", "chat", "total"}
+        assert etapas <= set(resultado['timings']), f"Faltan etapas: {etapas - set(resultado['timings'])}"
+        assert all(t >= 0 for t in resultado['timings'].values()), "Los tiempos no pueden ser negativos"
+        assert resultado['usage']['rerank']['billed_units'] == {'search_units': 1}, f"Uso de rerank: {resultado['usage']}"
+        tokens = resultado['usage']['chat']['tokens']
+        assert tokens['input_tokens'] > 0 and tokens['output_tokens'] == salida, f"Tokens del chat: {tokens}"
+        assert resultado['usage']['embed']['billed_units'] == {'input_tokens': estimate_tokens("¿Plazo para apelar?")}, \
+            "Tokens del embedding de la query"
+        
+        final = list(rag.query_stream("¿Qué es la casación?", top_k=3, initial_candidates=6))[-1]
+        assert {"chat", "total", "time_to_first_token", "generation_time"} <= set(final['timings']), final['timings']
+        assert final['usage']['chat']['billed_units']['output_tokens'] == salida, "El uso del stream llega en stream-end"
+        
+        resumen = rag.metrics.summary("rag_stage_seconds", "stage")
+        assert resumen['chat']['count'] == 2 and resumen['total']['p99'] >= resumen['total']['p50'], resumen
+        assert rag.metrics.counter("rag_api_units_total", endpoint="rerank", kind="billed_units", unit="search_units") == 2
+        texto = rag.metrics.render_prometheus()
+        assert '# TYPE rag_stage_seconds histogram' in texto, "Falta la cabecera del histograma"
+        assert 'rag_stage_seconds_bucket{stage="rerank",le="+Inf"} 2' in texto, "Falta el bucket +Inf"
+        assert 'rag_stage_seconds_count{stage="chat"} 2' in texto, "Falta el contador del histograma"
+        print(f"   ✅ {len(resultado['timings'])} etapas medidas; uso facturado y exportación Prometheus correctos")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_logging_estructurado():
+    """Test: Verificar logs JSON con ID de consulta y el modo silencioso"""
+    print("\n🧪 Test 24: Logging estructurado y modo silencioso")
+    
+    class Contador:
+        """Argumento de log que cuenta cuántas veces se formatea"""
+        veces = 0
+        
+        def __str__(self):
+            Contador.veces += 1
+            return "contador"
+    
+    raiz = logging.getLogger("legal_rag")
+    try:
+        rag = rag_simulado(citation_lookup=False)
+        
+        salida = io.StringIO()
+        configure_logging("json", stream=salida)
+        resultado = rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=3)
+        registros = [json.loads(linea) for linea in salida.getvalue().splitlines()]
+        assert registros, "El modo JSON debe emitir registros"
+        assert all({'ts', 'level', 'logger', 'query_id', 'message'} <= set(r) for r in registros), registros[0]
+        assert {r['query_id'] for r in registros} == {resultado['query_id']}, "Todos los registros llevan el ID de la consulta"
+        assert any(r['message'].startswith("🔍 [Paso 1]") for r in registros), "Falta el registro del paso 1"
+        
+        configure_logging("silent")
+        get_logger("test").info("%s", Contador())
+        rag.query("¿Qué es la casación?", top_k=3, initial_candidates=3)
+        assert Contador.veces == 0, "En modo silencioso no se formatea ningún mensaje"
+        assert not raiz.isEnabledFor(logging.CRITICAL), "El modo silencioso desactiva todos los niveles"
+        print(f"   ✅ {len(registros)} registros JSON con query_id {resultado['query_id']}; modo silencioso sin formateo")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+    finally:
+        # Volver a la configuración por defecto de la librería (sin salida)
+        raiz.handlers = [h for h in raiz.handlers if isinstance(h, logging.NullHandler)]
+        raiz.setLevel(logging.NOTSET)
+        raiz.propagate = True
+
+
+def test_cliente_simulado():
+    """Test: Verificar el cliente simulado de Cohere y el benchmark offline"""
+    print("\n🧪 Test 25: Cliente simulado y benchmark offline")
+    
+    from async_rag_system import AsyncLegalRAGSystem
+    import benchmark
+    
+    raiz = logging.getLogger("legal_rag")
+    try:
+        
+        a, b = FakeCohereClient(dim=64), FakeCohereClient(dim=64)
+        texto = "Plazo para apelar la sentencia definitiva"
+        assert np.array_equal(a.embed_vector(texto), b.embed_vector(texto)), "Los embeddings deben ser deterministas"
+        assert abs(float(np.linalg.norm(a.embed_vector(texto))) - 1.0) < 1e-5, "Los embeddings deben estar normalizados"
+        
+        lento = FakeCohereClient(dim=64, latency={'chat': 0.02}, jitter=0.01, answer="respuesta fija")
+        rag = LegalRAGSystem(api_key="", client=lento, cache_dir=None, citation_lookup=False)
+        rag.load_documents_from_folder("data/legal_docs")
+        resultado = rag.query("¿Cuál es el plazo para apelar?", top_k=2, initial_candidates=6)
+        assert resultado['answer'] == "respuesta fija", "La respuesta debe venir del cliente simulado"
+        assert resultado['context_docs'][0]['source'] == "plazos_legales.md", \
+            f"Los embeddings simulados deben recuperar el documento de plazos: {resultado['context_docs'][0]['source']}"
+        assert 0.02 <= resultado['timings']['chat'] < 0.5, f"Latencia simulada de chat: {resultado['timings']['chat']}"
+        final = list(rag.query_stream("¿Qué es la casación?", top_k=2, initial_candidates=6))[-1]
+        assert final['answer'] == "respuesta fija" and final['usage']['chat'], "El stream simulado termina con stream-end"
+        
+        rag_async = AsyncLegalRAGSystem(api_key="", async_client=AsyncFakeCohereClient(dim=64), client=FakeCohereClient(dim=64),
+                                        cache_dir=None, citation_lookup=False)
+        rag_async.load_documents_from_folder("data/legal_docs")
+        
+        async def consultar():
+            consultas = ["¿Plazo para apelar?", "¿Qué es la casación?"]
+            return await asyncio.gather(*(rag_async.aquery(q, top_k=2, initial_candidates=6) for q in consultas))
+        
+        respuestas = asyncio.run(consultar())
+        assert all(r['answer'].startswith("Respuesta simulada") for r in respuestas), "aquery debe usar el cliente asíncrono"
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            salida = os.path.join(tmp, "bench.json")
+            informe = benchmark.main(["--sizes", "200", "--queries", "10", "--warmup", "1", "--dim", "64",
+                                      "--no-isolate", "--output", salida])
+            with open(salida, encoding="utf-8") as f:
+                guardado = json.load(f)
+        medida = guardado['results'][0]
+        assert medida['chunks'] == 200 and medida['queries'] == 10, f"Tamaño medido: {medida['chunks']}"
+        assert {'p50', 'p95', 'p99'} <= set(medida['latency_ms']) and medida['throughput_qps']['sequential'] > 0
+        assert 'similarity_scan' in medida['stages_ms'] and medida['load_seconds'] >= 0
+        assert benchmark.comparar(informe, guardado)[1].startswith("   200 chunks"), "Comparación con un informe anterior"
+        print(f"   ✅ Cliente determinista, latencia simulada y benchmark (p50 {medida['latency_ms']['p50']} ms)")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+    finally:
+        # benchmark.main configura el modo silencioso en este proceso (--no-isolate)
+        raiz.handlers = [h for h in raiz.handlers if isinstance(h, logging.NullHandler)]
+        raiz.setLevel(logging.NOTSET)
+        raiz.propagate = True
+
+
+def test_servicio_http():
+    """Test: Verificar el servicio ASGI (consultas, streaming, readiness y cupo con 429)"""
+    print("\n🧪 Test 26: Servicio HTTP")
+    
+    try:
+        import httpx
+        from starlette.testclient import TestClient
+        from server import build_system, create_app
+    except ImportError as e:
+        print(f"   ⏭️  Saltando (falta {e.name})")
+        return None
+    
+    async def estructurada(rag, query):
+        return {'answer': f"estructurada: {query}", 'structured': True}
+    
+    try:
+        rag = build_system(fake=True, cache_dir=None, citation_lookup=False)
+        app = create_app(rag, docs_folder="data/legal_docs", structured_runner=estructurada)
+        sin_arrancar = TestClient(app)
+        assert sin_arrancar.get("/ready").status_code == 503, "Sin cargar el índice no está listo"
+        assert sin_arrancar.post("/query", json={'query': "¿Plazo?"}).status_code == 503, "Las consultas esperan al índice"
+        
+        with TestClient(app) as cliente:
+            # El índice se carga en segundo plano tras arrancar
+            for _ in range(100):
+                listo = cliente.get("/ready")
+                if listo.status_code == 200:
+                    break
+                time.sleep(0.05)
+            assert listo.status_code == 200 and listo.json()['chunks'] > 0, listo.text
+            assert cliente.get("/health").json() == {'status': "ok"}
+            
+            respuesta = cliente.post("/query", json={'query': "¿Cuál es el plazo para apelar?", 'top_k': 2})
+            assert respuesta.status_code == 200, respuesta.text
+            assert len(respuesta.json()['context_docs']) == 2 and 'timings' in respuesta.json()
+            assert cliente.post("/query", json={'top_k': 2}).status_code == 400, "Sin 'query' es 400"
+            
+            eventos = [json.loads(linea) for linea in cliente.post("/query/stream", json={'query': "¿Qué es la casación?"}).text.splitlines()]
+            assert eventos[-1]['type'] == "final" and all(e['type'] == "delta" for e in eventos[:-1]), "NDJSON con deltas y final"
+            assert cliente.post("/structured", json={'query': "¿Plazo?"}).json()['answer'] == "estructurada: ¿Plazo?"
+            assert "rag_stage_seconds_count" in cliente.get("/metrics").text
+        
+        # Cupo de 1 sin cola: con una consulta lenta en curso, la siguiente recibe 429
+        rag.async_client.latency = {'chat': 0.3}
+        app = create_app(rag, docs_folder=None, max_in_flight=1, max_queue=0)
+        
+        async def concurrentes():
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://test") as cliente:
+                return await asyncio.gather(*(cliente.post("/query", json={'query': f"¿Plazo {i}?"}) for i in range(3)))
+        
+        codigos = sorted(r.status_code for r in asyncio.run(concurrentes()))
+        assert codigos == [200, 429, 429], f"Solo una consulta debe entrar: {codigos}"
+        
+        # Un cliente que se va antes del primer evento de /query/stream no debe quedarse el hueco
+        async def desconectado():
+            cuerpo = json.dumps({'query': "¿Plazo?"}).encode()
+            mensajes = [{'type': "http.request", 'body': cuerpo, 'more_body': False}]
+            
+            async def receive():
+                return mensajes.pop(0) if mensajes else {'type': "http.disconnect"}
+            
+            async def send(mensaje):
+                raise OSError("cliente desconectado")
+            
+            scope = {'type': "http", 'asgi': {'version': "3.0", 'spec_version': "2.4"}, 'http_version': "1.1",
+                     'method': "POST", 'path': "/query/stream", 'raw_path': b"/query/stream", 'query_string': b"",
+                     'root_path': "", 'scheme': "http", 'server': ("test", 80), 'client': ("test", 1),
+                     'headers': [(b"content-type", b"application/json")]}
+            try:
+                await app(scope, receive, send)
+            except Exception:
+                pass
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://test") as cliente:
+                return await cliente.post("/query", json={'query': "¿Plazo?"})
+        
+        assert asyncio.run(desconectado()).status_code == 200, "El hueco de un stream abandonado debe liberarse"
+        print("   ✅ /query, /query/stream, /structured, readiness y 429 con el cupo lleno")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_busqueda_concurrente():
+    """Test: Verificar que varios hilos comparten un sistema sin mezclar scores"""
+    print("\n🧪 Test 27: Resultados inmutables y consultas concurrentes")
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    try:
+        rag = LegalRAGSystem(api_key="", client=FakeCohereClient(dim=64), cache_dir=None, citation_lookup=False,
+                             query_cache_size=0, rerank_cache_size=0)
+        rag.load_documents_from_folder("data/legal_docs")
+        
+        hits = rag._retrieve("¿Plazo para apelar?", top_n=6)
+        assert isinstance(hits, SearchHits) and len(hits) == 6, f"El paso 1 devuelve SearchHits: {hits!r}"
+        assert hits[0].row == int(hits.rows[0]) and hits[0].content == rag.chunks[hits[0].row].content
+        assert isinstance(hits[:3], SearchHits) and len(hits[:3]) == 3, "Cortar devuelve otro SearchHits"
+        try:
+            hits.scores[0] = 0.0
+            raise AssertionError("Los scores deben ser de solo lectura")
+        except ValueError:
+            pass
+        assert not any(hasattr(chunk, 'similarity_score') for chunk in rag.chunks), "El corpus no debe modificarse"
+        assert len(SearchHits(np.array([3, 1]), np.array([0.5, -np.inf]), rag.chunks)) == 1, "Los -inf se descartan"
+        
+        consultas = ["¿Plazo para apelar?", "¿Qué es la casación?", "¿Cómo se notifica una resolución?",
+                     "¿Qué efectos tiene la apelación?", "¿Cuándo procede el recurso de queja?"] * 8
+        
+        def scores(consulta):
+            candidatos = rag._retrieve(consulta, top_n=6)
+            contexto = rag.query(consulta, top_k=3, initial_candidates=6)['context_docs']
+            return candidatos.rows.tolist(), candidatos.scores.tolist(), [d['score'] for d in contexto]
+        
+        esperados = {consulta: scores(consulta) for consulta in set(consultas)}
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            obtenidos = list(executor.map(scores, consultas))
+        assert all(obtenido == esperados[consulta] for consulta, obtenido in zip(consultas, obtenidos)), \
+            "Cada hilo debe obtener exactamente los scores de su consulta"
+        print(f"   ✅ {len(consultas)} consultas en 8 hilos con los mismos resultados que en secuencia")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_almacen_de_texto():
+    """Test: Verificar que el corpus se guarda en un buffer contiguo sin copiar texto por chunk"""
+    print("\n🧪 Test 28: Almacén de texto compacto")
+    
+    try:
+        texto = "# Título\n\nArt. 1 Según el artículo, la notificación es válida.\n\n  Art. 2 Plazo de apelación: cinco días.  "
+        store = TextStore()
+        documento = store.add(Document(texto, {'source': "prueba.md", 'path': "data/prueba.md", 'type': "markdown"}))
+        assert documento.store is store and documento.content == texto and store.nbytes == len(texto.encode('utf-8'))
+        assert not hasattr(documento, '__dict__'), "Document debe usar __slots__"
+        
+        chunks = DocumentLoader.chunk_document(documento, chunk_size=40)
+        assert all(c.store is store for c in chunks), "Los chunks son rangos del mismo buffer"
+        assert all(texto[c.metadata['start']:c.metadata['end']].strip() == c.content for c in chunks), \
+            "Los rangos de bytes deben coincidir con los offsets en caracteres"
+        assert store.nbytes == len(texto.encode('utf-8')), "Dividir no añade texto al almacén"
+        assert isinstance(chunks[0].metadata, ChunkMetadata) and chunks[0].metadata._base is documento.metadata
+        chunks[0].metadata['doc_id'] = 3
+        chunks[0].metadata['extra'] = 1
+        assert 'doc_id' not in chunks[1].metadata and 'extra' not in documento.metadata, "Cada chunk escribe en lo suyo"
+        assert dict(chunks[0].metadata) == {'source': "prueba.md", 'path': "data/prueba.md", 'type': "markdown",
+                                            'extra': 1, 'chunk_id': 0, 'start': 0, 'end': chunks[0].metadata['end'],
+                                            'doc_id': 3}
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            resultados = []
+            for ruta in (None, os.path.join(tmp, "corpus.txt")):
+                rag = LegalRAGSystem(api_key="", client=FakeCohereClient(dim=64), cache_dir=None, text_store_path=ruta)
+                rag.load_documents_from_folder("data/legal_docs")
+                originales = DocumentLoader.load_from_folder("data/legal_docs")
+                assert [d.content for d in rag.documents] == [d.content for d in originales], "El texto no debe cambiar"
+                assert all(c.store is rag.text_store for c in rag.chunks)
+                assert len({id(c.metadata['source']) for c in rag.chunks}) == len(rag.documents), \
+                    "Los valores de metadatos se comparten entre chunks"
+                rag.add_documents([Document("Art. 900 Norma añadida después de mapear el archivo.",
+                                            {'source': "nuevo.md", 'path': "nuevo.md", 'type': "markdown"})])
+                assert rag.chunks[-1].content.startswith("Art. 900 Norma añadida")
+                resultado = rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=6)
+                resultados.append([(d['source'], d['content']) for d in resultado['context_docs']])
+            assert os.path.getsize(ruta) == rag.text_store.nbytes, "El archivo contiene el texto del corpus"
+            assert resultados[0] == resultados[1], "En memoria y con mmap se obtiene lo mismo"
+            
+            # Recargar no reabre el archivo en uso: el corpus pasa a path + ".next" y se cierra el anterior
+            anterior = rag.text_store
+            rag.load_documents_from_folder("data/legal_docs")
+            assert anterior._file.closed and anterior._map is None, "El almacén reemplazado debe cerrarse"
+            assert rag.text_store.path == ruta + ".next" and not os.path.exists(ruta), "Se alterna de archivo"
+            assert rag.query("¿Plazo para apelar?", top_k=3, initial_candidates=6)['context_docs']
+            rag._build_chunks()
+            assert rag.text_store.path == ruta and not os.path.exists(ruta + ".next")
+            rag.text_store.close()
+        print(f"   ✅ {len(rag.chunks)} chunks sobre {rag.text_store.nbytes / 1e3:.1f} kB de texto contiguo")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_carga_en_streaming():
+    """Test: Verificar la carga recursiva en paralelo y el embebido mientras se leen archivos"""
+    print("\n🧪 Test 29: Carga recursiva en streaming")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            archivos = {"a.md": "# A\n\nArt. 1 Plazo de apelación.", "sub/b.md": "# B\n\nArt. 2 Recurso de casación.",
+                        "sub/prof/c.md": "# C\n\nArt. 3 Notificación por cédula.", ".oculto/x.md": "# X",
+                        "borradores/y.md": "# Y", "notas.txt": "no es markdown"}
+            for nombre, texto in archivos.items():
+                os.makedirs(os.path.dirname(os.path.join(tmp, nombre)), exist_ok=True)
+                with open(os.path.join(tmp, nombre), "w", encoding="utf-8") as f:
+                    f.write(texto)
+            with open(os.path.join(tmp, "sub", "malo.md"), "wb") as f:
+                f.write(b"# Malo\n\xff\xfe")
+            
+            informe = LoadReport()
+            docs = list(DocumentLoader.iter_folder(tmp, ignore=(".*", "borradores"), max_workers=2, report=informe))
+            assert [os.path.relpath(d.metadata['path'], tmp) for d in docs] == ["a.md", os.path.join("sub", "b.md"),
+                                                                                os.path.join("sub", "prof", "c.md")]
+            assert informe.loaded == 3 and informe.ignored == 2, f"Informe incorrecto: {informe}"
+            assert list(informe.failed) == [os.path.join(tmp, "sub", "malo.md")], "El archivo ilegible se anota y se salta"
+            assert [d.metadata['source'] for d in DocumentLoader.load_from_folder(tmp)] == ["a.md"], \
+                "load_from_folder no entra en subcarpetas por defecto"
+            
+            rag = LegalRAGSystem(api_key="", client=FakeCohereClient(dim=32), cache_dir=None,
+                                 embed_batch_size=1, embed_max_workers=1)
+            ignorar = (".*", "borradores")
+            informe = rag.load_documents_from_folder(tmp, ignore=ignorar)
+            assert len(rag.documents) == 3 and len(rag.index) == len(rag.chunks) == len(rag.chunk_doc_ids)
+            assert rag.client.calls['embed'] == len(rag.chunks) and len(informe.failed) == 1
+            
+            # Embeber empieza antes de que el iterable termine
+            def documentos():
+                for i in range(5):
+                    if i == 4:
+                        limite = time.time() + 5
+                        while rag.client.calls['embed'] == 0 and time.time() < limite:
+                            time.sleep(0.01)
+                        solapado.append(rag.client.calls['embed'] > 0)
+                    yield Document(f"Art. {i} Texto del documento {i}.", {'source': f"d{i}.md"})
+            solapado = []
+            rag.client = FakeCohereClient(dim=32, latency=0.01)
+            rag._index_stream(documentos())
+            assert solapado == [True] and len(rag.index) == 5, "La primera tanda debe embeberse mientras llegan documentos"
+            
+            rag.load_documents_from_folder(tmp, ignore=ignorar)
+            with open(os.path.join(tmp, "sub", "prof", "c.md"), "a", encoding="utf-8") as f:
+                f.write("\n\nArt. 4 Texto añadido.")
+            os.remove(os.path.join(tmp, "sub", "b.md"))
+            resumen = rag.sync_folder(tmp, ignore=ignorar)
+            assert resumen['updated'] == [os.path.join(tmp, "sub", "prof", "c.md")], f"Sincronización: {resumen}"
+            assert resumen['removed'] == [os.path.join(tmp, "sub", "b.md")] and len(resumen['failed']) == 1
+        print(f"   ✅ {informe.loaded} archivos en subcarpetas, {informe.ignored} ignorados, {len(informe.failed)} con error")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
+def test_sesion_http():
+    """Test: Verificar reintentos, límite de ritmo y pool compartido contra un servidor local"""
+    print("\n🧪 Test 30: Sesión HTTP con reintentos y límites")
+    
+    from async_rag_system import AsyncLegalRAGSystem
+    from legal_agent import get_legal_agent
+    
+    try:
+        cubo = TokenBucket(rate=20, capacity=1)
+        esperas = [cubo.reserve() for _ in range(3)]
+        assert esperas[0] == 0 and 0.04 < esperas[1] < esperas[2] <= 0.1, f"Esperas del token bucket: {esperas}"
+        politica = RetryPolicy(max_retries=2, base_delay=0.1, seed=0)
+        assert politica.delay(0, retry_after=1.0) >= 1.0 and politica.delay(0, retry_after=120) is None
+        assert 0 <= politica.delay(1) <= 0.2 and politica.delay(2) is None, "Backoff exponencial con jitter y tope"
+        
+        with FakeCohereServer(FakeCohereClient(dim=32)) as servidor:
+            metricas = MetricsRegistry()
+            sesion = CohereSession("clave", base_url=servidor.url, rate_limits={'chat': 240}, metrics=metricas,
+                                   retry=RetryPolicy(max_retries=3, base_delay=0.01, seed=0))
+            rag = LegalRAGSystem(api_key="clave", session=sesion, metrics=metricas, cache_dir=None, adaptive_rerank=False)
+            rag.load_documents_from_folder("data/legal_docs")
+            
+            servidor.fail("rerank", 429, retry_after=0.2)
+            servidor.fail("chat", 503, times=2)
+            inicio = time.perf_counter()
+            resultado = rag.query("¿Cuál es el plazo para apelar?", top_k=2, initial_candidates=6)
+            assert resultado['answer'].startswith("Respuesta simulada") and time.perf_counter() - inicio >= 0.2, \
+                "La consulta debe completarse tras esperar lo que indica Retry-After"
+            estadisticas = sesion.stats()
+            assert estadisticas['rerank']['rate_limited'] == 1 and estadisticas['chat']['server_error'] == 2
+            assert "cohere_http_retries_total" in metricas.render_prometheus()
+            
+            conexiones = servidor.connections
+            inicio = time.perf_counter()
+            for i in range(6):
+                rag.client.chat(message=f"consulta {i}", model="command-r-plus")
+            assert time.perf_counter() - inicio >= 0.4 and sesion.stats()['chat']['throttled'] >= 1, \
+                "El límite de 240 por minuto debe espaciar las llamadas"
+            assert servidor.connections == conexiones, "Las llamadas deben reutilizar las conexiones del pool"
+            
+            servidor.fail("embed", 500, times=4)
+            try:
+                rag.client.embed(texts=["x"], model="m", input_type="search_query", embedding_types=["float"])
+                raise AssertionError("Tras agotar los reintentos el error debe propagarse")
+            except Exception as e:
+                assert getattr(e, 'status_code', None) == 500, f"Error inesperado: {e!r}"
+            assert sesion.stats()['embed']['give_ups'] == 1
+            
+            rag_async = AsyncLegalRAGSystem(api_key="clave", session=sesion, cache_dir=None)
+            proveedor = sesion.provider()
+            assert rag_async.async_client is sesion.async_client
+            assert proveedor.client._client_wrapper.httpx_client.httpx_client is sesion.async_http, \
+                "El agente debe usar el pool asíncrono de la sesión"
+            otra = CohereSession("otra")
+            assert get_legal_agent(sesion) is get_legal_agent(sesion), "El agente de una sesión se reutiliza"
+            assert get_legal_agent(otra) is not get_legal_agent(sesion), "Cada sesión debe tener su agente"
+            otra.close()
+            rag_async.documents, rag_async.chunks, rag_async.index = rag.documents, rag.chunks, rag.index
+            rag_async.chunk_doc_ids = rag.chunk_doc_ids
+            
+            # El pool asíncrono sirve a varios asyncio.run() seguidos (uno por event loop)
+            async def embed_asincrono():
+                respuesta = await rag_async.async_client.embed(texts=["x"], model="m", input_type="search_query",
+                                                               embedding_types=["float"])
+                return len(respuesta.embeddings.float)
+            
+            assert asyncio.run(embed_asincrono()) == asyncio.run(embed_asincrono()) == 1, \
+                "Un segundo event loop debe poder usar la sesión"
+            servidor.fail("embed", 429, retry_after=0)
+            
+            async def consulta():
+                try:
+                    return await rag_async.aquery("¿Qué es la casación?", top_k=2, initial_candidates=6)
+                finally:
+                    await sesion.aclose()
+            
+            respuesta = asyncio.run(consulta())
+            assert respuesta['answer'].startswith("Respuesta simulada")
+            assert sesion.stats()['embed']['rate_limited'] == 1, "El cliente asíncrono comparte reintentos y contadores"
+        print(f"   ✅ {int(sum(e['retries'] for e in sesion.stats().values()))} reintentos, "
+              f"{servidor.connections} conexiones para {sum(servidor.requests.values())} peticiones")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        return False
+
+
 def main():
     """Ejecuta todos los tests"""
     print("=" * 60)
@@ -157,6 +1364,32 @@ def main():
         "API Key": test_api_key(),
         "Inicialización RAG": test_inicializacion_rag(),
         "Query simple": test_query_simple(),
+        "Caché de embeddings": test_cache_embeddings(),
+        "Embeddings por lotes": test_embeddings_por_lotes(),
+        "Índice vectorial": test_indice_vectorial(),
+        "Caché de queries": test_cache_queries(),
+        "Caché de rerank": test_cache_rerank(),
+        "Caché de respuestas": test_cache_respuestas(),
+        "Pipeline asíncrono": test_pipeline_asincrono(),
+        "Streaming": test_query_stream(),
+        "Consultas por lote": test_query_many(),
+        "Chunks por artículo": test_chunks_por_articulo(),
+        "Empaquetado de contexto": test_empaquetado_contexto(),
+        "Índice IVF": test_indice_ivf(),
+        "Precisión de embeddings": test_precision_embeddings(),
+        "Actualización incremental": test_actualizacion_incremental(),
+        "Búsqueda léxica": test_busqueda_lexica(),
+        "Citas exactas": test_citas_exactas(),
+        "Política de rerank": test_politica_rerank(),
+        "Tiempos y uso": test_tiempos_y_uso(),
+        "Logging estructurado": test_logging_estructurado(),
+        "Cliente simulado y benchmark": test_cliente_simulado(),
+        "Servicio HTTP": test_servicio_http(),
+        "Búsqueda concurrente": test_busqueda_concurrente(),
+        "Almacén de texto": test_almacen_de_texto(),
+        "Carga en streaming": test_carga_en_streaming(),
+        "Sesión HTTP": test_sesion_http(),
+        "Lotes con índices aproximados": test_query_many_indices_aproximados(),
     }
     
     print("\n" + "=" * 60)
@@ -1,6 +1,20 @@
 """
 Utilidades para el sistema RAG
 """
-from .document_loader import Document, DocumentLoader
+from .document_loader import ChunkMetadata, Document, DocumentLoader, LoadReport
+from .bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+from .citations import CitationIndex, parse_citations
+from .cache import LRUCache, SemanticAnswerCache, normalize_query
+from .context_packer import ContextPacker, estimate_tokens
+from .rerank_policy import RerankPolicy
+from .metrics import MetricsRegistry, QueryTrace, serve_metrics
+from .log import configure_logging, get_logger
+from .clients import AsyncCohereClient, CohereClient
+from .cohere_session import CohereSession, RetryPolicy, TokenBucket
+from .fake_cohere import AsyncFakeCohereClient, FakeCohereClient, FakeCohereServer
+from .embedding_cache import EmbeddingCache, content_hash
+from .hits import Hit, SearchHits
+from .text_store import TextStore
+from .vector_index import FlatIndex, IVFIndex, QuantizedIndex, VectorIndex, create_index, load_index
 
-__all__ = ['Document', 'DocumentLoader']
+__all__ = ['Document', 'DocumentLoader', 'ChunkMetadata', 'LoadReport', 'TextStore', 'BM25Index', 'reciprocal_rank_fusion', 'tokenize', 'EmbeddingCache', 'content_hash', 'FlatIndex', 'IVFIndex', 'QuantizedIndex', 'VectorIndex', 'create_index', 'load_index', 'CitationIndex', 'parse_citations', 'LRUCache', 'SemanticAnswerCache', 'normalize_query', 'ContextPacker', 'estimate_tokens', 'RerankPolicy', 'MetricsRegistry', 'QueryTrace', 'serve_metrics', 'configure_logging', 'get_logger', 'CohereClient', 'AsyncCohereClient', 'FakeCohereClient', 'AsyncFakeCohereClient', 'FakeCohereServer', 'CohereSession', 'RetryPolicy', 'TokenBucket', 'Hit', 'SearchHits']
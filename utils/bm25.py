@@ -0,0 +1,244 @@
+"""
+Índice léxico BM25 en memoria y fusión de rankings (Reciprocal Rank Fusion)
+
+Pensado para consultas donde importan los términos exactos ("Art. 186",
+"recurso de queja") y para responder sin llamar a la API de embeddings.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vector_index import top_n_indices
+
+
+_TOKEN = re.compile(r'\w+')
+
+# Palabras vacías del español (artículos, preposiciones, conjunciones y pronombres frecuentes)
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aquel aquella aquellas aquellos aqui asi
+aun bajo bien cada como con contra cual cuales cuando de del desde donde dos e el ella ellas ello
+ellos en entre era eran es esa esas ese eso esos esta estan estas este esto estos fue fueron ha
+han hasta hay la las le les lo los mas me mi mis mucho muy ni no nos o otra otras otro otros para
+pero poco por porque que quien quienes se segun ser si sin sino sobre son su sus tal tambien tan
+te tiene tienen todo todos tu tus u un una unas uno unos y ya
+""".split())
+
+# Abreviaturas habituales en textos legales, llevadas a su forma completa
+_ABBREVIATIONS = {
+    'art': 'articulo',
+    'arts': 'articulo',
+    'inc': 'inciso',
+    'num': 'numeral',
+}
+
+
+def fold_accents(text: str) -> str:
+    """
+    Quita tildes y diéresis ("Artículo" → "articulo", "pingüino" → "pinguino")
+
+    La ñ se conserva porque distingue palabras ("año" / "ano").
+    """
+    decomposed = unicodedata.normalize('NFD', text.casefold())
+    folded = []
+    for i, char in enumerate(decomposed):
+        if unicodedata.combining(char) and not (char == '\u0303' and i and decomposed[i - 1] == 'n'):
+            continue
+        folded.append(char)
+    return unicodedata.normalize('NFC', ''.join(folded))
+
+
+def _stem(token: str, accented: bool = False) -> str:
+    """
+    Stemming ligero: reduce los plurales regulares al singular
+
+    Args:
+        token: Palabra ya sin tildes
+        accented: Si la palabra original terminaba en "-és" (interés, través): no es plural
+    """
+    if accented:
+        return token
+    if len(token) > 4 and token.endswith('ces'):
+        return token[:-3] + 'z'          # jueces → juez
+    if len(token) > 4 and token.endswith('es') and token[-3] in 'lnrdjy':
+        return token[:-2]                # tribunales → tribunal, leyes → ley
+    if len(token) > 3 and token.endswith('s'):
+        return token[:-1]                # recursos → recurso, partes → parte
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokeniza un texto en español para BM25
+
+    Minúsculas, sin tildes, sin palabras vacías, abreviaturas expandidas y
+    plurales reducidos. Los números se conservan (números de artículo).
+    """
+    tokens = []
+    # Las tildes se quitan palabra a palabra: el stemming necesita saber si acababa en "-és"
+    for word in _TOKEN.findall(unicodedata.normalize('NFC', text.casefold())):
+        token = word if word.isascii() else fold_accents(word)
+        if token in SPANISH_STOPWORDS:
+            continue
+        if token.isdigit():
+            tokens.append(token)
+            continue
+        token = _ABBREVIATIONS.get(token, token)
+        tokens.append(_stem(token, accented=word.endswith('és')))
+    return tokens
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 (Okapi) con altas incrementales y bajas por lápidas
+
+    Las filas siguen el mismo orden que las del índice vectorial, así que los
+    resultados de ambos se pueden fusionar directamente.
+    """
+
+    def __init__(self, texts: Sequence[str] = (), k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            texts: Textos iniciales (uno por fila)
+            k1: Saturación de la frecuencia de término
+            b: Peso de la normalización por longitud
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = defaultdict(lambda: ([], []))
+        self._frozen: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.doc_lengths = np.empty(0, dtype=np.float32)
+        self.deleted: Optional[np.ndarray] = None
+        self.add(texts)
+
+    def __len__(self) -> int:
+        return self.doc_lengths.shape[0]
+
+    def add(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Indexa textos nuevos al final
+
+        Returns:
+            Filas asignadas a los nuevos textos
+        """
+        start = len(self)
+        lengths = np.empty(len(texts), dtype=np.float32)
+        for offset, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[offset] = len(tokens)
+            counts: Dict[str, int] = defaultdict(int)
+            for token in tokens:
+                counts[token] += 1
+            for token, count in counts.items():
+                ids, tfs = self._postings[token]
+                ids.append(start + offset)
+                tfs.append(count)
+                self._frozen.pop(token, None)
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+        if self.deleted is not None:
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(texts), dtype=bool)])
+        return np.arange(start, start + len(texts))
+
+    def remove(self, ids: np.ndarray):
+        """
+        Marca filas como borradas; dejan de puntuar pero siguen contando en las
+        estadísticas del corpus (df) hasta compact()
+        """
+        if self.deleted is None:
+            self.deleted = np.zeros(len(self), dtype=bool)
+        self.deleted[np.asarray(ids, dtype=np.int64)] = True
+
+    def compact(self) -> np.ndarray:
+        """
+        Elimina las filas borradas y renumera las restantes
+
+        Returns:
+            Filas antiguas que se conservan, en su nuevo orden
+        """
+        if self.deleted is None or not self.deleted.any():
+            self.deleted = None
+            return np.arange(len(self))
+        keep = np.flatnonzero(~self.deleted)
+        renumber = np.full(len(self), -1, dtype=np.int64)
+        renumber[keep] = np.arange(len(keep))
+        postings = defaultdict(lambda: ([], []))
+        for token in list(self._postings):
+            ids, tfs = self._posting_arrays(token)
+            alive = renumber[ids] >= 0
+            if alive.any():
+                postings[token] = (renumber[ids[alive]].tolist(), tfs[alive].astype(int).tolist())
+        self._postings = postings
+        self._frozen = {}
+        self.doc_lengths = self.doc_lengths[keep]
+        self.deleted = None
+        return keep
+
+    def _posting_arrays(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Lista de apariciones de un término como arrays (convertida una vez y reutilizada)"""
+        frozen = self._frozen.get(token)
+        if frozen is None:
+            ids, tfs = self._postings[token]
+            frozen = (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            self._frozen[token] = frozen
+        return frozen
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Score BM25 de la query contra todas las filas (0 si no comparten términos)
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        n = len(self)
+        avg_length = float(self.doc_lengths.mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / avg_length)
+        for token in set(tokenize(query)):
+            if token not in self._postings:
+                continue
+            ids, tfs = self._posting_arrays(token)
+            idf = np.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        return scores
+
+    def search(self, query: str, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca las top_n filas con mayor score BM25
+
+        Returns:
+            Tupla (índices, scores) ordenada de mayor a menor; solo filas con score > 0
+        """
+        scores = self.scores(query)
+        if self.deleted is not None:
+            scores[self.deleted] = 0.0
+        indices = top_n_indices(scores, top_n)
+        indices = indices[scores[indices] > 0]
+        return indices, scores[indices]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], top_n: int, k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fusiona varios rankings con Reciprocal Rank Fusion: score = Σ 1 / (k + rank)
+
+    Solo usa las posiciones, así que no hace falta calibrar scores de BM25
+    contra similaridades coseno.
+
+    Args:
+        rankings: Listas de filas, cada una ordenada de mejor a peor
+        top_n: Número de resultados fusionados
+        k: Constante de suavizado (60 es el valor habitual)
+
+    Returns:
+        Tupla (índices, scores RRF) ordenada de mayor a menor
+    """
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, 1):
+            fused[int(idx)] += 1.0 / (k + rank)
+    if not fused:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    indices = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    best = top_n_indices(scores, top_n)
+    return indices[best], scores[best]
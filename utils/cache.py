@@ -0,0 +1,192 @@
+"""
+Cachés en memoria para los pasos de la consulta (embeddings de query, rerank, respuestas)
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normaliza una consulta para usarla como clave de caché
+
+    Unifica la forma Unicode, las mayúsculas y los espacios, de modo que
+    "¿Cuál es el plazo?" y "  ¿cuál es el  plazo? " compartan entrada.
+    """
+    query = unicodedata.normalize('NFC', query)
+    return _WHITESPACE.sub(' ', query).strip().casefold()
+
+
+class LRUCache:
+    """
+    Caché LRU acotada con expiración opcional (TTL) y segura entre hilos
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: Número máximo de entradas (0 desactiva la caché)
+            ttl: Segundos de vida de cada entrada (None = sin expiración)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Devuelve el valor asociado a key, o None si no está o expiró
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Guarda un valor, desalojando la entrada menos usada si se excede maxsize
+        """
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Vacía la caché (los contadores se conservan)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        """Tamaño, aciertos, fallos y tasa de aciertos"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas completas indexada por el embedding de la consulta
+
+    Una consulta nueva reutiliza la respuesta de otra anterior si sus embeddings
+    tienen similaridad coseno >= threshold, ambas se hicieron sobre la misma
+    versión del corpus y con los mismos parámetros de consulta.
+    """
+
+    def __init__(self, maxsize: int = 256, threshold: float = 0.95):
+        """
+        Args:
+            maxsize: Número máximo de respuestas guardadas
+            threshold: Similaridad coseno mínima para considerar equivalentes dos consultas
+        """
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: list = []
+        self._last_used = np.zeros(maxsize, dtype=np.int64)
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, query_embedding: np.ndarray, version: int, params: Hashable) -> Optional[Tuple[Dict, float]]:
+        """
+        Busca una respuesta para una consulta semánticamente equivalente
+
+        Args:
+            query_embedding: Embedding de la consulta
+            version: Versión del corpus/índice
+            params: Parámetros de la consulta que deben coincidir (top_k, modelo, ...)
+
+        Returns:
+            Tupla (resultado guardado, similaridad) o None
+        """
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            query = _unit(query_embedding)
+            similarities = self._vectors[:len(self._entries)] @ query
+            for slot in np.argsort(similarities)[::-1]:
+                if similarities[slot] < self.threshold:
+                    break
+                entry_version, entry_params, result = self._entries[slot]
+                if entry_version == version and entry_params == params:
+                    self._clock += 1
+                    self._last_used[slot] = self._clock
+                    self.hits += 1
+                    return result, float(similarities[slot])
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: np.ndarray, version: int, params: Hashable, result: Dict):
+        """
+        Guarda una respuesta; si la caché está llena desaloja la menos usada
+        """
+        if self.maxsize <= 0:
+            return
+        query = _unit(query_embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, query.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.maxsize:
+                slot = len(self._entries)
+                self._entries.append(None)
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = query
+            self._entries[slot] = (version, params, result)
+            self._clock += 1
+            self._last_used[slot] = self._clock
+
+    def clear(self):
+        """Vacía la caché (los contadores se conservan)"""
+        with self._lock:
+            self._entries = []
+            self._last_used[:] = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Tamaño, aciertos, fallos y tasa de aciertos"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,150 @@
+"""
+Índice exacto de citas legales: (código, número de artículo) → pasaje
+
+Permite responder "¿Qué dice el Art. 189?" sin embeddings ni rerank: las
+citas de la consulta se buscan en un diccionario construido al cargar los
+documentos a partir de los encabezados de artículo.
+"""
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from .bm25 import SPANISH_STOPWORDS, fold_accents
+from .document_loader import Document, _SECTION_START
+
+
+# Encabezado de artículo al inicio de línea: "### Artículo 189 - ...", "Art. 64."
+_ARTICLE_HEADING = re.compile(r'^[ \t]*(?:#{1,6}[ \t]*)?(?:Art\.|Artículo)[ \t]*(\d+)', re.MULTILINE)
+_TITLE = re.compile(r'^#[ \t]+(.+)$', re.MULTILINE)
+# Cantidades que siguen a un número que no es artículo: "art. 189 y 10 dias", "el articulo 5, 3 veces"
+_QUANTITY_NOUNS = r'(?:dias?|habiles|veces|años?|mes(?:es)?|semanas?|horas?|minutos?|personas?|pesos|euros|%)'
+# Citas en la consulta (ya sin tildes): "art. 189", "articulo 186", "arts. 186 y 189"
+_CITATION = re.compile(
+    r'\bart(?:iculos?|s?\.?)[ \t]*(\d+(?:[ \t]*(?:,|y|e)[ \t]*\d+(?!\d)(?![ \t]*' + _QUANTITY_NOUNS + r'(?!\w)))*)'
+)
+_NUMBER = re.compile(r'\d+')
+
+
+class Citation(NamedTuple):
+    """Pasaje de un artículo: fila del chunk y offsets del artículo dentro de su contenido"""
+    code: str
+    article: str
+    row: int
+    start: int
+    end: int
+
+
+def document_code(document: Document) -> str:
+    """
+    Nombre normalizado del cuerpo legal de un documento
+
+    Se toma del título Markdown ("# Código de Procedimiento Civil - Extractos"
+    → "codigo de procedimiento civil") o, si no hay título, del nombre de archivo.
+    """
+    match = _TITLE.search(document.content)
+    title = match.group(1).split(' - ')[0] if match else document.metadata.get('source', '').rsplit('.', 1)[0]
+    return ' '.join(re.findall(r'\w+', fold_accents(title)))
+
+
+def code_aliases(code: str) -> Set[str]:
+    """Formas de citar un código: su nombre y su sigla ("codigo de procedimiento civil", "cpc")"""
+    words = [w for w in code.split() if w not in SPANISH_STOPWORDS]
+    aliases = {code}
+    if len(words) > 1:
+        aliases.add(''.join(w[0] for w in words))
+    return aliases
+
+
+def parse_citations(query: str) -> List[str]:
+    """
+    Números de artículo citados en una consulta, en orden y sin repetir
+    """
+    articles: List[str] = []
+    for match in _CITATION.finditer(fold_accents(query)):
+        for number in _NUMBER.findall(match.group(1)):
+            if number not in articles:
+                articles.append(number)
+    return articles
+
+
+class CitationIndex:
+    """
+    Diccionario (código, artículo) → pasajes, fila a fila con el índice vectorial
+
+    Un mismo número puede tener varios pasajes (p. ej. un artículo repetido en
+    extractos distintos); se devuelven todos en orden de carga.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], List[Citation]] = defaultdict(list)
+        self._codes_by_article: Dict[str, List[str]] = defaultdict(list)
+        self._aliases: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return sum(len(citations) for citations in self._entries.values())
+
+    def add(self, chunk: Document, row: int, code: str):
+        """
+        Indexa los artículos que empiezan en un chunk
+
+        Args:
+            chunk: Chunk a indexar
+            row: Fila del chunk en el índice
+            code: Código al que pertenece su documento (ver document_code)
+        """
+        content = chunk.content
+        for match in _ARTICLE_HEADING.finditer(content):
+            next_section = _SECTION_START.search(content, match.end())
+            end = next_section.start() if next_section else len(content)
+            article = match.group(1)
+            self._entries[(code, article)].append(Citation(code, article, int(row), match.start(), end))
+            if code not in self._codes_by_article[article]:
+                self._codes_by_article[article].append(code)
+            for alias in code_aliases(code):
+                self._aliases.setdefault(alias, code)
+
+    def remove(self, rows: Iterable[int]):
+        """Quita los pasajes de las filas borradas"""
+        self._filter(set(int(row) for row in rows), renumber=None)
+
+    def compact(self, keep: np.ndarray):
+        """Renumera las filas tras compactar el índice (la fila nueva i es keep[i])"""
+        renumber = {int(old): new for new, old in enumerate(keep)}
+        self._filter(set(), renumber=renumber)
+
+    def _filter(self, dropped: Set[int], renumber: Optional[Dict[int, int]]):
+        entries: Dict[Tuple[str, str], List[Citation]] = defaultdict(list)
+        for key, citations in self._entries.items():
+            for citation in citations:
+                if citation.row in dropped or (renumber is not None and citation.row not in renumber):
+                    continue
+                row = renumber[citation.row] if renumber is not None else citation.row
+                entries[key].append(citation._replace(row=row))
+        self._entries = entries
+        self._codes_by_article = defaultdict(list)
+        for code, article in entries:
+            self._codes_by_article[article].append(code)
+
+    def lookup(self, query: str) -> List[Citation]:
+        """
+        Pasajes de los artículos citados en la consulta
+
+        Si la consulta nombra un código (por nombre o sigla) solo se buscan sus
+        artículos; si no, el número se busca en todos los códigos.
+
+        Returns:
+            Lista de citas (vacía si la consulta no cita artículos indexados)
+        """
+        articles = parse_citations(query)
+        if not articles:
+            return []
+        folded = fold_accents(query)
+        codes = {code for alias, code in self._aliases.items() if re.search(rf'\b{re.escape(alias)}\b', folded)}
+        found: List[Citation] = []
+        for article in articles:
+            for code in self._codes_by_article.get(article, ()):
+                if not codes or code in codes:
+                    found.extend(self._entries[(code, article)])
+        return found
@@ -0,0 +1,43 @@
+"""
+Interfaz mínima del cliente de Cohere que usa el sistema RAG
+
+LegalRAGSystem acepta cualquier objeto con estos métodos (cohere.Client,
+FakeCohereClient o un envoltorio propio), de modo que el pipeline se puede
+ejecutar sin red en tests y benchmarks.
+"""
+from typing import Any, AsyncIterator, Iterator, List, Protocol, runtime_checkable
+
+
+@runtime_checkable
+class CohereClient(Protocol):
+    """
+    Métodos de cohere.Client (API v1) que llama el pipeline
+
+    Las respuestas deben exponer los mismos atributos que las del SDK:
+    embed → .embeddings.float, rerank → .results[i].index/.relevance_score,
+    chat → .text y chat_stream → eventos con .event_type ("text-generation"
+    con .text, "stream-end" con .response). El campo .meta (uso facturado) es opcional.
+    """
+
+    def embed(self, *, texts: List[str], model: str, input_type: str, embedding_types: List[str]) -> Any: ...
+
+    def rerank(self, *, model: str, query: str, documents: List[str], top_n: int,
+               return_documents: bool = False) -> Any: ...
+
+    def chat(self, *, model: str, message: str, temperature: float = 0.3) -> Any: ...
+
+    def chat_stream(self, *, model: str, message: str, temperature: float = 0.3) -> Iterator[Any]: ...
+
+
+@runtime_checkable
+class AsyncCohereClient(Protocol):
+    """Equivalente asíncrono (cohere.AsyncClient): mismos métodos con await"""
+
+    async def embed(self, *, texts: List[str], model: str, input_type: str, embedding_types: List[str]) -> Any: ...
+
+    async def rerank(self, *, model: str, query: str, documents: List[str], top_n: int,
+                     return_documents: bool = False) -> Any: ...
+
+    async def chat(self, *, model: str, message: str, temperature: float = 0.3) -> Any: ...
+
+    def chat_stream(self, *, model: str, message: str, temperature: float = 0.3) -> AsyncIterator[Any]: ...
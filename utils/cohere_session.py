@@ -0,0 +1,391 @@
+"""
+Capa HTTP compartida con la API de Cohere: ritmo por endpoint, reintentos y un pool de conexiones
+
+CohereSession crea los clientes que usa el proyecto (cohere.Client para
+LegalRAGSystem, cohere.AsyncClient para AsyncLegalRAGSystem y el
+CohereProvider de pydantic-ai para el agente) sobre los mismos clientes httpx,
+cuyo transporte:
+
+1. Espera a que haya turno en el token bucket del endpoint (embed, rerank, chat)
+2. Reintenta 429 y 5xx (y los fallos de conexión) con backoff exponencial con
+   jitter, o lo que indique Retry-After si la respuesta lo trae
+3. Registra peticiones, reintentos y esperas en un MetricsRegistry
+
+Los SDK se crean con max_retries=0: los reintentos se hacen solo aquí.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+import cohere
+import httpx
+
+from .log import get_logger
+from .metrics import MetricsRegistry
+
+if TYPE_CHECKING:
+    from pydantic_ai.providers.cohere import CohereProvider
+
+
+logger = get_logger("cohere_session")
+
+# Peticiones por minuto de una API key de producción (una de prueba admite bastantes menos)
+DEFAULT_RATE_LIMITS = {'embed': 2000, 'rerank': 1000, 'chat': 500}
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+ENDPOINTS = ('embed', 'rerank', 'chat')
+# Errores en los que la petición no llegó al servidor: reintentarlos no duplica nada
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class TokenBucket:
+    """
+    Token bucket con reservas: cada petición toma un token y, si no quedan,
+    sabe cuánto esperar (el saldo puede ser negativo: las esperas se encolan)
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: Tokens por segundo
+            capacity: Ráfaga máxima (None = un segundo de tokens, al menos 1)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Toma un token y devuelve los segundos que hay que esperar para usarlo"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1.0
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def pause(self, seconds: float):
+        """Vacía el bucket durante seconds (p. ej. tras un 429): las siguientes reservas esperan"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class RetryPolicy:
+    """
+    Cuándo y cuánto esperar antes de reintentar una petición
+
+    Sin Retry-After la espera es "full jitter": uniforme entre 0 y
+    base_delay × 2^intento (como mucho max_delay). Con Retry-After se espera
+    lo indicado más un jitter de hasta base_delay, salvo que supere
+    max_retry_after: entonces no se reintenta.
+    """
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 max_retry_after: float = 60.0, seed: Optional[int] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self._random = random.Random(seed)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Segundos a esperar antes del reintento attempt + 1 (None = no reintentar)"""
+        if attempt >= self.max_retries:
+            return None
+        jitter = self._random.uniform(0.0, self.base_delay)
+        if retry_after is not None:
+            return retry_after + jitter if retry_after <= self.max_retry_after else None
+        return self._random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    """Segundos de Retry-After (o retry-after-ms), en segundos o como fecha HTTP"""
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+def endpoint_of(path: str) -> str:
+    """Endpoint de una ruta de la API ("/v1/embed" → "embed"; otras → "other")"""
+    name = path.rstrip('/').rsplit('/', 1)[-1]
+    return name if name in ENDPOINTS else "other"
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Si merece la pena reintentar una petición que falló con error: 429, 5xx o
+    fallos de red. Un 4xx (clave inválida, petición mal formada) fallaría igual.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class _Guard:
+    """Estado compartido por los transportes síncrono y asíncrono de una sesión"""
+
+    def __init__(self, buckets: Dict[str, TokenBucket], retry: RetryPolicy, metrics: MetricsRegistry):
+        self.buckets = buckets
+        self.retry = retry
+        self.metrics = metrics
+
+    def throttle(self, endpoint: str) -> float:
+        """Reserva turno y devuelve la espera (anotada si es mayor que cero)"""
+        bucket = self.buckets.get(endpoint)
+        wait = bucket.reserve() if bucket is not None else 0.0
+        if wait > 0:
+            self.metrics.inc("cohere_http_throttled_total", endpoint=endpoint)
+            self.metrics.inc("cohere_http_throttle_seconds_total", wait, endpoint=endpoint)
+        return wait
+
+    def after_response(self, endpoint: str, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Registra la respuesta y devuelve la espera antes de reintentar (None = devolverla)"""
+        self.metrics.inc("cohere_http_requests_total", endpoint=endpoint, status=str(response.status_code))
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        reason = "rate_limited" if response.status_code == 429 else "server_error"
+        retry_after = parse_retry_after(response.headers)
+        delay = self.retry.delay(attempt, retry_after)
+        if response.status_code == 429 and endpoint in self.buckets:
+            # Los demás hilos tampoco deben insistir mientras dure el límite
+            self.buckets[endpoint].pause(delay if delay is not None else (retry_after or 0.0))
+        return self._retry_or_give_up(endpoint, reason, attempt, delay, response.status_code)
+
+    def after_error(self, endpoint: str, error: Exception, attempt: int) -> Optional[float]:
+        """Registra un fallo de conexión y devuelve la espera antes de reintentar (None = propagarlo)"""
+        self.metrics.inc("cohere_http_requests_total", endpoint=endpoint, status="connect_error")
+        return self._retry_or_give_up(endpoint, "connect_error", attempt, self.retry.delay(attempt), error)
+
+    def _retry_or_give_up(self, endpoint: str, reason: str, attempt: int, delay: Optional[float], cause) -> Optional[float]:
+        if delay is None:
+            self.metrics.inc("cohere_http_give_ups_total", endpoint=endpoint, reason=reason)
+            logger.warning("⚠️  %s: sin más reintentos tras %d intentos (%s)", endpoint, attempt + 1, cause)
+            return None
+        self.metrics.inc("cohere_http_retries_total", endpoint=endpoint, reason=reason)
+        logger.info("   ↻ %s: %s, reintento %d en %.2fs", endpoint, cause, attempt + 1, delay)
+        return delay
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Transporte httpx síncrono con token bucket y reintentos (ver CohereSession)"""
+
+    def __init__(self, guard: _Guard, transport: httpx.BaseTransport):
+        self._guard = guard
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_of(request.url.path)
+        # El cuerpo se lee una vez para poder reenviarlo en cada intento
+        request.read()
+        attempt = 0
+        while True:
+            wait = self._guard.throttle(endpoint)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                response = self._transport.handle_request(request)
+            except _CONNECT_ERRORS as e:
+                delay = self._guard.after_error(endpoint, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._guard.after_response(endpoint, response, attempt)
+                if delay is None:
+                    return response
+                # Leer el cuerpo devuelve la conexión al pool
+                response.read()
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Versión asíncrona de RateLimitedTransport (las esperas no bloquean el event loop)
+
+    Las conexiones de httpx quedan ligadas al event loop que las abrió, así que
+    hay un transporte interno (y un pool) por loop: la misma sesión sirve a
+    varios asyncio.run() seguidos.
+    """
+
+    def __init__(self, guard: _Guard, transport_factory: Callable[[], httpx.AsyncBaseTransport]):
+        """
+        Args:
+            guard: Estado compartido de límites, reintentos y métricas
+            transport_factory: Crea el transporte interno de cada event loop
+        """
+        self._guard = guard
+        self._factory = transport_factory
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncBaseTransport]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _loop_transport(self) -> httpx.AsyncBaseTransport:
+        """Transporte interno del event loop en curso"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                # Los pools de loops ya cerrados no se pueden reutilizar ni cerrar: se sueltan
+                for closed in [other for other in self._transports if other.is_closed()]:
+                    del self._transports[closed]
+                transport = self._transports[loop] = self._factory()
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_of(request.url.path)
+        transport = self._loop_transport()
+        await request.aread()
+        attempt = 0
+        while True:
+            wait = self._guard.throttle(endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await transport.handle_async_request(request)
+            except _CONNECT_ERRORS as e:
+                delay = self._guard.after_error(endpoint, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._guard.after_response(endpoint, response, attempt)
+                if delay is None:
+                    return response
+                await response.aread()
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        # Solo se pueden cerrar las conexiones del loop en curso; las de otros loops se descartan
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+            self._transports.clear()
+        if transport is not None:
+            await transport.aclose()
+
+
+class CohereSession:
+    """
+    Clientes de Cohere que comparten límites de ritmo, reintentos y conexiones
+
+    Hay un pool para el código síncrono y otro para el asíncrono, uno por
+    event loop (httpx no comparte conexiones entre ellos); los límites y los
+    contadores sí son comunes. Un mismo objeto puede pasarse a LegalRAGSystem(session=...),
+    AsyncLegalRAGSystem y create_legal_agent(session=...).
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None,
+                 rate_limits: Optional[Dict[str, float]] = DEFAULT_RATE_LIMITS,
+                 retry: Optional[RetryPolicy] = None, max_connections: int = 20,
+                 timeout: float = 300.0, metrics: Optional[MetricsRegistry] = None):
+        """
+        Args:
+            api_key: API key de Cohere
+            base_url: URL de la API (None = la de Cohere; p. ej. la de FakeCohereServer en tests)
+            rate_limits: Peticiones por minuto de cada endpoint ('embed', 'rerank', 'chat');
+                los que falten no se limitan (None no limita ninguno)
+            retry: Política de reintentos (None = RetryPolicy() por defecto)
+            max_connections: Conexiones abiertas como mucho en cada pool
+            timeout: Segundos de espera de cada petición
+            metrics: Registro donde anotar peticiones, reintentos y esperas (None crea uno propio)
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.retry = retry or RetryPolicy()
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.describe("cohere_http_requests_total", "Respuestas HTTP de Cohere por endpoint y estado")
+        self.metrics.describe("cohere_http_retries_total", "Reintentos por endpoint y motivo")
+        self.metrics.describe("cohere_http_give_ups_total", "Peticiones que agotaron los reintentos")
+        self.metrics.describe("cohere_http_throttled_total", "Peticiones retenidas por el límite de ritmo")
+        self.metrics.describe("cohere_http_throttle_seconds_total", "Segundos de espera por el límite de ritmo")
+        buckets = {endpoint: TokenBucket(per_minute / 60.0) for endpoint, per_minute in (rate_limits or {}).items()}
+        self._guard = _Guard(buckets, self.retry, self.metrics)
+
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = timeout
+        self.http = httpx.Client(
+            transport=RateLimitedTransport(self._guard, httpx.HTTPTransport(limits=self._limits)), timeout=timeout)
+        self.client = cohere.Client(api_key, base_url=base_url, httpx_client=self.http, max_retries=0)
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self._async_client: Optional[cohere.AsyncClient] = None
+
+    @property
+    def async_http(self) -> httpx.AsyncClient:
+        """Cliente asíncrono (se crea al usarlo por primera vez; sus conexiones, por event loop)"""
+        with self._lock:
+            if self._async_http is None:
+                transport = AsyncRateLimitedTransport(self._guard, lambda: httpx.AsyncHTTPTransport(limits=self._limits))
+                self._async_http = httpx.AsyncClient(transport=transport, timeout=self._timeout)
+        return self._async_http
+
+    @property
+    def async_client(self) -> cohere.AsyncClient:
+        """cohere.AsyncClient sobre el pool asíncrono"""
+        if self._async_client is None:
+            self._async_client = cohere.AsyncClient(self.api_key, base_url=self.base_url,
+                                                    httpx_client=self.async_http, max_retries=0)
+        return self._async_client
+
+    def provider(self) -> "CohereProvider":
+        """CohereProvider de pydantic-ai sobre el pool asíncrono (API v2 de chat)"""
+        from pydantic_ai.providers.cohere import CohereProvider
+
+        client = cohere.AsyncClientV2(self.api_key, base_url=self.base_url, httpx_client=self.async_http, max_retries=0)
+        return CohereProvider(cohere_client=client)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Contadores por endpoint: peticiones, reintentos, abandonos y esperas por el límite de ritmo"""
+        total = self.metrics.total
+        stats = {}
+        for endpoint in ENDPOINTS + ("other",):
+            retries = {reason: total("cohere_http_retries_total", endpoint=endpoint, reason=reason)
+                       for reason in ("rate_limited", "server_error", "connect_error")}
+            stats[endpoint] = {
+                'requests': total("cohere_http_requests_total", endpoint=endpoint),
+                'retries': sum(retries.values()),
+                **retries,
+                'give_ups': total("cohere_http_give_ups_total", endpoint=endpoint),
+                'throttled': total("cohere_http_throttled_total", endpoint=endpoint),
+                'throttle_seconds': total("cohere_http_throttle_seconds_total", endpoint=endpoint),
+            }
+        return stats
+
+    def close(self):
+        """Cierra el pool síncrono (el asíncrono se cierra con aclose)"""
+        self.http.close()
+
+    async def aclose(self):
+        self.http.close()
+        if self._async_http is not None:
+            await self._async_http.aclose()
+
+    def __repr__(self):
+        return f"CohereSession({self.base_url or 'api.cohere.com'}, {len(self._guard.buckets)} límites)"
@@ -0,0 +1,118 @@
+"""
+Empaquetado del contexto para el prompt con un presupuesto de tokens
+"""
+import re
+from typing import Dict, List, Set, Tuple
+
+
+# Aproximación habitual: ~4 caracteres por token en español/inglés
+CHARS_PER_TOKEN = 4
+
+_WORD = re.compile(r'\w+')
+_SENTENCE_END = re.compile(r'[.!?;:](?=\s)|\n')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estima el número de tokens de un texto (sin llamar a un tokenizador)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def truncate_at_sentence(text: str, max_chars: int) -> str:
+    """
+    Recorta text a como mucho max_chars caracteres, terminando en un fin de frase
+
+    Si no hay ningún fin de frase dentro del límite, corta en el último espacio.
+    """
+    if len(text) <= max_chars:
+        return text
+    window = text[:max_chars]
+    ends = [m.end() for m in _SENTENCE_END.finditer(window)]
+    if ends:
+        return window[:ends[-1]].rstrip()
+    cut = window.rfind(' ')
+    return window[:cut if cut > 0 else max_chars].rstrip()
+
+
+class ContextPacker:
+    """
+    Llena un presupuesto de tokens con los documentos en orden de rerank
+
+    - Descarta pasajes redundantes (cuyo contenido ya está cubierto por otro incluido)
+    - Recorta en un fin de frase el último pasaje que no cabe entero
+    - Informa cuántos tokens se empaquetaron y cuántos se descartaron
+    """
+
+    def __init__(self, max_tokens: int = 3000, overlap_threshold: float = 0.8, min_tokens: int = 32):
+        """
+        Args:
+            max_tokens: Presupuesto de tokens para el contexto
+            overlap_threshold: Fracción de trigramas ya presentes a partir de la cual
+                un pasaje se considera redundante
+            min_tokens: Espacio mínimo restante para incluir un pasaje recortado
+        """
+        self.max_tokens = max_tokens
+        self.overlap_threshold = overlap_threshold
+        self.min_tokens = min_tokens
+
+    def pack(self, context_docs: List[Dict]) -> Tuple[List[Dict], Dict[str, int]]:
+        """
+        Selecciona y recorta los documentos que entran en el presupuesto
+
+        Args:
+            context_docs: Documentos ordenados por relevancia (con 'content')
+
+        Returns:
+            Tupla (documentos empaquetados, estadísticas)
+        """
+        packed: List[Dict] = []
+        seen: List[Set[Tuple[str, ...]]] = []
+        stats = {
+            'budget_tokens': self.max_tokens,
+            'packed_tokens': 0,
+            'dropped_tokens': 0,
+            'packed_docs': 0,
+            'dropped_docs': 0,
+            'truncated_docs': 0,
+        }
+        remaining = self.max_tokens
+
+        for doc in context_docs:
+            content = doc['content']
+            tokens = estimate_tokens(content)
+
+            shingles = _shingles(content)
+            if shingles and any(len(shingles & other) / len(shingles) >= self.overlap_threshold for other in seen):
+                stats['dropped_tokens'] += tokens
+                stats['dropped_docs'] += 1
+                continue
+
+            if tokens <= remaining:
+                packed.append(doc)
+            elif remaining >= self.min_tokens:
+                truncated = truncate_at_sentence(content, remaining * CHARS_PER_TOKEN)
+                if not truncated:
+                    stats['dropped_tokens'] += tokens
+                    stats['dropped_docs'] += 1
+                    continue
+                packed.append({**doc, 'content': truncated, 'truncated': True})
+                stats['truncated_docs'] += 1
+                stats['dropped_tokens'] += tokens - estimate_tokens(truncated)
+                tokens = estimate_tokens(truncated)
+            else:
+                stats['dropped_tokens'] += tokens
+                stats['dropped_docs'] += 1
+                continue
+
+            seen.append(shingles)
+            remaining -= tokens
+            stats['packed_tokens'] += tokens
+            stats['packed_docs'] += 1
+
+        return packed, stats
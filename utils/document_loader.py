@@ -2,22 +2,175 @@
 Utilidades para cargar y procesar documentos Markdown
 """
 import os
-from typing import List, Dict
-from pathlib import Path
+import re
+import sys
+import time
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from .log import get_logger
+
+if TYPE_CHECKING:
+    from .text_store import TextStore
+
+
+logger = get_logger("document_loader")
+
+# Inicio de sección: encabezado Markdown o inicio de artículo ("Art. 64", "Artículo 189")
+_SECTION_START = re.compile(r'^(?:#{1,6}\s|[ \t]*(?:Art\.|Artículo)[ \t]*\d+)', re.MULTILINE)
+_HEADING_LINE = re.compile(r'^#{1,6}\s.*$')
+
+# Se ignoran por defecto archivos y carpetas ocultos (.git, .embeddings_cache...) y cachés
+DEFAULT_IGNORE = ('.*', '__pycache__', 'node_modules')
 
 
 class Document:
     """
     Representa un documento con su contenido y metadatos
+
+    El contenido puede ser un str propio o un rango de bytes de un TextStore
+    (ver utils.text_store); en ese caso el texto se decodifica cada vez que se
+    lee content y no queda guardado en el objeto.
     """
-    def __init__(self, content: str, metadata: Dict[str, str]):
-        self.content = content
+
+    __slots__ = ('_text', 'metadata', '_store', '_offset', '_length')
+
+    def __init__(self, content: str, metadata: Dict[str, Any]):
+        self._text = content
         self.metadata = metadata
-    
+        self._store: Optional["TextStore"] = None
+        self._offset = 0
+        self._length = 0
+
+    @classmethod
+    def stored(cls, store: "TextStore", offset: int, length: int, metadata) -> "Document":
+        """Documento cuyo texto son los bytes [offset, offset + length) de store"""
+        document = cls.__new__(cls)
+        document._text = None
+        document.metadata = metadata
+        document._store = store
+        document._offset = offset
+        document._length = length
+        return document
+
+    @property
+    def content(self) -> str:
+        if self._store is None:
+            return self._text
+        return self._store.text(self._offset, self._length)
+
+    @content.setter
+    def content(self, value: str):
+        self._text = value
+        self._store = None
+
+    @property
+    def store(self) -> Optional["TextStore"]:
+        """TextStore que guarda el texto (None si el contenido es un str propio)"""
+        return self._store
+
     def __repr__(self):
         return f"Document(source={self.metadata.get('source', 'unknown')})"
 
 
+class ChunkMetadata(MutableMapping):
+    """
+    Metadatos de un chunk sin copiar los de su documento
+
+    Las claves propias del chunk ('chunk_id', 'start', 'end', 'doc_id',
+    'content_hash') se guardan en slots; el resto se lee del diccionario del
+    documento, que comparten todos sus chunks. Escribir otra clave no toca ese
+    diccionario: va a un diccionario propio que se crea solo si hace falta.
+    """
+
+    __slots__ = ('_base', 'chunk_id', 'start', 'end', 'doc_id', 'content_hash', '_extra')
+    _OWN = ('chunk_id', 'start', 'end', 'doc_id', 'content_hash')
+
+    def __init__(self, base: Dict[str, Any], chunk_id: int, start: int, end: int):
+        self._base = base
+        self.chunk_id = chunk_id
+        self.start = start
+        self.end = end
+        self._extra: Optional[Dict[str, Any]] = None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._OWN:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        return self._base[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self._OWN:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self._OWN:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        extra = self._extra or {}
+        yield from (key for key in self._base if key not in extra and key not in self._OWN)
+        yield from (key for key in extra)
+        yield from (key for key in self._OWN if hasattr(self, key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def intern_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia de los metadatos con los valores str internados (un solo objeto por valor repetido)"""
+    return {key: sys.intern(value) if type(value) is str else value for key, value in metadata.items()}
+
+
+class LoadReport:
+    """
+    Resultado de una carga: cuántos archivos se leyeron, omitieron o fallaron
+
+    Un archivo que no se puede leer no detiene la carga: queda en failed
+    (ruta → error) y se sigue con el resto.
+    """
+
+    def __init__(self):
+        self.loaded = 0
+        self.skipped = 0
+        self.ignored = 0
+        self.failed: Dict[str, str] = {}
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'loaded': self.loaded, 'skipped': self.skipped, 'ignored': self.ignored,
+                'failed': dict(self.failed), 'bytes': self.bytes, 'seconds': round(self.seconds, 3)}
+
+    def __repr__(self):
+        return (f"LoadReport(loaded={self.loaded}, skipped={self.skipped}, ignored={self.ignored}, "
+                f"failed={len(self.failed)})")
+
+
 class DocumentLoader:
     """
     Carga documentos desde archivos Markdown
@@ -36,85 +189,276 @@ class DocumentLoader:
         """
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
+            # fstat sobre el archivo abierto: sin otra consulta al sistema de archivos (o a la red)
+            stat = os.fstat(f.fileno())
         
-        metadata = {
+        metadata = intern_metadata({
             'source': os.path.basename(file_path),
             'path': file_path,
-            'type': 'markdown'
-        }
+            'type': 'markdown',
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        })
         
         return Document(content=content, metadata=metadata)
     
     @staticmethod
-    def load_from_folder(folder_path: str) -> List[Document]:
+    def load_from_folder(folder_path: str, recursive: bool = False, ignore: Sequence[str] = DEFAULT_IGNORE,
+                         max_workers: int = 8) -> List[Document]:
         """
         Carga todos los archivos .md de una carpeta
         
         Args:
             folder_path: Ruta a la carpeta con archivos .md
+            recursive: Si True, incluye las subcarpetas
+            ignore: Patrones de archivos y carpetas a omitir (ver find_files)
+            max_workers: Archivos leídos en paralelo
             
         Returns:
-            Lista de Documents
+            Lista de Documents (cada carpeta en orden alfabético)
         """
         documents = []
-        folder = Path(folder_path)
-        
-        if not folder.exists():
-            raise ValueError(f"La carpeta {folder_path} no existe")
-        
-        # Buscar todos los archivos .md
-        md_files = list(folder.glob("*.md"))
-        
-        if not md_files:
-            print(f"⚠️ No se encontraron archivos .md en {folder_path}")
-            return documents
+        for doc in DocumentLoader.iter_folder(folder_path, recursive=recursive, ignore=ignore, max_workers=max_workers):
+            documents.append(doc)
+            logger.info("✅ Cargado: %s", doc.metadata['source'])
         
-        for md_file in md_files:
-            try:
-                doc = DocumentLoader.load_markdown_file(str(md_file))
-                documents.append(doc)
-                print(f"✅ Cargado: {md_file.name}")
-            except Exception as e:
-                print(f"❌ Error cargando {md_file.name}: {e}")
+        if not documents:
+            logger.warning("⚠️ No se encontraron archivos .md en %s", folder_path)
         
         return documents
+
+    @staticmethod
+    def iter_folder(folder_path: str, recursive: bool = True, pattern: str = "*.md",
+                    ignore: Sequence[str] = DEFAULT_IGNORE, skip: Optional[Callable[[str], bool]] = None,
+                    max_workers: int = 8, report: Optional[LoadReport] = None) -> Iterator[Document]:
+        """
+        Recorre una carpeta y entrega los documentos a medida que se leen
+
+        Ni la lista de archivos ni la de documentos se construyen enteras: quien
+        consume el generador (p. ej. LegalRAGSystem.load_documents_from_folder)
+        puede trocear y embeber los primeros mientras se leen los siguientes.
+
+        Args:
+            folder_path: Carpeta raíz
+            recursive: Si True, recorre también las subcarpetas
+            pattern: Patrón de los archivos a cargar
+            ignore: Patrones de archivos y carpetas a omitir (ver find_files)
+            skip: Función ruta → True para no leer ese archivo (p. ej. si no cambió)
+            max_workers: Archivos leídos en paralelo
+            report: LoadReport donde anotar lo cargado, omitido y fallido
+
+        Yields:
+            Documents en el orden de find_files
+        """
+        # No es un generador: la carpeta se comprueba al llamar, no al pedir el primer documento
+        if not os.path.isdir(folder_path):
+            raise ValueError(f"La carpeta {folder_path} no existe")
+        report = report if report is not None else LoadReport()
+        paths = DocumentLoader.find_files(folder_path, pattern=pattern, recursive=recursive, ignore=ignore, report=report)
+        if skip is not None:
+            paths = DocumentLoader._without_skipped(paths, skip, report)
+        return DocumentLoader.iter_documents(paths, max_workers=max_workers, report=report)
+
+    @staticmethod
+    def find_files(folder_path: str, pattern: str = "*.md", recursive: bool = True,
+                   ignore: Sequence[str] = DEFAULT_IGNORE, report: Optional[LoadReport] = None) -> Iterator[str]:
+        """
+        Rutas de los archivos que cumplen pattern, sin listar el árbol completo
+
+        Cada carpeta se recorre en orden alfabético: primero sus archivos y luego
+        sus subcarpetas.
+
+        Un patrón de ignore excluye los archivos y carpetas (con todo su
+        contenido) cuyo nombre o ruta relativa a folder_path lo cumplen, p. ej.
+        ".*", "borradores" o "anexos/*.md". No se siguen enlaces a carpetas.
+        """
+        pending = [folder_path]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                logger.error("❌ Error leyendo la carpeta %s: %s", directory, e)
+                if report is not None:
+                    report.failed[directory] = f"{type(e).__name__}: {e}"
+                continue
+            subdirectories = []
+            for entry in entries:
+                relative = os.path.relpath(entry.path, folder_path).replace(os.sep, '/')
+                if any(fnmatch(entry.name, p) or fnmatch(relative, p) for p in ignore):
+                    if report is not None:
+                        report.ignored += 1
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirectories.append(entry.path)
+                elif fnmatch(entry.name, pattern):
+                    yield entry.path
+            # En orden inverso: la pila saca primero la primera subcarpeta
+            pending.extend(reversed(subdirectories))
+
+    @staticmethod
+    def _without_skipped(paths: Iterable[str], skip: Callable[[str], bool], report: LoadReport) -> Iterator[str]:
+        for path in paths:
+            if skip(path):
+                report.skipped += 1
+            else:
+                yield path
+
+    @staticmethod
+    def iter_documents(paths: Iterable[str], max_workers: int = 8, report: Optional[LoadReport] = None) -> Iterator[Document]:
+        """
+        Lee archivos en un pool de hilos y entrega los documentos en el orden de paths
+
+        Como mucho hay 4 × max_workers lecturas adelantadas, así que la memoria no
+        depende del número de archivos. Los errores de lectura se anotan en report
+        y el archivo se salta.
+        """
+        report = report if report is not None else LoadReport()
+        paths = iter(paths)
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="loader")
+        try:
+            pending = deque()
+            for path in paths:
+                pending.append((path, executor.submit(DocumentLoader.load_markdown_file, path)))
+                if len(pending) >= 4 * max(max_workers, 1):
+                    break
+            while pending:
+                path, future = pending.popleft()
+                following = next(paths, None)
+                if following is not None:
+                    pending.append((following, executor.submit(DocumentLoader.load_markdown_file, following)))
+                try:
+                    document = future.result()
+                except Exception as e:
+                    logger.error("❌ Error cargando %s: %s", path, e)
+                    report.failed[path] = f"{type(e).__name__}: {e}"
+                    continue
+                report.loaded += 1
+                report.bytes += document.metadata['size']
+                logger.debug("Cargado: %s", path)
+                yield document
+        finally:
+            # Si el consumidor deja el generador a medias no se esperan las lecturas pendientes
+            executor.shutdown(wait=False, cancel_futures=True)
+            report.seconds += time.perf_counter() - started
     
     @staticmethod
     def chunk_document(document: Document, chunk_size: int = 500) -> List[Document]:
         """
-        Divide un documento en chunks más pequeños
-        (Útil para documentos muy largos)
+        Divide un documento en chunks por secciones Markdown y artículos
+
+        Corta en cada encabezado Markdown ("#", "##", ...) y en cada inicio de
+        artículo ("Art. N", "Artículo N"). Los encabezados sin cuerpo (p. ej. el
+        título del código o de un "Título II") se unen a la sección siguiente, y
+        las secciones más largas que chunk_size se parten por párrafos.
+        Cada chunk es un fragmento literal del documento original.
+
+        Los chunks comparten los metadatos del documento (ver ChunkMetadata). Si
+        el documento está en un TextStore, cada chunk es un rango de sus bytes y
+        el texto no se copia.
         
         Args:
             document: Documento a dividir
-            chunk_size: Tamaño aproximado de cada chunk en caracteres
+            chunk_size: Tamaño máximo aproximado de cada chunk en caracteres
             
         Returns:
-            Lista de Documents (chunks)
+            Lista de Documents (chunks) con 'chunk_id', 'start' y 'end' en metadata
         """
         content = document.content
+        store = document.store
+        byte_offset = _byte_offsets(content) if store is not None else None
         chunks = []
         
-        # Simple splitting por párrafos
-        paragraphs = content.split('\n\n')
-        current_chunk = ""
-        chunk_idx = 0
+        for start, end in DocumentLoader._split_spans(content, chunk_size):
+            piece = content[start:end]
+            text = piece.strip()
+            if not text:
+                continue
+            metadata = ChunkMetadata(document.metadata, len(chunks), start, end)
+            if store is None:
+                chunks.append(Document(content=text, metadata=metadata))
+                continue
+            first = start + len(piece) - len(piece.lstrip())
+            first_byte = byte_offset(first)
+            length = byte_offset(first + len(text)) - first_byte
+            chunks.append(Document.stored(store, document._offset + first_byte, length, metadata))
         
-        for para in paragraphs:
-            if len(current_chunk) + len(para) < chunk_size:
-                current_chunk += para + "\n\n"
-            else:
-                if current_chunk:
-                    metadata = document.metadata.copy()
-                    metadata['chunk_id'] = chunk_idx
-                    chunks.append(Document(content=current_chunk.strip(), metadata=metadata))
-                    chunk_idx += 1
-                current_chunk = para + "\n\n"
+        return chunks
+
+    @staticmethod
+    def _split_spans(content: str, chunk_size: int) -> List[Tuple[int, int]]:
+        """
+        Calcula los rangos [inicio, fin) de cada chunk dentro de content
+        """
+        # 1. Cortes en encabezados y artículos
+        boundaries = sorted({0, *(m.start() for m in _SECTION_START.finditer(content))})
+        sections = [(a, b) for a, b in zip(boundaries, boundaries[1:] + [len(content)]) if a < b]
         
-        # Agregar el último chunk
-        if current_chunk:
-            metadata = document.metadata.copy()
-            metadata['chunk_id'] = chunk_idx
-            chunks.append(Document(content=current_chunk.strip(), metadata=metadata))
+        # 2. Encabezados sin cuerpo se unen a la sección siguiente
+        merged = []
+        pending_start = None
+        for start, end in sections:
+            if pending_start is not None:
+                start = pending_start
+                pending_start = None
+            if _is_heading_only(content[start:end]):
+                pending_start = start
+                continue
+            merged.append((start, end))
+        if pending_start is not None:
+            if merged:
+                merged[-1] = (merged[-1][0], len(content))
+            else:
+                merged.append((pending_start, len(content)))
         
-        return chunks
+        # 3. Secciones demasiado largas se parten por párrafos (y por espacios si hace falta)
+        spans = []
+        for start, end in merged:
+            spans.extend(_split_long(content, start, end, chunk_size))
+        return spans
+
+
+def _byte_offsets(content: str):
+    """
+    Función carácter → byte del texto codificado en UTF-8
+
+    Las posiciones deben pedirse en orden creciente: cada llamada solo codifica
+    el tramo desde la anterior.
+    """
+    if content.isascii():
+        return lambda i: i
+    position = [0, 0]
+
+    def offset(i: int) -> int:
+        position[1] += len(content[position[0]:i].encode('utf-8'))
+        position[0] = i
+        return position[1]
+    return offset
+
+
+def _is_heading_only(text: str) -> bool:
+    """True si el texto solo contiene líneas de encabezado Markdown (o vacías)"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    return bool(lines) and all(_HEADING_LINE.match(line) for line in lines)
+
+
+def _split_long(content: str, start: int, end: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Parte el rango [start, end) en trozos de como mucho chunk_size caracteres,
+    cortando preferentemente en párrafos y, si no, en espacios
+    """
+    spans = []
+    while end - start > chunk_size:
+        window = content[start:start + chunk_size]
+        cut = window.rfind('\n\n')
+        if cut <= 0:
+            cut = window.rfind(' ')
+        if cut <= 0:
+            cut = chunk_size
+        spans.append((start, start + cut))
+        start += cut
+    spans.append((start, end))
+    return spans
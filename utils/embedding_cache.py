@@ -0,0 +1,99 @@
+"""
+Caché persistente de embeddings direccionada por contenido
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def content_hash(text: str) -> str:
+    """
+    Calcula el hash SHA-256 del contenido de un texto
+
+    Args:
+        text: Texto a hashear
+
+    Returns:
+        Hash hexadecimal del contenido
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Almacena embeddings en disco indexados por (modelo, input_type, hash del contenido)
+
+    Cada embedding se guarda como un archivo .npy independiente, de modo que
+    solo los documentos nuevos o modificados necesitan pasar por la API.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir: Carpeta donde se guardan los embeddings
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, model: str, input_type: str, text_hash: str) -> str:
+        return hashlib.sha256(f"{model}\x00{input_type}\x00{text_hash}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        # Dos niveles de subcarpetas para no acumular miles de archivos en una sola
+        return self.cache_dir / key[:2] / f"{key}.npy"
+
+    def get(self, model: str, input_type: str, text_hash: str) -> Optional[np.ndarray]:
+        """
+        Busca un embedding en la caché
+
+        Returns:
+            El embedding si existe, None en caso contrario
+        """
+        path = self._path(self._key(model, input_type, text_hash))
+        try:
+            embedding = np.load(path, allow_pickle=False)
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return embedding
+
+    def put(self, model: str, input_type: str, text_hash: str, embedding: np.ndarray):
+        """
+        Guarda un embedding en la caché (escritura atómica)
+        """
+        path = self._path(self._key(model, input_type, text_hash))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(embedding, dtype=np.float32), allow_pickle=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get_many(self, model: str, input_type: str, text_hashes: List[str]) -> Dict[int, np.ndarray]:
+        """
+        Busca varios embeddings a la vez
+
+        Returns:
+            Diccionario {posición en text_hashes: embedding} con los aciertos
+        """
+        found = {}
+        for i, text_hash in enumerate(text_hashes):
+            embedding = self.get(model, input_type, text_hash)
+            if embedding is not None:
+                found[i] = embedding
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        """Contadores de aciertos y fallos desde la creación de la caché"""
+        return {'hits': self.hits, 'misses': self.misses}
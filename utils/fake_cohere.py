@@ -0,0 +1,333 @@
+"""
+Cliente de Cohere simulado: determinista, sin red y con latencia configurable
+
+Los embeddings se obtienen por hashing de las palabras del texto, así que
+textos con vocabulario común quedan cerca y la búsqueda devuelve
+resultados con sentido. Rerank puntúa por similaridad coseno de esos mismos
+vectores y chat devuelve un texto fijo derivado del prompt.
+
+FakeCohereServer sirve esas mismas respuestas por HTTP (API v1) para probar
+la capa de red (utils.cohere_session) con errores inyectados.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from .context_packer import estimate_tokens
+
+
+_WORD = re.compile(r'\w+')
+
+
+class FakeCohereClient:
+    """
+    Implementa CohereClient (ver utils.clients) sin llamar a la API
+
+    Mismas entradas → mismas salidas en cualquier proceso (se usa blake2b, no
+    hash(), que cambia entre ejecuciones). La latencia simulada sí varía si
+    jitter > 0, pero la secuencia depende solo de seed.
+    """
+
+    def __init__(self, dim: int = 1024, latency: Union[float, Dict[str, float]] = 0.0,
+                 jitter: float = 0.0, seed: int = 0, answer: Optional[str] = None):
+        """
+        Args:
+            dim: Dimensiones de los embeddings
+            latency: Segundos de espera por llamada, uno para todos los endpoints o
+                por endpoint ({'embed': 0.05, 'rerank': 0.1, 'chat': 0.8})
+            jitter: Segundos extra aleatorios (uniforme entre 0 y jitter) por llamada
+            seed: Semilla de los embeddings de textos sin tokens y del jitter
+            answer: Texto fijo de chat (None genera uno a partir del prompt)
+        """
+        self.dim = dim
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.answer = answer
+        self.calls: Counter = Counter()
+        self._key = seed.to_bytes(8, 'little', signed=True)
+        self._slots: Dict[str, tuple] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # --- Respuestas (sin espera) ---
+
+    def embed_vector(self, text: str) -> np.ndarray:
+        """Embedding determinista y normalizado de un texto"""
+        # Tokenización mínima a propósito: el cliente simulado no debe pesar en los benchmarks
+        tokens = _WORD.findall(text.lower())
+        if not tokens:
+            digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8, key=self._key).digest()
+            vector = np.random.default_rng(int.from_bytes(digest, 'little')).standard_normal(self.dim)
+            return (vector / np.linalg.norm(vector)).astype(np.float32)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        slots = [self._slot(token) for token in tokens]
+        np.add.at(vector, [slot for slot, _ in slots], [sign for _, sign in slots])
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[slots[0][0]] = 1.0
+            norm = 1.0
+        return vector / norm
+
+    def _slot(self, token: str) -> tuple:
+        """Posición y signo de un token en el vector (memorizados)"""
+        slot = self._slots.get(token)
+        if slot is None:
+            value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8, key=self._key).digest(), 'little')
+            slot = (value % self.dim, 1.0 if value >> 63 else -1.0)
+            self._slots[token] = slot
+        return slot
+
+    def _embed_response(self, texts: List[str]) -> SimpleNamespace:
+        self._count("embed")
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return SimpleNamespace(
+            embeddings=SimpleNamespace(float=[self.embed_vector(text) for text in texts]),
+            meta=_meta(billed_units={'input_tokens': tokens})
+        )
+
+    def _rerank_response(self, query: str, documents: List[str], top_n: int) -> SimpleNamespace:
+        self._count("rerank")
+        query_vector = self.embed_vector(query)
+        scores = np.array([float(self.embed_vector(doc) @ query_vector) for doc in documents])
+        # Similaridad coseno llevada a [0, 1], como relevance_score
+        scores = (scores + 1.0) / 2.0
+        order = np.argsort(-scores, kind='stable')[:top_n]
+        results = [SimpleNamespace(index=int(i), relevance_score=float(scores[i])) for i in order]
+        return SimpleNamespace(results=results, meta=_meta(billed_units={'search_units': 1 + (len(documents) - 1) // 100}))
+
+    def _chat_response(self, message: str) -> SimpleNamespace:
+        self._count("chat")
+        text = self.answer
+        if text is None:
+            digest = hashlib.sha256(message.encode('utf-8')).hexdigest()[:12]
+            text = f"Respuesta simulada {digest} a partir de {len(message)} caracteres de prompt."
+        usage = {'input_tokens': estimate_tokens(message), 'output_tokens': estimate_tokens(text)}
+        return SimpleNamespace(text=text, meta=_meta(billed_units=usage, tokens=usage))
+
+    @staticmethod
+    def _stream_events(response: SimpleNamespace) -> List[SimpleNamespace]:
+        words = response.text.split(' ')
+        events = [SimpleNamespace(event_type="stream-start")]
+        events += [SimpleNamespace(event_type="text-generation", text=word if i == 0 else ' ' + word)
+                   for i, word in enumerate(words)]
+        events.append(SimpleNamespace(event_type="stream-end", finish_reason="COMPLETE", response=response))
+        return events
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def _delay(self, endpoint: str) -> float:
+        """Segundos que debe tardar una llamada al endpoint"""
+        base = self.latency.get(endpoint, 0.0) if isinstance(self.latency, dict) else self.latency
+        if self.jitter:
+            with self._lock:
+                base += self._random.uniform(0.0, self.jitter)
+        return base
+
+    def _wait(self, endpoint: str):
+        delay = self._delay(endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    # --- API de cohere.Client ---
+
+    def embed(self, *, texts: List[str], model: str = "", input_type: str = "",
+              embedding_types: Optional[List[str]] = None, **kwargs) -> SimpleNamespace:
+        self._wait("embed")
+        return self._embed_response(texts)
+
+    def rerank(self, *, query: str, documents: List[str], top_n: int, model: str = "",
+               return_documents: bool = False, **kwargs) -> SimpleNamespace:
+        self._wait("rerank")
+        return self._rerank_response(query, documents, top_n)
+
+    def chat(self, *, message: str, model: str = "", temperature: float = 0.3, **kwargs) -> SimpleNamespace:
+        self._wait("chat")
+        return self._chat_response(message)
+
+    def chat_stream(self, *, message: str, model: str = "", temperature: float = 0.3,
+                    **kwargs) -> Iterator[SimpleNamespace]:
+        # La latencia se aplica antes del primer token (time to first token)
+        self._wait("chat")
+        yield from self._stream_events(self._chat_response(message))
+
+
+class AsyncFakeCohereClient(FakeCohereClient):
+    """
+    Versión asíncrona (AsyncCohereClient): la latencia se simula con asyncio.sleep
+    """
+
+    async def _await(self, endpoint: str):
+        delay = self._delay(endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def embed(self, *, texts: List[str], model: str = "", input_type: str = "",
+                    embedding_types: Optional[List[str]] = None, **kwargs) -> SimpleNamespace:
+        await self._await("embed")
+        return self._embed_response(texts)
+
+    async def rerank(self, *, query: str, documents: List[str], top_n: int, model: str = "",
+                     return_documents: bool = False, **kwargs) -> SimpleNamespace:
+        await self._await("rerank")
+        return self._rerank_response(query, documents, top_n)
+
+    async def chat(self, *, message: str, model: str = "", temperature: float = 0.3, **kwargs) -> SimpleNamespace:
+        await self._await("chat")
+        return self._chat_response(message)
+
+    async def chat_stream(self, *, message: str, model: str = "", temperature: float = 0.3,
+                          **kwargs) -> AsyncIterator[SimpleNamespace]:
+        await self._await("chat")
+        for event in self._stream_events(self._chat_response(message)):
+            yield event
+
+
+def _meta(billed_units: Dict[str, int], tokens: Optional[Dict[str, int]] = None) -> SimpleNamespace:
+    """Objeto .meta con la forma de las respuestas del SDK"""
+    meta = SimpleNamespace(billed_units=SimpleNamespace(**billed_units))
+    meta.tokens = SimpleNamespace(**tokens) if tokens is not None else None
+    return meta
+
+
+class FakeCohereServer:
+    """
+    Servidor HTTP local con los endpoints v1 embed, rerank y chat (también en streaming)
+
+    Responde con un FakeCohereClient. fail() encola errores para los
+    próximos intentos de un endpoint (p. ej. tres 429 con Retry-After) y
+    requests/connections cuentan lo recibido, para comprobar reintentos y pooling.
+
+        with FakeCohereServer() as server:
+            session = CohereSession("clave", base_url=server.url)
+    """
+
+    def __init__(self, client: Optional[FakeCohereClient] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            client: Cliente que calcula las respuestas (None = FakeCohereClient())
+            host, port: Dirección de escucha (port=0 elige uno libre)
+        """
+        self.client = client or FakeCohereClient()
+        self.requests: Counter = Counter()
+        self.connections = 0
+        self._faults: Dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fail(self, endpoint: str, status: int = 429, times: int = 1, retry_after: Optional[float] = None):
+        """Las próximas times peticiones a endpoint responden status (con Retry-After si se indica)"""
+        with self._lock:
+            self._faults[endpoint].extend([(status, retry_after)] * times)
+
+    def start(self) -> "FakeCohereServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-cohere", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeCohereServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_fault(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] += 1
+            return self._faults[endpoint].popleft() if self._faults[endpoint] else None
+
+    def _respond(self, endpoint: str, body: Dict) -> tuple:
+        """(status, cabeceras, cuerpo) de una petición válida"""
+        client = self.client
+        if endpoint == "embed":
+            response = client._embed_response(body['texts'])
+            payload = {'response_type': "embeddings_by_type", 'id': "fake", 'texts': body['texts'],
+                       'embeddings': {'float': [vector.tolist() for vector in response.embeddings.float]},
+                       'meta': _meta_dict(response.meta)}
+        elif endpoint == "rerank":
+            response = client._rerank_response(body['query'], body['documents'], body.get('top_n', len(body['documents'])))
+            payload = {'id': "fake", 'meta': _meta_dict(response.meta),
+                       'results': [{'index': r.index, 'relevance_score': r.relevance_score} for r in response.results]}
+        elif endpoint == "chat":
+            response = client._chat_response(body['message'])
+            payload = {'text': response.text, 'generation_id': "fake", 'finish_reason': "COMPLETE",
+                       'meta': _meta_dict(response.meta)}
+            if body.get('stream'):
+                lines = [{'event_type': "stream-start", 'generation_id': "fake", 'is_finished': False}]
+                lines += [{'event_type': "text-generation", 'text': event.text, 'is_finished': False}
+                          for event in client._stream_events(response) if event.event_type == "text-generation"]
+                lines.append({'event_type': "stream-end", 'finish_reason': "COMPLETE", 'is_finished': True,
+                              'response': payload})
+                return 200, "application/stream+json", "".join(json.dumps(line) + "\n" for line in lines)
+        else:
+            return 404, "application/json", json.dumps({'message': f"endpoint desconocido: {endpoint}"})
+        return 200, "application/json", json.dumps(payload)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1: las conexiones se reutilizan (keep-alive) entre peticiones
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                fault = server._next_fault(endpoint)
+                headers = {}
+                if fault is not None:
+                    status, retry_after = fault
+                    content_type, text = "application/json", json.dumps({'message': f"error simulado {status}"})
+                    if retry_after is not None:
+                        headers['Retry-After'] = f"{retry_after:g}"
+                else:
+                    status, content_type, text = server._respond(endpoint, body)
+                data = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _meta_dict(meta: SimpleNamespace) -> Dict:
+    """Campo meta de una respuesta simulada como JSON de la API"""
+    result = {'billed_units': vars(meta.billed_units)}
+    if meta.tokens is not None:
+        result['tokens'] = vars(meta.tokens)
+    return result
@@ -0,0 +1,88 @@
+"""
+Resultados de búsqueda inmutables: filas del índice y scores en arrays de NumPy
+
+Sustituyen a escribir el score en el propio Document (compartido entre
+consultas): cada búsqueda devuelve su SearchHits y el corpus no se modifica,
+así que varios hilos pueden consultar el mismo sistema a la vez.
+"""
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Union, overload
+
+import numpy as np
+
+from .document_loader import Document
+
+
+class Hit(NamedTuple):
+    """Un candidato: fila del índice, score del paso 1 y su chunk"""
+    row: int
+    score: float
+    document: Document
+
+    @property
+    def content(self) -> str:
+        return self.document.content
+
+    @property
+    def metadata(self) -> Dict:
+        return self.document.metadata
+
+
+class SearchHits(Sequence[Hit]):
+    """
+    Candidatos del paso 1 en orden, como dos arrays de solo lectura (rows, scores)
+
+    Los Hit se crean al acceder a ellos; filtrar, cortar o leer los scores no
+    crea objetos por candidato. Guarda la lista de chunks vigente al buscar,
+    de modo que una compactación posterior no cambia a qué chunk apunta cada fila.
+    """
+
+    __slots__ = ('rows', 'scores', '_chunks')
+
+    def __init__(self, rows: np.ndarray, scores: np.ndarray, chunks: Sequence[Document]):
+        """
+        Args:
+            rows: Filas del índice, de mejor a peor
+            scores: Score de cada fila (las no finitas, relleno de search_many, se descartan)
+            chunks: Chunks del sistema (la fila i es chunks[i])
+        """
+        rows = np.array(rows, dtype=np.int64)
+        scores = np.array(scores, dtype=np.float32)
+        finite = np.isfinite(scores)
+        if not finite.all():
+            rows, scores = rows[finite], scores[finite]
+        rows.setflags(write=False)
+        scores.setflags(write=False)
+        self.rows = rows
+        self.scores = scores
+        self._chunks = chunks
+
+    @classmethod
+    def empty(cls) -> "SearchHits":
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), ())
+
+    def __len__(self) -> int:
+        return self.rows.shape[0]
+
+    @overload
+    def __getitem__(self, i: int) -> Hit: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "SearchHits": ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Hit, "SearchHits"]:
+        if isinstance(i, slice):
+            return SearchHits(self.rows[i], self.scores[i], self._chunks)
+        row = int(self.rows[i])
+        return Hit(row, float(self.scores[i]), self._chunks[row])
+
+    def __iter__(self) -> Iterator[Hit]:
+        for row, score in zip(self.rows.tolist(), self.scores.tolist()):
+            yield Hit(row, score, self._chunks[row])
+
+    def __repr__(self) -> str:
+        return f"SearchHits({len(self)} candidatos)"
+
+    @property
+    def documents(self) -> List[Document]:
+        """Chunks de los candidatos, en orden"""
+        return [self._chunks[row] for row in self.rows.tolist()]
@@ -0,0 +1,99 @@
+"""
+Logging del sistema RAG: consola, JSON con ID de consulta o silencio total
+
+Todos los módulos escriben en loggers bajo "legal_rag" con formato diferido
+(logger.info("... %s", valor)): si el nivel está desactivado el mensaje no
+llega a formatearse. Sin configure_logging() la librería no escribe nada.
+"""
+import json
+import logging
+import os
+import sys
+from typing import Optional, TextIO
+
+from .metrics import current_trace
+
+
+ROOT_LOGGER = "legal_rag"
+LOG_MODES = ("console", "json", "silent")
+
+# Separador de los banners de consulta en modo consola
+BANNER = "=" * 60
+
+logging.getLogger(ROOT_LOGGER).addHandler(logging.NullHandler())
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger hijo de "legal_rag" (p. ej. get_logger("rag_system") → legal_rag.rag_system)"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class QueryIdFilter(logging.Filter):
+    """Añade record.query_id con el ID de la consulta en curso ("-" fuera de una consulta)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = current_trace()
+        record.query_id = trace.query_id if trace is not None else "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, query_id, message y los extra del registro"""
+
+    _STANDARD = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'query_id'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'query_id': getattr(record, 'query_id', "-"),
+            'message': record.getMessage().strip(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(mode: Optional[str] = None, level: int = logging.INFO,
+                      stream: Optional[TextIO] = None) -> logging.Logger:
+    """
+    Configura la salida de los loggers "legal_rag"
+
+    Args:
+        mode: "console" (mensajes legibles, como el demo), "json" (una línea JSON
+            por registro con query_id) o "silent" (nada; ni siquiera se formatean
+            los mensajes). None lee la variable de entorno RAG_LOG_MODE (por defecto "console")
+        level: Nivel mínimo (logging.DEBUG muestra también el detalle por candidato)
+        stream: Destino (por defecto stdout en consola y stderr en JSON)
+
+    Returns:
+        El logger raíz "legal_rag"
+    """
+    mode = mode or os.getenv("RAG_LOG_MODE", "console")
+    if mode not in LOG_MODES:
+        raise ValueError(f"mode debe ser uno de {LOG_MODES}, no {mode!r}")
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        if not isinstance(handler, logging.NullHandler):
+            logger.removeHandler(handler)
+    logger.propagate = False
+
+    if mode == "silent":
+        # Por encima de CRITICAL: isEnabledFor() corta antes de crear el registro
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+
+    if mode == "json":
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.addFilter(QueryIdFilter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
@@ -0,0 +1,248 @@
+"""
+Métricas en proceso: tiempos por etapa, uso facturado de Cohere y exportación Prometheus
+
+- QueryTrace acumula los tiempos y el uso de una consulta; la traza activa se
+  guarda en una ContextVar, así cada etapa la encuentra sin pasarla por parámetro
+- MetricsRegistry guarda histogramas y contadores (seguros entre hilos) y los
+  exporta en formato de texto de Prometheus
+"""
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Límites superiores de los buckets en segundos (desde 1 ms hasta 30 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Histograma con buckets acumulativos (para Prometheus) y una muestra de las
+    últimas observaciones (para percentiles exactos en proceso)
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, reservoir_size: int = 2048):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: deque = deque(maxlen=reservoir_size)
+
+    def observe(self, value: float):
+        """Registra una observación (no es seguro entre hilos: lo protege el registro)"""
+        position = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                position = i
+                break
+        self.bucket_counts[position] += 1
+        self.count += 1
+        self.sum += value
+        self._recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        """Percentil q (0-1) de las últimas observaciones (0.0 si no hay ninguna)"""
+        if not self._recent:
+            return 0.0
+        return float(np.quantile(np.fromiter(self._recent, dtype=np.float64), q))
+
+
+class MetricsRegistry:
+    """
+    Histogramas y contadores con etiquetas, exportables en formato Prometheus
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        """Texto de ayuda (# HELP) de una métrica"""
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Añade una observación al histograma name con esas etiquetas"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str):
+        """Incrementa el contador name con esas etiquetas"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def counter(self, name: str, **labels: str) -> float:
+        """Valor actual de un contador (0 si no existe)"""
+        return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def total(self, name: str, **labels: str) -> float:
+        """Suma de las series de un contador que tienen esas etiquetas (y cualquier otra)"""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum((value for key, value in self._counters.get(name, {}).items() if wanted <= set(key)), 0.0)
+
+    def summary(self, name: str, label: str) -> Dict[str, Dict[str, float]]:
+        """
+        Resumen de un histograma agrupado por una etiqueta
+
+        Returns:
+            {valor de la etiqueta: {'count', 'mean', 'p50', 'p95', 'p99'}}
+        """
+        result = {}
+        with self._lock:
+            for key, histogram in self._histograms.get(name, {}).items():
+                value = dict(key).get(label, "")
+                result[value] = {
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                    'p50': histogram.quantile(0.50),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                }
+        return result
+
+    def render_prometheus(self) -> str:
+        """
+        Exporta todas las métricas en el formato de texto de Prometheus (versión 0.0.4)
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.extend(self._header(name, "counter"))
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                lines.extend(self._header(name, "histogram"))
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.bucket_counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float('inf') else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, kind: str):
+        if name in self._help:
+            yield f"# HELP {name} {self._help[name]}"
+        yield f"# TYPE {name} {kind}"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class QueryTrace:
+    """
+    Tiempos por etapa, uso de la API e ID de correlación (para los logs) de una consulta
+    """
+
+    def __init__(self, timings: Optional[Dict[str, float]] = None, query_id: Optional[str] = None):
+        self.query_id = query_id or uuid.uuid4().hex[:16]
+        self.timings: Dict[str, float] = dict(timings or {})
+        self.usage: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def add_timing(self, stage: str, seconds: float):
+        """Suma segundos a una etapa (una etapa puede ejecutarse varias veces)"""
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def add_usage(self, endpoint: str, usage: Dict[str, Dict[str, float]]):
+        """Suma el uso de una respuesta de la API (ver response_usage)"""
+        totals = self.usage.setdefault(endpoint, {})
+        for group, values in usage.items():
+            group_totals = totals.setdefault(group, {})
+            for unit, value in values.items():
+                group_totals[unit] = group_totals.get(unit, 0) + value
+
+
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar('rag_query_trace', default=None)
+
+
+def current_trace() -> Optional[QueryTrace]:
+    """Traza de la consulta en curso en este hilo/tarea (None fuera de una consulta)"""
+    return _current_trace.get()
+
+
+@contextmanager
+def activate(trace: QueryTrace) -> Iterator[QueryTrace]:
+    """Hace de trace la traza activa mientras dura el bloque"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def response_usage(response) -> Dict[str, Dict[str, float]]:
+    """
+    Extrae el uso que informa Cohere en response.meta
+
+    Returns:
+        {'billed_units': {...}, 'tokens': {...}} solo con los campos presentes
+    """
+    meta = getattr(response, 'meta', None)
+    usage = {}
+    for group in ('billed_units', 'tokens'):
+        values = getattr(meta, group, None)
+        if values is None:
+            continue
+        fields = {}
+        for unit in ('input_tokens', 'output_tokens', 'search_units', 'classifications', 'images'):
+            value = getattr(values, unit, None)
+            if isinstance(value, (int, float)):
+                fields[unit] = value
+        if fields:
+            usage[group] = fields
+    return usage
+
+
+def serve_metrics(registry: MetricsRegistry, port: int = 9464, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Sirve GET /metrics en formato Prometheus desde un hilo en segundo plano
+
+    Returns:
+        El servidor (server.shutdown() lo detiene)
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,88 @@
+"""
+Política adaptativa de rerank: decide entre el paso 1 y el 2 si hace falta llamar a Rerank
+
+Con pocos candidatos o con un candidato claramente dominante, el orden de la
+búsqueda semántica ya es suficiente y se ahorra una llamada de red; con un
+salto brusco de scores, los candidatos por debajo del salto no se envían.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+def skip_decision(reason: str, candidates: int) -> Dict:
+    """Decisión de no llamar a Rerank (p. ej. por una cita exacta)"""
+    return {'action': "skip", 'reason': reason, 'candidates': candidates, 'sent': 0}
+
+
+class RerankPolicy:
+    """
+    Decide, a partir de los scores del paso 1, si se hace rerank y con cuántos candidatos
+
+    Acciones posibles:
+        "skip":   no se llama a Rerank; se usan los top_k candidatos en su orden
+        "narrow": se llama a Rerank solo con los candidatos anteriores al mayor salto de score
+        "rerank": se llama a Rerank con todos los candidatos
+    """
+
+    def __init__(self, skip_at_most_top_k: bool = True, skip_margin: Optional[float] = 0.1,
+                 narrow_gap: Optional[float] = 0.08):
+        """
+        Args:
+            skip_at_most_top_k: Saltar el rerank si hay top_k candidatos o menos
+                (todos entran en el contexto de todas formas)
+            skip_margin: Diferencia mínima entre el primer y el segundo score para
+                considerar dominante al primero y saltar el rerank (None lo desactiva)
+            narrow_gap: Salto mínimo entre scores consecutivos (a partir de la
+                posición top_k) para descartar los candidatos de debajo (None lo desactiva)
+        """
+        self.skip_at_most_top_k = skip_at_most_top_k
+        self.skip_margin = skip_margin
+        self.narrow_gap = narrow_gap
+
+    def decide(self, scores: Sequence[float], top_k: int, scores_comparable: bool = True) -> Dict:
+        """
+        Decide qué hacer con los candidatos
+
+        Args:
+            scores: Scores del paso 1, de mayor a menor
+            top_k: Documentos que se quieren tras el rerank
+            scores_comparable: False si los scores no son similaridades coseno (BM25,
+                RRF); entonces solo se aplica la regla del número de candidatos
+
+        Returns:
+            Diccionario con 'action', 'reason', 'candidates' (recibidos) y 'sent'
+            (enviados a Rerank), más 'margin' y 'gap' cuando se calculan
+
+        Raises:
+            ValueError: Si top_k < 1
+        """
+        if top_k < 1:
+            raise ValueError(f"top_k debe ser al menos 1 (recibido {top_k})")
+        n = len(scores)
+        decision = {'action': "rerank", 'reason': "default", 'candidates': n, 'sent': n}
+        if n == 0:
+            return skip_decision("no_candidates", n)
+        if self.skip_at_most_top_k and n <= top_k:
+            return skip_decision("few_candidates", n)
+        if n == 1:
+            # Un solo candidato no se puede reordenar
+            return skip_decision("single_candidate", n)
+        if not scores_comparable:
+            return decision
+
+        scores = np.asarray(scores, dtype=np.float64)
+        margin = float(scores[0] - scores[1])
+        decision['margin'] = round(margin, 4)
+        if self.skip_margin is not None and margin >= self.skip_margin:
+            return {**skip_decision("dominant_hit", n), 'margin': decision['margin']}
+
+        if self.narrow_gap is not None and n > top_k:
+            # Mayor caída entre posiciones consecutivas sin cortar por encima de top_k
+            drops = scores[top_k - 1:-1] - scores[top_k:]
+            cut = int(np.argmax(drops))
+            gap = float(drops[cut])
+            decision['gap'] = round(gap, 4)
+            if gap >= self.narrow_gap:
+                return {**decision, 'action': "narrow", 'reason': "score_gap", 'sent': top_k + cut}
+        return decision
@@ -0,0 +1,106 @@
+"""
+Almacén contiguo del texto del corpus: un único buffer UTF-8 en memoria o en un archivo mapeado
+
+Los documentos se guardan una vez y sus chunks son rangos de bytes del mismo
+buffer (ver Document.stored y DocumentLoader.chunk_document), de modo que el
+texto no se duplica entre documento y chunks ni se crea un str por chunk.
+El texto se decodifica solo al leer Document.content: en una consulta, para
+los candidatos que llegan a Rerank o al prompt.
+"""
+import mmap
+import os
+import threading
+from typing import Optional
+
+from .document_loader import Document, intern_metadata
+
+
+class TextStore:
+    """
+    Buffer de solo añadir con el texto de los documentos
+
+    Sin path el buffer es un bytearray. Con path los bytes se escriben en ese
+    archivo y se leen con mmap: el sistema operativo decide qué páginas quedan
+    en memoria y puede descartarlas bajo presión. Eliminar documentos no libera
+    su texto; se recupera al recargar el corpus (load_documents_from_folder).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Archivo donde guardar el texto (None lo guarda en memoria). Si
+                existe se reemplaza: no debe tenerlo abierto otro TextStore.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._size = 0
+        self._buffer: Optional[bytearray] = None
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        if path is None:
+            self._buffer = bytearray()
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            self._file = open(path, 'w+b')
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes de texto guardados"""
+        return self._size
+
+    def add(self, document: Document) -> Document:
+        """
+        Guarda el texto de un documento
+
+        Returns:
+            Documento equivalente cuyo contenido vive en el almacén (con los
+            valores str de los metadatos internados)
+        """
+        data = document.content.encode('utf-8')
+        return Document.stored(self, self.append(data), len(data), intern_metadata(document.metadata))
+
+    def append(self, data: bytes) -> int:
+        """Añade bytes al final del buffer y devuelve su posición"""
+        with self._lock:
+            offset = self._size
+            if self._buffer is not None:
+                self._buffer += data
+            else:
+                self._file.seek(offset)
+                self._file.write(data)
+            self._size += len(data)
+        return offset
+
+    def text(self, offset: int, length: int) -> str:
+        """Decodifica los bytes [offset, offset + length)"""
+        if self._buffer is not None:
+            return self._buffer[offset:offset + length].decode('utf-8')
+        if length == 0:
+            return ""
+        view = self._map
+        if view is None or len(view) < offset + length:
+            view = self._remap()
+        return view[offset:offset + length].decode('utf-8')
+
+    def _remap(self) -> mmap.mmap:
+        """Vuelve a mapear el archivo para incluir lo añadido desde el último mapa"""
+        with self._lock:
+            if self._map is None or len(self._map) < self._size:
+                self._file.flush()
+                # El mapa anterior no se cierra: otros hilos pueden estar leyéndolo
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+
+    def close(self):
+        """Cierra el mapa y el archivo (los documentos del almacén dejan de poder leerse)"""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+
+    def __repr__(self):
+        where = self.path or "memoria"
+        return f"TextStore({where}, {self._size} bytes)"
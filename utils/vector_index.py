@@ -0,0 +1,712 @@
+"""
+Índices vectoriales en memoria para búsqueda por similaridad coseno
+
+- FlatIndex: búsqueda exacta (fuerza bruta), un producto matriz-vector por query
+- IVFIndex: búsqueda aproximada con listas invertidas sobre centroides k-means
+- QuantizedIndex: vectores en float16, int8 o binario con re-puntuación de una lista corta
+
+Todos implementan la interfaz VectorIndex: se pueden guardar/cargar con
+save() / load_index() y actualizar sin reconstruirlos con add() / remove()
+(las filas borradas quedan como lápidas hasta compact()).
+"""
+import os
+import tempfile
+import weakref
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+
+from .log import get_logger
+
+
+logger = get_logger("vector_index")
+
+
+def top_n_indices(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Devuelve los índices de los top_n scores más altos, ordenados de mayor a menor
+
+    Usa selección parcial (argpartition, O(n)) y solo ordena los top_n elegidos.
+    Con un array 2D opera fila a fila (una fila por query).
+
+    Args:
+        scores: Array 1D de scores, o 2D (queries × documentos)
+        top_n: Número de índices a devolver
+
+    Returns:
+        Array de índices (1D, o 2D con una fila por query)
+    """
+    n = scores.shape[-1]
+    top_n = min(top_n, n)
+    if top_n <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if top_n < n:
+        candidates = np.argpartition(scores, n - top_n, axis=-1)[..., n - top_n:]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=-1), axis=-1)[..., ::-1]
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Convierte a float32 contiguo y normaliza cada fila a norma 1
+
+    Las filas con norma 0 se dejan en cero.
+    """
+    vectors = np.array(vectors, dtype=np.float32, order='C', ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class VectorIndex:
+    """
+    Interfaz común de los índices vectoriales
+
+    Las subclases guardan vectores normalizados y devuelven (índices, scores)
+    donde los índices son las filas de la matriz original de embeddings.
+    """
+
+    kind = "base"
+    # Lápidas: máscara de filas borradas (None = ninguna)
+    deleted: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def live_count(self) -> int:
+        """Filas no borradas"""
+        return len(self) - (int(self.deleted.sum()) if self.deleted is not None else 0)
+
+    @property
+    def dim(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria ocupada por los arrays del índice"""
+        return sum(array.nbytes for array in self._state().values())
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Similaridad de la query con todas las filas, en el orden original"""
+        raise NotImplementedError
+
+    def search(self, query_embedding: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca los top_n vectores más similares a una query"""
+        raise NotImplementedError
+
+    def search_many(self, query_embeddings: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca varias queries; por defecto una a una
+
+        Returns:
+            Tupla (índices, scores), ambos de forma (n_queries × top_n); cuando una
+            query devuelve menos filas (listas IVF pequeñas, lápidas), el resto se
+            rellena con índice -1 y score -inf
+        """
+        queries = normalize_rows(query_embeddings)
+        indices = np.full((queries.shape[0], top_n), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], top_n), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            found, found_scores = self.search(query, top_n)
+            indices[i, :len(found)] = found[:top_n]
+            scores[i, :len(found)] = found_scores[:top_n]
+        return indices, scores
+
+    def add(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Añade vectores al final del índice sin reconstruirlo
+
+        Returns:
+            Filas asignadas a los nuevos vectores
+        """
+        vectors = normalize_rows(embeddings)
+        start = len(self)
+        self._append(vectors)
+        if self.deleted is not None:
+            self.deleted = np.concatenate([self.deleted, np.zeros(vectors.shape[0], dtype=bool)])
+        return np.arange(start, start + vectors.shape[0])
+
+    def remove(self, ids: np.ndarray):
+        """
+        Marca filas como borradas (lápidas): dejan de aparecer en las búsquedas
+        pero siguen ocupando memoria hasta compact()
+        """
+        if self.deleted is None:
+            self.deleted = np.zeros(len(self), dtype=bool)
+        self.deleted[np.asarray(ids, dtype=np.int64)] = True
+
+    def compact(self) -> np.ndarray:
+        """
+        Elimina físicamente las filas borradas y renumera las restantes
+
+        Returns:
+            Filas antiguas que se conservan, en su nuevo orden (la fila nueva i es keep[i])
+        """
+        if self.deleted is None or not self.deleted.any():
+            self.deleted = None
+            return np.arange(len(self))
+        keep = np.flatnonzero(~self.deleted)
+        self._compact(keep)
+        self.deleted = None
+        return keep
+
+    def _append(self, vectors: np.ndarray):
+        raise NotImplementedError
+
+    def _compact(self, keep: np.ndarray):
+        raise NotImplementedError
+
+    def _mask_deleted(self, scores: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Pone a -inf los scores de las filas borradas (ids = fila de cada score)"""
+        if self.deleted is not None:
+            dead = self.deleted if ids is None else self.deleted[ids]
+            scores[..., dead] = -np.inf
+        return scores
+
+    @staticmethod
+    def _drop_masked(indices: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Quita de un resultado 1D las filas con score -inf (borradas)"""
+        alive = np.isfinite(scores)
+        if alive.all():
+            return indices, scores
+        return indices[alive], scores[alive]
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        """Arrays que describen el índice (para serializar)"""
+        raise NotImplementedError
+
+    @classmethod
+    def _from_state(cls, state: Dict[str, np.ndarray]) -> "VectorIndex":
+        raise NotImplementedError
+
+    def save(self, path: str):
+        """
+        Guarda el índice en un archivo .npz (sin pickle), lápidas incluidas
+        """
+        extra = {'deleted': self.deleted} if self.deleted is not None else {}
+        np.savez(path, kind=np.array(self.kind), **self._state(), **extra)
+
+
+class FlatIndex(VectorIndex):
+    """
+    Búsqueda exacta (fuerza bruta) sobre vectores normalizados una sola vez
+
+    Los vectores se guardan como float32 contiguos y ya normalizados, así que
+    la similaridad coseno de una query es un único producto matriz-vector.
+    """
+
+    kind = "flat"
+
+    def __init__(self, embeddings: np.ndarray):
+        """
+        Args:
+            embeddings: Matriz (n_documentos × dimensiones) de embeddings
+        """
+        self.vectors = normalize_rows(embeddings)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Similaridad coseno entre la query y todos los vectores del índice
+        """
+        query = normalize_rows(query_embedding)[0]
+        return self.vectors @ query
+
+    def search(self, query_embedding: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los top_n vectores más similares a la query
+
+        Returns:
+            Tupla (índices, scores) ordenada de mayor a menor similaridad
+        """
+        scores = self._mask_deleted(self.scores(query_embedding))
+        indices = top_n_indices(scores, top_n)
+        return self._drop_masked(indices, scores[indices])
+
+    def search_many(self, query_embeddings: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca varias queries a la vez con un único producto matriz-matriz
+
+        Args:
+            query_embeddings: Matriz (n_queries × dimensiones)
+
+        Returns:
+            Tupla (índices, scores), ambos de forma (n_queries × top_n); si quedan menos
+            filas vivas que top_n, las sobrantes vienen con índice -1 y score -inf
+        """
+        queries = normalize_rows(query_embeddings)
+        all_scores = self._mask_deleted(queries @ self.vectors.T)
+        found = top_n_indices(all_scores, top_n)
+        indices = np.full((queries.shape[0], top_n), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], top_n), -np.inf, dtype=np.float32)
+        indices[:, :found.shape[1]] = found
+        scores[:, :found.shape[1]] = np.take_along_axis(all_scores, found, axis=-1)
+        indices[~np.isfinite(scores)] = -1
+        return indices, scores
+
+    def _append(self, vectors: np.ndarray):
+        self.vectors = np.concatenate([self.vectors, vectors])
+
+    def _compact(self, keep: np.ndarray):
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {'vectors': self.vectors}
+
+    @classmethod
+    def _from_state(cls, state: Dict[str, np.ndarray]) -> "FlatIndex":
+        index = cls.__new__(cls)
+        index.vectors = np.ascontiguousarray(state['vectors'], dtype=np.float32)
+        return index
+
+
+class IVFIndex(VectorIndex):
+    """
+    Índice aproximado IVF (inverted file) en NumPy puro
+
+    Agrupa los vectores en nlist listas con k-means esférico. Cada query solo
+    compara contra los centroides y contra los vectores de las nprobe listas
+    más cercanas, así que el coste por query es ~ nlist + n·nprobe/nlist
+    productos punto en lugar de n.
+
+    Los vectores se guardan contiguos y ordenados por lista, de modo que cada
+    lista es una vista (sin copias) de la matriz.
+
+    Parámetros de recall/velocidad:
+        nlist: Más listas → listas más cortas (más rápido) pero más riesgo de fallar vecinos
+        nprobe: Más listas visitadas → más recall y más coste (nprobe = nlist equivale a exacto)
+    """
+
+    kind = "ivf"
+
+    def __init__(self, embeddings: np.ndarray, nlist: int = None, nprobe: int = 8,
+                 n_iter: int = 10, train_size: int = None, seed: int = 0):
+        """
+        Args:
+            embeddings: Matriz (n_documentos × dimensiones) de embeddings
+            nlist: Número de listas/centroides (por defecto ~4·√n)
+            nprobe: Listas visitadas por query
+            n_iter: Iteraciones de k-means
+            train_size: Vectores usados para entrenar k-means (por defecto 64 por lista)
+            seed: Semilla para la inicialización de k-means
+        """
+        vectors = normalize_rows(embeddings)
+        n = vectors.shape[0]
+        if nlist is None:
+            nlist = int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        self.nprobe = nprobe
+
+        rng = np.random.default_rng(seed)
+        train_size = min(n, train_size or nlist * 64)
+        train = vectors[rng.choice(n, size=train_size, replace=False)] if train_size < n else vectors
+        self.centroids = _spherical_kmeans(train, nlist, n_iter, rng)
+
+        assignments = _assign(vectors, self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.ids = order.astype(np.int64)
+        counts = np.bincount(assignments, minlength=nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Similaridad exacta con todas las filas, en el orden original (para análisis)
+        """
+        query = normalize_rows(query_embedding)[0]
+        scores = np.empty(len(self), dtype=np.float32)
+        scores[self.ids] = self.vectors @ query
+        return scores
+
+    def search(self, query_embedding: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los top_n vectores más similares visitando las nprobe listas más cercanas
+
+        Returns:
+            Tupla (índices, scores) ordenada de mayor a menor similaridad
+        """
+        query = normalize_rows(query_embedding)[0]
+        probes = top_n_indices(self.centroids @ query, self.nprobe)
+
+        ids, scores = [], []
+        for list_id in probes:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            scores.append(self.vectors[start:end] @ query)
+            ids.append(self.ids[start:end])
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        ids = np.concatenate(ids)
+        scores = self._mask_deleted(np.concatenate(scores), ids)
+        best = top_n_indices(scores, top_n)
+        return self._drop_masked(ids[best], scores[best])
+
+    def _append(self, vectors: np.ndarray):
+        """Inserta cada vector al final de la lista de su centroide más cercano (sin re-entrenar)"""
+        assignments = _assign(vectors, self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        positions = self.offsets[assignments[order] + 1]
+        new_ids = len(self) + order
+        self.vectors = np.insert(self.vectors, positions, vectors[order], axis=0)
+        self.ids = np.insert(self.ids, positions, new_ids)
+        self.offsets[1:] += np.cumsum(np.bincount(assignments, minlength=self.nlist))
+
+    def _compact(self, keep: np.ndarray):
+        list_of_row = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+        alive = ~self.deleted[self.ids]
+        renumber = np.full(len(self), -1, dtype=np.int64)
+        renumber[keep] = np.arange(len(keep))
+        self.vectors = np.ascontiguousarray(self.vectors[alive])
+        self.ids = renumber[self.ids[alive]]
+        counts = np.bincount(list_of_row[alive], minlength=self.nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {
+            'vectors': self.vectors,
+            'ids': self.ids,
+            'offsets': self.offsets,
+            'centroids': self.centroids,
+            'nprobe': np.array(self.nprobe),
+        }
+
+    @classmethod
+    def _from_state(cls, state: Dict[str, np.ndarray]) -> "IVFIndex":
+        index = cls.__new__(cls)
+        index.vectors = np.ascontiguousarray(state['vectors'], dtype=np.float32)
+        index.ids = state['ids']
+        index.offsets = state['offsets']
+        index.centroids = np.ascontiguousarray(state['centroids'], dtype=np.float32)
+        index.nprobe = int(state['nprobe'])
+        return index
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Búsqueda en dos fases sobre vectores de precisión reducida
+
+    1. Recorrido rápido de todo el corpus con los códigos compactos:
+       - "float16": 2 bytes por dimensión (2x menos memoria)
+       - "int8": 1 byte por dimensión con escala por dimensión (4x menos)
+       - "binary": 1 bit por dimensión (signo) y distancia de Hamming (32x menos)
+    2. Re-puntuación de una lista corta (top_n × rescore_factor) a precisión completa,
+       contra los vectores float32 guardados en disco (memmap: solo se leen las filas
+       de la lista corta). Van a rescore_path o, sin él, a un archivo temporal que se
+       borra con el índice. Con rescore=False no se guardan y se re-puntúa con la query
+       en float32 contra los códigos (asimétrico): en float16/int8 eso apenas reordena
+       la primera fase, así que el recall es el de los códigos.
+
+    La escala int8 se fija al construir el índice: los vectores añadidos después
+    con add() se recortan a esa escala. save() guarda la ruta de los vectores, no
+    los vectores: solo se puede guardar un índice creado con rescore_path.
+    """
+
+    kind = "quantized"
+    PRECISIONS = ("float16", "int8", "binary")
+    # Cuanto más burdo el primer recorrido, más larga la lista corta para no perder recall
+    DEFAULT_RESCORE_FACTOR = {"float16": 2, "int8": 4, "binary": 10}
+
+    def __init__(self, embeddings: np.ndarray, precision: str = "int8", rescore_factor: Optional[int] = None,
+                 rescore_path: Optional[str] = None, rescore: bool = True, block_size: int = 2048):
+        """
+        Args:
+            embeddings: Matriz (n_documentos × dimensiones) de embeddings
+            precision: "float16", "int8" o "binary"
+            rescore_factor: Tamaño de la lista corta como múltiplo de top_n
+                (None = valor por defecto de la precisión)
+            rescore_path: Archivo donde guardar los vectores float32 (en bruto) para re-puntuar
+                (None usa un archivo temporal)
+            rescore: Si False no se guardan los vectores float32 y la lista corta se
+                re-puntúa con los propios códigos
+            block_size: Filas por bloque al recorrer los códigos (bloques pequeños caben en caché)
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Precisión desconocida: {precision} (opciones: {', '.join(self.PRECISIONS)})")
+        vectors = normalize_rows(embeddings)
+        self.precision = precision
+        self.rescore_factor = rescore_factor or self.DEFAULT_RESCORE_FACTOR[precision]
+        self.block_size = block_size
+        self._dim = vectors.shape[1]
+        self.scale = np.ones(self._dim, dtype=np.float32)
+
+        if precision == "int8":
+            # Escala simétrica por dimensión: el máximo absoluto de cada dimensión va a 127
+            max_abs = np.abs(vectors).max(axis=0)
+            max_abs[max_abs == 0] = 1.0
+            self.scale = (max_abs / 127.0).astype(np.float32)
+        self.codes = self._encode(vectors)
+
+        self.rescore_path = rescore_path
+        self.rescore_vectors: Optional[np.ndarray] = None
+        self._temporary_rescore = rescore and rescore_path is None
+        if self._temporary_rescore:
+            fd, self.rescore_path = tempfile.mkstemp(prefix="rescore_", suffix=".f32")
+            os.close(fd)
+            weakref.finalize(self, _remove_file, self.rescore_path)
+        if self.rescore_path is not None:
+            vectors.tofile(self.rescore_path)
+            self._open_rescore()
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Códigos compactos de vectores normalizados"""
+        if self.precision == "float16":
+            return vectors.astype(np.float16)
+        if self.precision == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(vectors > 0, axis=1)
+
+    def _open_rescore(self):
+        """(Re)abre en modo lectura el memmap de vectores float32 para re-puntuar"""
+        self.rescore_vectors = np.memmap(self.rescore_path, dtype=np.float32, mode='r',
+                                         shape=(len(self), self._dim))
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _approx_scores(self, query: np.ndarray) -> np.ndarray:
+        """Primera fase: score aproximado de todas las filas a partir de los códigos"""
+        if self.precision == "binary":
+            query_bits = np.packbits(query > 0)
+            # Menos bits distintos = más parecido; se devuelve como score (mayor es mejor)
+            return self._dim - 2.0 * _hamming(self.codes, query_bits, self.block_size)
+        weights = (query * self.scale).astype(np.float32)
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            block = self.codes[start:start + self.block_size]
+            scores[start:start + self.block_size] = block.astype(np.float32) @ weights
+        return scores
+
+    def _rescore(self, query: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Segunda fase: score preciso de las filas de la lista corta"""
+        if self.rescore_vectors is not None:
+            return np.asarray(self.rescore_vectors[ids], dtype=np.float32) @ query
+        codes = self.codes[ids]
+        if self.precision == "binary":
+            # Query float contra bits ±1: mucho más fino que Hamming
+            signs = np.unpackbits(codes, axis=1, count=self._dim).astype(np.float32) * 2.0 - 1.0
+            return signs @ query / np.sqrt(self._dim)
+        return codes.astype(np.float32) @ (query * self.scale)
+
+    def scores(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Similaridad de la query con todas las filas según los códigos (para análisis)
+        """
+        query = normalize_rows(query_embedding)[0]
+        return self._rescore(query, np.arange(len(self)))
+
+    def search(self, query_embedding: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Recorre los códigos, toma top_n × rescore_factor candidatos y los re-puntúa
+
+        Returns:
+            Tupla (índices, scores) ordenada de mayor a menor similaridad
+        """
+        query = normalize_rows(query_embedding)[0]
+        approx = self._mask_deleted(self._approx_scores(query))
+        shortlist = top_n_indices(approx, top_n * self.rescore_factor)
+        scores = self._mask_deleted(self._rescore(query, shortlist), shortlist)
+        best = top_n_indices(scores, top_n)
+        return self._drop_masked(shortlist[best], scores[best])
+
+    def _append(self, vectors: np.ndarray):
+        self.codes = np.concatenate([self.codes, self._encode(vectors)])
+        if self.rescore_path is not None:
+            with open(self.rescore_path, 'ab') as f:
+                vectors.tofile(f)
+            self._open_rescore()
+
+    def _compact(self, keep: np.ndarray):
+        self.codes = np.ascontiguousarray(self.codes[keep])
+        if self.rescore_path is not None:
+            # Reescribe el archivo por bloques para no cargarlo entero en memoria
+            old, self.rescore_vectors = self.rescore_vectors, None
+            tmp_path = self.rescore_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(keep), self.block_size):
+                    np.asarray(old[keep[start:start + self.block_size]], dtype=np.float32).tofile(f)
+            del old
+            os.replace(tmp_path, self.rescore_path)
+            self._open_rescore()
+
+    def save(self, path: str):
+        """
+        Guarda el índice; los vectores float32 se quedan en rescore_path
+
+        Raises:
+            ValueError: Si los vectores están en un archivo temporal (se borra con el índice)
+        """
+        if self._temporary_rescore:
+            raise ValueError("Los vectores para re-puntuar están en un archivo temporal: "
+                             "crea el índice con rescore_path para poder guardarlo")
+        super().save(path)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria residente: códigos y escala (los vectores en disco no cuentan)"""
+        return self.codes.nbytes + self.scale.nbytes
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {
+            'codes': self.codes,
+            'scale': self.scale,
+            'dim': np.array(self._dim),
+            'precision': np.array(self.precision),
+            'rescore_factor': np.array(self.rescore_factor),
+            'rescore_path': np.array(self.rescore_path or ""),
+        }
+
+    @classmethod
+    def _from_state(cls, state: Dict[str, np.ndarray]) -> "QuantizedIndex":
+        index = cls.__new__(cls)
+        index.codes = state['codes']
+        index.scale = state['scale']
+        index._dim = int(state['dim'])
+        index.precision = str(state['precision'])
+        index.rescore_factor = int(state['rescore_factor'])
+        index.block_size = 2048
+        index.rescore_path = str(state['rescore_path']) or None
+        index.rescore_vectors = None
+        index._temporary_rescore = False
+        if index.rescore_path:
+            if os.path.exists(index.rescore_path):
+                index._open_rescore()
+            else:
+                logger.warning("⚠️ No existe %s: el índice %s se re-puntuará con sus códigos, con menos recall",
+                               index.rescore_path, index.precision)
+        return index
+
+
+def _remove_file(path: str):
+    """Borra el archivo temporal de un índice (si sigue abierto en otro proceso, se deja)"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _hamming(codes: np.ndarray, query_bits: np.ndarray, block_size: int) -> np.ndarray:
+    """Distancia de Hamming entre cada fila de bits empaquetados y la query"""
+    distances = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], block_size):
+        xor = np.bitwise_xor(codes[start:start + block_size], query_bits)
+        if hasattr(np, 'bitwise_count'):
+            distances[start:start + block_size] = np.bitwise_count(xor).sum(axis=1, dtype=np.int32)
+        else:
+            distances[start:start + block_size] = _POPCOUNT[xor].sum(axis=1, dtype=np.int32)
+    return distances
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    """Centroide más cercano de cada vector (por bloques para acotar memoria)"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], block):
+        assignments[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return assignments
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    k-means sobre la esfera unidad (centroides normalizados, similaridad coseno)
+    """
+    centroids = vectors[rng.choice(vectors.shape[0], size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        # Suma por lista con los vectores ordenados por asignación (reduceat, sin bucles)
+        order = np.argsort(assignments, kind='stable')
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[nonempty]
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts, axis=0)
+        # Las listas vacías se re-siembran con vectores al azar
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+INDEX_TYPES: Dict[str, Type[VectorIndex]] = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+    QuantizedIndex.kind: QuantizedIndex,
+}
+
+
+def create_index(kind: str, embeddings: np.ndarray, **params) -> VectorIndex:
+    """
+    Construye un índice del tipo indicado ("flat", "ivf" o "quantized")
+
+    Args:
+        kind: Tipo de índice
+        embeddings: Matriz de embeddings
+        **params: Parámetros propios del tipo (p. ej. nlist, nprobe para "ivf")
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {kind} (opciones: {', '.join(INDEX_TYPES)})")
+    return INDEX_TYPES[kind](embeddings, **params)
+
+
+def load_index(path: str) -> VectorIndex:
+    """
+    Carga un índice guardado con VectorIndex.save()
+    """
+    with np.load(path, allow_pickle=False) as data:
+        state = {key: data[key] for key in data.files}
+    kind = str(state.pop('kind'))
+    deleted = state.pop('deleted', None)
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido en {path}: {kind}")
+    index = INDEX_TYPES[kind]._from_state(state)
+    index.deleted = deleted
+    return index
+
+
+def recall_at_k(index: VectorIndex, reference: VectorIndex, queries: np.ndarray, k: int = 10) -> float:
+    """
+    Fracción de los k vecinos exactos (según reference) que index también devuelve
+
+    Args:
+        index: Índice a evaluar
+        reference: Índice exacto de referencia (p. ej. FlatIndex)
+        queries: Matriz de queries de prueba
+        k: Número de vecinos
+    """
+    expected, _ = reference.search_many(queries, k)
+    found = total = 0
+    for query, exact in zip(normalize_rows(queries), expected):
+        exact = exact[exact >= 0]
+        approx, _ = index.search(query, k)
+        found += len(np.intersect1d(approx, exact))
+        total += len(exact)
+    return found / total if total else 1.0
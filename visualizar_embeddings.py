@@ -6,6 +6,7 @@ Este script muestra cómo funcionan los embeddings y la similaridad semántica
 import os
 from dotenv import load_dotenv
 from rag_system import LegalRAGSystem
+from utils.log import configure_logging
 import numpy as np
 
 
@@ -46,17 +47,17 @@ def visualizar_similaridades():
         print(f"QUERY #{query_idx}: {query}")
         print(f"{'─' * 70}")
         
-        # Generar embedding de la query
-        query_response = rag.client.embed(
-            texts=[query],
-            model=rag.embed_model,
-            input_type="search_query",
-            embedding_types=["float"]
-        )
-        query_embedding = np.array(query_response.embeddings.float[0])
+        # Generar embedding de la query (con caché de queries del sistema)
+        query_embedding = rag._embed_query(query)
         
-        # Calcular similaridades con todos los documentos
-        similarities = rag._cosine_similarity(query_embedding, rag.document_embeddings)
+        # Calcular similaridades con todos los chunks (índice ya normalizado)
+        chunk_similarities = rag.index.scores(query_embedding)
+        
+        # Similaridad de cada documento = la de su chunk más parecido
+        # (los chunks de documentos eliminados tienen doc_id -1 y se ignoran)
+        similarities = np.full(len(rag.documents), -1.0)
+        alive = rag.chunk_doc_ids >= 0
+        np.maximum.at(similarities, rag.chunk_doc_ids[alive], chunk_similarities[alive])
         
         # Ordenar por similaridad
         sorted_indices = np.argsort(similarities)[::-1]
@@ -95,6 +96,10 @@ def visualizar_similaridades():
         
         print(f"\n  💡 {conclusion}")
 
+    stats = rag.query_cache.stats()
+    print(f"\n📦 Caché de queries: {stats['hits']} aciertos, {stats['misses']} fallos "
+          f"(tasa de aciertos {stats['hit_rate']:.0%})")
+
 
 def comparar_queries_similares():
     """
@@ -129,16 +134,8 @@ def comparar_queries_similares():
         print(f"  Query A: {query1}")
         print(f"  Query B: {query2}")
         
-        # Generar embeddings
-        response = rag.client.embed(
-            texts=[query1, query2],
-            model=rag.embed_model,
-            input_type="search_query",
-            embedding_types=["float"]
-        )
-        
-        emb1 = np.array(response.embeddings.float[0])
-        emb2 = np.array(response.embeddings.float[1])
+        # Generar embeddings: una sola llamada a embed para las queries que no estén en caché
+        emb1, emb2 = rag._embed_queries([query1, query2])
         
         # Calcular similaridad entre las queries
         # Normalizar
@@ -155,11 +152,11 @@ def comparar_queries_similares():
         print(f"\n  Similaridad: {bar} {similarity:.4f}")
         
         if similarity > 0.9:
-            print(f"  💚 Prácticamente idénticas semánticamente")
+            print("  💚 Prácticamente idénticas semánticamente")
         elif similarity > 0.7:
-            print(f"  💛 Muy similares (mismo tema)")
+            print("  💛 Muy similares (mismo tema)")
         else:
-            print(f"  🧡 Relacionadas pero diferentes enfoques")
+            print("  🧡 Relacionadas pero diferentes enfoques")
         
         print()
 
@@ -178,14 +175,7 @@ def mostrar_dimensiones_embedding():
     rag = LegalRAGSystem(api_key=api_key)
     
     # Generar embedding de ejemplo
-    response = rag.client.embed(
-        texts=["Ejemplo de texto"],
-        model=rag.embed_model,
-        input_type="search_query",
-        embedding_types=["float"]
-    )
-    
-    embedding = np.array(response.embeddings.float[0])
+    embedding = rag._embed_query("Ejemplo de texto")
     
     print(f"\n📊 Modelo: {rag.embed_model}")
     print(f"📏 Dimensiones: {len(embedding)}")
@@ -236,4 +226,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure_logging()
     main()